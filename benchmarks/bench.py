@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Offline benchmarks of msad on a synthetic directory (ldap3 MOCK_SYNC)
+
+    python benchmarks/bench.py --users 10000 --groups 500 --depth 8 --output bench.json
+    python benchmarks/bench.py --compare bench.json   # fails on regressions
+
+For every benchmark it reports wall time, peak memory (tracemalloc) and the
+LDAP operations sent. The mock strategy does not implement extensible
+matches (LDAP_MATCHING_RULE_IN_CHAIN, bitwise rules), so the functions
+relying on them are measured through their graph or memberOf variants.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import ldap3
+
+import msad
+import msad.cache
+import msad.graph
+import msad.main
+import msad.output
+import msad.snapshot
+
+from typer.testing import CliRunner
+
+BASE = "dc=example,dc=com"
+ADMIN = f"cn=admin,{BASE}"
+
+
+def build_directory(users: int, groups: int, depth: int, groups_per_user: int = 3, seed: int = 42):
+    """A mock server with users, and groups nested in chains of depth groups"""
+    server = ldap3.Server("bench", get_info=ldap3.OFFLINE_AD_2012_R2)
+    conn = ldap3.Connection(server, user=ADMIN, password="secret", client_strategy=ldap3.MOCK_SYNC)
+    add = conn.strategy.add_entry
+    add(ADMIN, {"userPassword": "secret", "sAMAccountName": "admin"})
+    add(BASE, {"objectClass": ["top", "domain"]})
+    for ou in ["users", "groups"]:
+        add(f"ou={ou},{BASE}", {"objectClass": ["top", "organizationalUnit"], "ou": ou})
+
+    rnd = random.Random(seed)
+    group_dns = [f"cn=group{g},ou=groups,{BASE}" for g in range(groups)]
+    members = {dn: [] for dn in group_dns}
+    member_of = {}
+    # group g contains group g+1 inside each chain of depth groups
+    for g in range(groups - 1):
+        if (g + 1) % depth:
+            members[group_dns[g]].append(group_dns[g + 1])
+            member_of.setdefault(group_dns[g + 1], []).append(group_dns[g])
+    user_dns = []
+    for u in range(users):
+        dn = f"cn=user{u},ou=users,{BASE}"
+        user_dns.append(dn)
+        for group_dn in rnd.sample(group_dns, min(groups_per_user, groups)):
+            members[group_dn].append(dn)
+            member_of.setdefault(dn, []).append(group_dn)
+
+    for u, dn in enumerate(user_dns):
+        add(dn, {
+            "objectClass": ["top", "person", "organizationalPerson", "user"],
+            # AD expands (objectCategory=person) to the class DN, the mock does not
+            "objectCategory": "person",
+            "distinguishedName": dn,
+            "sAMAccountName": f"user{u}",
+            "cn": f"user{u}",
+            "mail": f"user{u}@example.com",
+            "userPrincipalName": f"user{u}@example.com",
+            "userAccountControl": 514 if u % 10 == 0 else 512,
+            "pwdLastSet": 133000000000000000,
+            "lockoutTime": 0,
+            "memberOf": member_of.get(dn, []),
+        })
+    for g, dn in enumerate(group_dns):
+        add(dn, {
+            "objectClass": ["top", "group"],
+            "distinguishedName": dn,
+            "sAMAccountName": f"group{g}",
+            "cn": f"group{g}",
+            "groupType": -2147483646,
+            "member": members[dn],
+            "memberOf": member_of.get(dn, []),
+        })
+    return server
+
+
+def connect(server):
+    conn = ldap3.Connection(server, user=ADMIN, password="secret",
+                            client_strategy=ldap3.MOCK_SYNC, collect_usage=True)
+    conn.bind()
+    return conn
+
+
+def _consume(result):
+    if result is None:
+        return 0
+    if isinstance(result, (bool, str, dict)):
+        return 1
+    return sum(1 for _ in result)
+
+
+def measure(name, function, connections):
+    """Run function() and return its wall time, peak memory and LDAP operations"""
+    msad.cache.set_dn_cache(msad.cache.Cache())
+    for conn in connections:
+        conn.usage.reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+    entries = _consume(function())
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    operations = {"bind": 0, "search": 0, "modify": 0}
+    for conn in connections:
+        operations["bind"] += conn.usage.bind_operations
+        operations["search"] += conn.usage.search_operations
+        operations["modify"] += conn.usage.modify_operations
+    result = {
+        "wall_s": round(wall, 4),
+        "peak_mb": round(peak / 2**20, 3),
+        "entries": entries,
+        "operations": operations,
+    }
+    print(f"{name:32} {wall:9.3f}s {peak / 2**20:9.2f}MB {entries:8} entries {operations}", file=sys.stderr)
+    return result
+
+
+def benchmarks(server, args):
+    conn = connect(server)
+    connections = [conn]
+    sample = [f"user{i}" for i in range(0, args.users, max(1, args.users // args.sample))][: args.sample]
+    attributes = ["sAMAccountName", "mail", "memberOf", "userAccountControl"]
+    records = msad.search(conn, BASE, "(objectClass=user)", attributes=attributes)
+    graph = msad.graph.GroupGraph.load(conn, BASE)
+    top_group = "group0"
+    snapshot_dir = tempfile.mkdtemp()
+    snapshot_path = os.path.join(snapshot_dir, "snapshot.sqlite")
+    msad.snapshot.create_snapshot(conn, BASE, snapshot_path)
+
+    def _cli(*argv):
+        def _run():
+            runner = CliRunner()
+            result = runner.invoke(msad.main.app, ["--no-cache", "--no-daemon", *argv])
+            if result.exit_code:
+                raise RuntimeError(f"msad {' '.join(argv)} failed: {result.output}")
+            return result.output.splitlines()
+        return _run
+
+    def _write(out_format):
+        def _run():
+            stream = io.StringIO()
+            msad.output.write_records(records, out_format, stream=stream, fields=attributes)
+            return stream.getvalue().splitlines()
+        return _run
+
+    def _snapshot_queries():
+        snapshot = msad.snapshot.Snapshot(snapshot_path)
+        for user in sample:
+            yield from msad.users(snapshot, BASE, user, 0, attributes=["mail"])
+
+    suite = {
+        "search.search": lambda: msad.search(conn, BASE, "(objectClass=user)", attributes=attributes),
+        "search.iter_search": lambda: msad.iter_search(conn, BASE, "(objectClass=user)", attributes=attributes),
+        "search.users": lambda: (e for user in sample for e in msad.users(conn, BASE, user, 0, attributes=["mail"])),
+        "search.get_dn": lambda: [msad.get_dn(conn, BASE, user) for user in sample],
+        "output.ndjson": _write("json"),
+        "output.csv": _write("csv"),
+        "graph.load": lambda: msad.graph.GroupGraph.load(conn, BASE).dns,
+        "graph.effective_groups": lambda: graph.effective_groups(),
+        "group.group_flat_members.graph": lambda: msad.group_flat_members(conn, BASE, 0, top_group, attributes=["cn"], graph=graph),
+        # the ldap3 mock answers ranged retrieval (member;range=0-*) with no values:
+        # group_members and user_groups(nested=False) measure the searches only
+        "group.group_members": lambda: msad.group_members(conn, BASE, top_group),
+        "group.sync_members.dry_run": lambda: [msad.group.sync_members(conn, BASE, top_group, sample, dry_run=True)],
+        "user.user_groups": lambda: (g for user in sample for g in msad.user.user_groups(conn, BASE, 0, user, nested=False)),
+        "user.user_groups.graph": lambda: (g for user in sample for g in msad.user.user_groups(conn, BASE, 0, user, graph=graph)),
+        "user.check_users": lambda: msad.user.check_users(conn, BASE, sample, 90),
+        "user.audit_users": lambda: msad.user.audit_users(conn, BASE),
+        "snapshot.create": lambda: [msad.snapshot.create_snapshot(conn, BASE, os.path.join(snapshot_dir, "new.sqlite"))],
+        "snapshot.users": _snapshot_queries,
+        "cli.search": _cli("search", "(objectClass=user)", "--attributes", "sAMAccountName", "--limit", "0"),
+        "cli.search.csv": _cli("search", "(objectClass=user)", "--attributes", "sAMAccountName", "--attributes", "mail", "--out-format", "csv", "--limit", "0"),
+        "cli.user-groups.graph": _cli("user-groups", sample[0], "--nested", "--graph"),
+        "cli.group-members": _cli("group-members", top_group),
+    }
+
+    # the CLI commands run on new connections to the same mock server
+    def _new_connection(config):
+        cli_conn = connect(server)
+        connections.append(cli_conn)
+        return cli_conn
+
+    msad.main._get_config = lambda domain, config_file: {
+        "domain": "bench", "host": "bench", "port": 389, "use_ssl": False, "search_base": BASE}
+    msad.main._new_connection = _new_connection
+
+    results = {}
+    for name, function in suite.items():
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        try:
+            results[name] = measure(name, function, connections)
+        except Exception as error:
+            print(f"{name:32} failed: {error}", file=sys.stderr)
+            results[name] = {"error": str(error)}
+        del connections[1:]
+    return results
+
+
+def compare(results: dict, baseline_file: str, tolerance: float) -> int:
+    """Print the changes from a baseline, returning the number of regressions"""
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = 0
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old or "error" in old or "error" in result:
+            continue
+        for metric in ["wall_s", "peak_mb"]:
+            if old[metric] > 0 and result[metric] > old[metric] * (1 + tolerance):
+                regressions += 1
+                print(f"REGRESSION {name} {metric}: {old[metric]} -> {result[metric]}", file=sys.stderr)
+        for operation, count in result["operations"].items():
+            if count > old["operations"].get(operation, 0):
+                regressions += 1
+                print(f"REGRESSION {name} {operation} operations: {old['operations'].get(operation, 0)} -> {count}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="msad benchmarks on a synthetic mock directory")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=8, help="nesting depth of the groups")
+    parser.add_argument("--groups-per-user", type=int, default=3)
+    parser.add_argument("--sample", type=int, default=20, help="users used by the per user benchmarks")
+    parser.add_argument("--only", action="append", help="run only the benchmarks containing this text")
+    parser.add_argument("--output", help="save the results to this json file")
+    parser.add_argument("--compare", help="compare with the results saved in this json file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown when comparing")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    server = build_directory(args.users, args.groups, args.depth, args.groups_per_user)
+    print(f"built directory in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    results = benchmarks(server, args)
+    report = {
+        "parameters": {k: v for k, v in vars(args).items() if k not in ["output", "compare"]},
+        "python": platform.python_version(),
+        "ldap3": ldap3.__version__,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
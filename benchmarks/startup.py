@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Startup time of msad, checked against a budget
+
+    python benchmarks/startup.py              # fails if over budget
+    python benchmarks/startup.py --runs 20 --budget-cli 150
+
+Every case runs in a new python process and the best of --runs is
+reported: `import msad` minus the time of an empty interpreter, `msad --help`
+as the whole wall time a user waits for (answered without loading typer,
+whose import time is shown apart). It also checks that `import msad` and
+the CLI commands not talking to AD do not load ldap3.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["ldap3", "ssl", "gssapi", "cryptography"]
+
+CHECK_IMPORTS = f"""
+import sys
+import msad, msad.main
+heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+if heavy:
+    sys.exit("loaded at import time: " + ", ".join(heavy))
+"""
+
+
+def best_time(argv: list, runs: int) -> float:
+    """The best wall time of runs executions of argv"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        run = subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if run.returncode:
+            error = " ".join(line.strip() for line in run.stderr.strip().splitlines()[-3:])
+            sys.exit(f"{' '.join(argv[1:])} failed with exit code {run.returncode}: {error}")
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="msad startup time")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-import", type=float, default=50, help="milliseconds for 'import msad'")
+    parser.add_argument("--budget-cli", type=float, default=100,
+                        help="milliseconds for 'msad --help', wall time")
+    args = parser.parse_args()
+
+    python = sys.executable
+    check = subprocess.run([python, "-c", CHECK_IMPORTS], capture_output=True, text=True)
+    if check.returncode:
+        print(check.stderr.strip(), file=sys.stderr)
+        sys.exit(1)
+
+    empty = best_time([python, "-c", "pass"], args.runs)
+    typer = best_time([python, "-c", "import typer"], args.runs) - empty
+    cases = [
+        ("import msad", [python, "-c", "import msad"], args.budget_import, empty),
+        ("msad --help", [python, "-m", "msad", "--help"], args.budget_cli, 0),
+    ]
+    over = 0
+    print(f"{'python -c pass':28} {empty * 1000:8.1f} ms")
+    for name, argv, budget, baseline in cases:
+        elapsed = (best_time(argv, args.runs) - baseline) * 1000
+        status = "ok" if elapsed <= budget else "OVER BUDGET"
+        over += elapsed > budget
+        print(f"{name:28} {elapsed:8.1f} ms  (budget {budget:.0f} ms) {status}")
+    # msad --help and get-sample-config skip it, the other commands pay it
+    print(f"{'import typer':28} {typer * 1000:8.1f} ms  (not loaded by msad --help)")
+    if over:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,23 @@
-from .main import app
+import sys
+
+
+def main():
+    """The msad command: --help and get-sample-config are answered without loading typer"""
+    args = sys.argv[1:]
+    if args == ["--help"]:
+        from .usage import HELP
+
+        print(HELP, end="")
+        return
+    if args == ["get-sample-config"]:
+        from .usage import SAMPLE_CONFIG
+
+        print(SAMPLE_CONFIG)
+        return
+    from .main import app
 
-if __name__ == "__main__":
     app()
+
+
+if __name__ == "__main__":
+    main()
@@ -20,12 +20,17 @@ import ldap3
 import json
 import argparse
 
+from msad.schema import get_server, refresh
+
 def _get_server(host, port, use_ssl):
-    return ldap3.Server(host, port=port, get_info=ldap3.ALL, use_ssl=use_ssl)
+    # info and schema are loaded from the local cache, see _get_connection
+    return get_server(host, port=port, use_ssl=use_ssl)
 
 def _get_connection(host, port, use_ssl, binddn, bindpwd):
     server = _get_server(host, port, use_ssl)
-    return ldap3.Connection(server, user=binddn, password=bindpwd, auto_bind=True)
+    conn = ldap3.Connection(server, user=binddn, password=bindpwd, auto_bind=True)
+    refresh(conn)
+    return conn
 
 def search(args):
     print(args)
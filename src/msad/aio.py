@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""asyncio API: the msad functions run on a bounded pool of connections
+
+    async with msad.aio.Client(factory, "dc=example,dc=com", size=8) as ad:
+        groups = await ad.user_groups("matteo", timeout=5)
+"""
+
+import asyncio
+import itertools
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import group, user
+from .pool import ConnectionPool
+from .search import get_dn, iter_search, search, users
+
+
+class Client:
+    """Run the msad functions without blocking the event loop
+
+    Up to size calls are in flight at the same time, each on its own
+    connection created by connection_factory(). Cancelled or timed out
+    calls give back their connection as soon as the LDAP operation ends.
+    Up to streams iter_search generators are open at the same time, on
+    connections and threads of their own: the others wait for one of them
+    to end, and the calls are never starved by them
+    """
+
+    def __init__(
+        self,
+        connection_factory,
+        search_base: str,
+        size: int = 8,
+        timeout: float | None = None,
+        streams: int = 2,
+    ):
+        self.search_base = search_base
+        self.timeout = timeout
+        self.pool = ConnectionPool(connection_factory, size=size)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="msad-aio")
+        self.stream_pool = ConnectionPool(connection_factory, size=streams)
+        self._stream_executor = ThreadPoolExecutor(max_workers=streams, thread_name_prefix="msad-aio-stream")
+        self._streams = asyncio.Semaphore(streams)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._stream_executor.shutdown(wait=False, cancel_futures=True)
+        self.pool.close()
+        self.stream_pool.close()
+
+    async def _call(self, function, *args, timeout: float | None = None, **kwargs):
+        def _run():
+            # one thread per pooled connection: a running call never waits for a connection
+            with self.pool.connection() as conn:
+                result = function(conn, self.search_base, *args, **kwargs)
+                # generators must be consumed while the connection is held
+                if result is not None and not isinstance(result, (list, dict, str, bool)):
+                    result = list(result)
+                return result
+
+        future = asyncio.wrap_future(self._executor.submit(_run))
+        return await asyncio.wait_for(future, timeout if timeout is not None else self.timeout)
+
+    async def search(self, search_filter: str, limit: int = 0, attributes=None, timeout=None):
+        return await self._call(search, search_filter, limit=limit, attributes=attributes, timeout=timeout)
+
+    async def iter_search(self, search_filter: str, limit: int = 0, attributes=None, chunk_size: int = 500):
+        """Yield the entries found, fetched in chunks on one connection kept until the end"""
+        async with self._streams:
+            # a stream slot is free: so are a connection and a thread of the stream pool
+            acquiring = self._stream_executor.submit(self.stream_pool.acquire)
+            try:
+                conn = await asyncio.wrap_future(acquiring)
+            except asyncio.CancelledError:
+                acquiring.add_done_callback(
+                    lambda f: f.cancelled() or f.exception() or self.stream_pool.release(f.result())
+                )
+                raise
+            iterator = iter_search(conn, self.search_base, search_filter, limit=limit, attributes=attributes)
+            pending = None
+            try:
+                while True:
+                    pending = self._stream_executor.submit(lambda: list(itertools.islice(iterator, chunk_size)))
+                    chunk = await asyncio.wrap_future(pending)
+                    if not chunk:
+                        return
+                    for entry in chunk:
+                        yield entry
+            finally:
+                if pending is None:
+                    self.stream_pool.release(conn)
+                else:
+                    # wait for the running chunk, if any, before giving back the connection
+                    pending.add_done_callback(lambda _: self.stream_pool.release(conn))
+
+    async def users(self, string: str, limit: int = 0, attributes=None, timeout=None):
+        return await self._call(users, string, limit, attributes=attributes, timeout=timeout)
+
+    async def get_dn(self, entry: str, timeout=None):
+        return await self._call(get_dn, entry, timeout=timeout)
+
+    async def user_groups(self, user_name: str, nested: bool = True, limit: int = 0, timeout=None):
+        return await self._call(user.user_groups, limit, user_name, nested=nested, timeout=timeout)
+
+    async def is_disabled(self, user_name: str, timeout=None):
+        return await self._call(user.is_disabled, user_name, timeout=timeout)
+
+    async def is_locked(self, user_name: str, timeout=None):
+        return await self._call(user.is_locked, user_name, timeout=timeout)
+
+    async def has_never_expires_password(self, user_name: str, timeout=None):
+        return await self._call(user.has_never_expires_password, user_name, timeout=timeout)
+
+    async def group_members(self, group_name: str, timeout=None):
+        return await self._call(group.group_members, group_name, timeout=timeout)
+
+    async def group_flat_members(self, group_name: str, limit: int = 0, attributes=None, timeout=None):
+        return await self._call(group.group_flat_members, limit, group_name, attributes=attributes, timeout=timeout)
+
+    async def group_member(self, group_name: str, user_name: str, timeout=None):
+        return await self._call(group.group_member, group_name, user_name, timeout=timeout)
+
+    async def group_memberships(self, user_name: str, groups: list, timeout=None):
+        return await self._call(group.group_memberships, user_name, groups, timeout=timeout)
+
+    async def add_member(self, group_name: str, user_name: str, timeout=None):
+        return await self._call(group.add_member, group_name, user_name, timeout=timeout)
+
+    async def remove_member(self, group_name: str, user_name: str, timeout=None):
+        return await self._call(group.remove_member, group_name, user_name, timeout=timeout)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import base64
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# writes between two evictions from the sqlite file
+PRUNE_EVERY = 100
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "msad"
+
+
+def create_private(path):
+    """Create a file (if missing) readable by its owner only, e.g. for directory data
+
+    Its directory, if missing, is created for the owner only too
+    """
+    path = Path(path)
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+    os.chmod(path, 0o600)
+
+
+# key of the objects encoding the values json has no type for
+TAG = "__msad__"
+
+
+def _tag(value):
+    if isinstance(value, bytes):
+        return {TAG: "bytes", "value": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, datetime):
+        return {TAG: "datetime", "value": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {TAG: "timedelta", "value": value.total_seconds()}
+    if type(value).__name__ == "CaseInsensitiveDict":
+        # the attributes of the entries found by ldap3
+        return {TAG: "cidict", "value": dict(value)}
+    raise TypeError(f"Cannot cache a value of type {type(value).__name__}")
+
+
+def _untag(obj):
+    tag = obj.get(TAG)
+    if tag is None:
+        return obj
+    value = obj["value"]
+    if tag == "bytes":
+        return base64.b64decode(value)
+    if tag == "datetime":
+        return datetime.fromisoformat(value)
+    if tag == "timedelta":
+        return timedelta(seconds=value)
+    if tag == "cidict":
+        from ldap3.utils.ciDict import CaseInsensitiveDict
+
+        return CaseInsensitiveDict(value)
+    raise ValueError(f"Unknown tag {tag}")
+
+
+def dumps(value) -> str:
+    """Serialize a value to json, also with bytes, datetimes, timedeltas and the dicts of ldap3
+
+    Unlike pickle, loading it cannot run code: tuples come back as lists
+    """
+    return json.dumps(value, default=_tag)
+
+
+def loads(text):
+    return json.loads(text, object_hook=_untag)
+
+
+class Cache:
+    """A LRU cache with expiring entries and an optional sqlite backend
+
+    Keys are tuples of strings, values anything that dumps can serialize.
+    With a path, entries are also stored on disk and survive between runs;
+    the file keeps about maxsize entries too
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 3600, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        self._writes = 0
+        if path:
+            self._db = self._open(path)
+
+    def _open(self, path):
+        try:
+            # sqlite creates the journal with the permissions of the file
+            create_private(path)
+            db = sqlite3.connect(str(path), check_same_thread=False)
+            columns = [row[1] for row in db.execute("PRAGMA table_info(cache)")]
+            if columns and "created" not in columns:
+                # written by an older version
+                db.execute("DROP TABLE cache")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL, created REAL)"
+            )
+            db.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+            db.commit()
+            return db
+        except (OSError, sqlite3.Error) as error:
+            logging.warning(f"Cannot use cache file {path}: {error}")
+            return None
+
+    @staticmethod
+    def _key(key) -> str:
+        return json.dumps(list(key))
+
+    def get(self, key, default=None, max_age: float | None = None):
+        """The value of key, if not expired and, with max_age, set at most max_age seconds ago"""
+        now = time.time()
+        oldest = None if max_age is None else now - max_age
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                value, expires, created = item
+                if expires < now:
+                    del self._entries[key]
+                elif oldest is None or created >= oldest:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            elif self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires, created FROM cache WHERE key = ?", (self._key(key),)
+                ).fetchone()
+                if row and row[1] >= now:
+                    try:
+                        value = loads(row[0])
+                    except ValueError:
+                        value = None
+                    else:
+                        self._remember(key, value, row[1], row[2])
+                        if oldest is None or row[2] >= oldest:
+                            self.hits += 1
+                            return value
+            self.misses += 1
+            return default
+
+    def _remember(self, key, value, expires, created):
+        self._entries[key] = (value, expires, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def set(self, key, value, ttl: float | None = None):
+        created = time.time()
+        expires = created + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, value, expires, created)
+            if self._db is not None:
+                try:
+                    text = dumps(value)
+                except (TypeError, ValueError) as error:
+                    logging.warning(f"Not caching {key} on disk: {error}")
+                    return
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires, created) VALUES (?, ?, ?, ?)",
+                    (self._key(key), text, expires, created),
+                )
+                self._writes += 1
+                if self._writes % PRUNE_EVERY == 0:
+                    self._prune()
+                self._db.commit()
+
+    def _prune(self):
+        """Bound the file to maxsize entries, dropping the expired and then the oldest ones"""
+        self._db.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        )
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache WHERE key = ?", (self._key(key),))
+                self._db.commit()
+
+    def clear(self, prefix=()):
+        """Remove all the entries whose key starts with prefix"""
+        prefix = tuple(prefix)
+        with self._lock:
+            for key in [k for k in self._entries if k[: len(prefix)] == prefix]:
+                del self._entries[key]
+            if self._db is not None:
+                if prefix:
+                    pattern = (
+                        self._key(prefix)[:-1]
+                        .replace("\\", "\\\\")
+                        .replace("%", "\\%")
+                        .replace("_", "\\_")
+                    )
+                    self._db.execute(
+                        "DELETE FROM cache WHERE key LIKE ? ESCAPE '\\'", (pattern + "%",)
+                    )
+                else:
+                    self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else None,
+        }
+
+
+class CacheView:
+    """A cache seen with another ttl, e.g. by a request of the daemon
+
+    Entries are stored with ttl and, if older than ttl, ignored
+    """
+
+    def __init__(self, cache, ttl: float):
+        self.cache = cache
+        self.ttl = ttl
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+    def get(self, key, default=None, max_age: float | None = None):
+        return self.cache.get(key, default, self.ttl if max_age is None else min(max_age, self.ttl))
+
+    def set(self, key, value, ttl: float | None = None):
+        self.cache.set(key, value, self.ttl if ttl is None else ttl)
+
+
+# caches and refresh of the current request of the daemon (see set_request_caches)
+_request = contextvars.ContextVar("msad_request_caches", default=None)
+
+# cache used by search.get_dn, None to disable it
+_dn_cache = Cache(maxsize=10000, ttl=3600)
+
+
+def get_dn_cache():
+    request = _request.get()
+    return _dn_cache if request is None else request[0]
+
+
+def set_dn_cache(cache):
+    global _dn_cache
+    _dn_cache = cache
+
+
+# results kept in memory by the result cache
+RESULT_CACHE_SIZE = 256
+
+# cache used by search.iter_entries for whole results, None (the default) to disable it
+_result_cache = None
+_refresh = False
+
+
+def get_result_cache(shared: bool = False):
+    """The result cache of the current request or, if shared, of the process (e.g. to invalidate it)"""
+    request = _request.get()
+    return _result_cache if request is None or shared else request[1]
+
+
+def set_result_cache(cache, refresh: bool = False):
+    """With refresh, the results are searched again (and cached) even if in cache"""
+    global _result_cache, _refresh
+    _result_cache = cache
+    _refresh = refresh
+
+
+def refreshing() -> bool:
+    request = _request.get()
+    return _refresh if request is None else request[2]
+
+
+def set_request_caches(dn_ttl: float | None, result_ttl: float, refresh: bool = False):
+    """Let the current request of the daemon use the caches of the process with its own options
+
+    dn_ttl None disables the cache of DNs, result_ttl 0 the result cache.
+    The threads started by the request see its caches if run in a copy of
+    its context (contextvars.copy_context). Returns a token for reset_request_caches
+    """
+    return _request.set((
+        None if dn_ttl is None or _dn_cache is None else CacheView(_dn_cache, dn_ttl),
+        None if result_ttl <= 0 or _result_cache is None else CacheView(_result_cache, result_ttl),
+        refresh,
+    ))
+
+
+def reset_request_caches(token):
+    _request.reset(token)
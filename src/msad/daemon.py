@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""A local daemon keeping bound connections and running msad commands
+
+The client sends one json line {"argv": [...]} and receives json lines
+{"out": text}, {"log": text} and finally {"exit": code}
+"""
+
+import contextvars
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+from .cache import CACHE_DIR
+from .pool import ConnectionPool
+
+# commands that can be run by the daemon (no stdin, no local files, no prompts)
+FORWARDED_COMMANDS = [
+    "group-add-member",
+    "group-members",
+    "group-remove-member",
+    "search",
+    "user-groups",
+    "users",
+]
+
+# options whose value is a path, made absolute by the client
+PATH_OPTIONS = ["--config-file", "--state-file"]
+
+
+class _Request:
+    """State of a request: the daemon, the stream to its client and the connections it borrowed"""
+
+    def __init__(self, daemon, stream):
+        self.daemon = daemon
+        self.stream = stream
+        self.borrowed = []
+
+
+# request served by the current thread, also seen by the threads started in a copy of its context
+_request = contextvars.ContextVar("msad_daemon_request", default=None)
+
+
+def socket_path() -> str:
+    return os.environ.get("MSAD_SOCKET", str(CACHE_DIR / "msad.sock"))
+
+
+def _config_key(config: dict) -> str:
+    return json.dumps(config, sort_keys=True, default=str)
+
+
+class _ClientStream:
+    """A text stream sending what is written to the client"""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._lock = threading.Lock()
+        self.written = 0
+
+    def send(self, message: dict):
+        with self._lock:
+            self._wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+            self._wfile.flush()
+
+    def write(self, text: str):
+        if text:
+            self.written += len(text)
+            self.send({"out": text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class _ClientLogHandler(logging.Handler):
+    """Send the log records of a request to its client"""
+
+    def emit(self, record):
+        stream = client_stream()
+        if stream is None:
+            return
+        try:
+            stream.send({"log": self.format(record)})
+        except OSError:
+            pass
+
+
+class Daemon:
+    def __init__(self, path: str, factory=None, pool_size: int = 4, max_idle: float = 600):
+        """factory(config) returns a new connection for a domain config"""
+        if factory is None:
+            from .main import _new_connection as factory
+        self.path = path
+        self.factory = factory
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def pool(self, config: dict) -> ConnectionPool:
+        key = _config_key(config)
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(
+                    lambda: self.factory(config), size=self.pool_size, max_idle=self.max_idle
+                )
+            return self._pools[key]
+
+    def get_connection(self, config: dict):
+        """Borrow a connection for the current request"""
+        pool = self.pool(config)
+        conn = pool.acquire()
+        _request.get().borrowed.append((pool, conn))
+        return conn
+
+    def prewarm(self, configs: dict):
+        for name, config in configs.items():
+            try:
+                pool = self.pool(config)
+                pool.release(pool.acquire())
+                logging.info(f"bound to domain {name}")
+            except Exception as error:
+                logging.error(f"cannot bind to domain {name}: {error}")
+
+    def run(self, argv: list, stream) -> int:
+        from click.exceptions import ClickException, Exit
+        from ldap3.core.exceptions import LDAPCommunicationError, LDAPSessionTerminatedByServerError
+        from .main import app
+
+        request = _Request(self, stream)
+        token = _request.set(request)
+        try:
+            for attempt in range(2):
+                request.borrowed = []
+                failed = False
+                try:
+                    app(args=argv, prog_name="msad", standalone_mode=False)
+                    return 0
+                except SystemExit as error:
+                    return error.code if isinstance(error.code, int) else 1
+                except Exit as error:
+                    return error.exit_code
+                except ClickException as error:
+                    stream.send({"log": error.format_message()})
+                    return error.exit_code
+                except (LDAPCommunicationError, LDAPSessionTerminatedByServerError) as error:
+                    # the session expired: retry once on new connections if nothing was sent
+                    failed = True
+                    logging.warning(f"connection lost: {error}")
+                    if attempt or stream.written:
+                        return 1
+                except Exception as error:
+                    logging.exception(error)
+                    return 1
+                finally:
+                    for pool, conn in request.borrowed:
+                        pool.release(conn, discard=failed)
+            return 1
+        finally:
+            _request.reset(token)
+
+    def serve_forever(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return
+                stream = _ClientStream(self.wfile)
+                try:
+                    request = json.loads(line)
+                    code = daemon.run(request["argv"], stream)
+                    stream.send({"exit": code})
+                except (OSError, ValueError, KeyError) as error:
+                    logging.error(f"bad request: {error}")
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        handler = _ClientLogHandler()
+        handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+        logging.getLogger().addHandler(handler)
+        # only the owner can use the daemon and its bound connections
+        umask = os.umask(0o177)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        finally:
+            os.umask(umask)
+        server.daemon_threads = True
+        logging.info(f"msad daemon listening on {self.path}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(self.path)
+            for pool in self._pools.values():
+                pool.close()
+
+
+def current():
+    """The daemon serving the current thread, if any"""
+    request = _request.get()
+    return request.daemon if request is not None else None
+
+
+def client_stream():
+    """The stream to the client of the request served by the current thread, if any"""
+    request = _request.get()
+    return request.stream if request is not None else None
+
+
+def _absolute_paths(argv: list) -> list:
+    """argv with the values of PATH_OPTIONS relative to the current directory, not to the one of the daemon"""
+    result = []
+    for arg in argv:
+        name, equals, value = arg.partition("=")
+        if equals and name in PATH_OPTIONS:
+            arg = f"{name}={os.path.abspath(os.path.expanduser(value))}"
+        elif result and result[-1] in PATH_OPTIONS:
+            arg = os.path.abspath(os.path.expanduser(arg))
+        result.append(arg)
+    return result
+
+
+def forward(argv: list, path: str | None = None):
+    """Run a command in the daemon, returning its exit code or None if it is not running"""
+    argv = _absolute_paths(argv)
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    with sock, sock.makefile("rwb") as f:
+        f.write((json.dumps({"argv": argv}) + "\n").encode("utf-8"))
+        f.flush()
+        for line in f:
+            message = json.loads(line)
+            if "out" in message:
+                sys.stdout.write(message["out"])
+            elif "log" in message:
+                sys.stderr.write(message["log"] + "\n")
+            elif "exit" in message:
+                sys.stdout.flush()
+                return message["exit"]
+    logging.error("the daemon closed the connection")
+    return 1
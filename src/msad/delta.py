@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+import json
+import logging
+import os
+
+import ldap3
+
+from ldap3.core.exceptions import LDAPCommunicationError
+
+from .cache import CACHE_DIR
+from .filters import and_, ge
+from .search import _send_search, iter_search
+
+STATE_FILE = CACHE_DIR / "usn_state.json"
+
+
+def _first(value):
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def _read_base(conn, dn, attribute_names) -> dict:
+    response, _ = _send_search(conn, dn, "(objectClass=*)", ldap3.BASE, attributes=attribute_names)
+    entries = [r for r in response or [] if "attributes" in r]
+    if not entries:
+        raise LDAPCommunicationError(f"cannot read {attribute_names} of '{dn}' from {conn.server}")
+    return entries[0]["attributes"]
+
+
+def dc_state(conn) -> dict:
+    """Read the identity (dsServiceName, invocationId) and highestCommittedUSN of the DC
+
+    All come from the same DC: if conn moves to another server of its pool
+    between the two searches, they are read again
+    """
+    for _ in range(2):
+        server = conn.server
+        root = _read_base(conn, "", ["dsServiceName", "highestCommittedUSN"])
+        service = _first(root["dsServiceName"])
+        invocation_id = _first(_read_base(conn, service, ["invocationId"])["invocationId"])
+        if conn.server is server:
+            break
+        logging.warning(f"the connection moved from {server} to {conn.server} while reading the DC state")
+    else:
+        raise LDAPCommunicationError("the connection keeps moving to other DCs")
+    if isinstance(invocation_id, bytes):
+        invocation_id = invocation_id.hex()
+    return {
+        "dc": str(service),
+        "invocation_id": str(invocation_id),
+        "usn": int(_first(root["highestCommittedUSN"])),
+    }
+
+
+def load_state(state_file=STATE_FILE) -> dict:
+    try:
+        with open(state_file, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as error:
+        logging.warning(f"Ignoring invalid state file {state_file}: {error}")
+        return {}
+
+
+def save_state(state: dict, state_file=STATE_FILE):
+    os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+    tmp = f"{state_file}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, state_file)
+
+
+class DeltaSearch:
+    """Iterate over the entries changed since the previous run
+
+    The watermark (highestCommittedUSN read before the search) is stored
+    per domain and DC in the state file once the iteration is complete and
+    was not truncated by limit or by the server (then self.truncated).
+    If there is no watermark or the invocationId of the DC changed (e.g.
+    restored from backup) all the entries are returned: check self.full.
+    Added and modified entries are returned alike, deleted ones are not
+    """
+
+    def __init__(
+        self,
+        conn,
+        search_base,
+        search_filter,
+        limit=0,
+        attributes=None,
+        domain=None,
+        state_file=STATE_FILE,
+        page_size=None,
+        prefetch=0,
+    ):
+        self.conn = conn
+        self.search_base = search_base
+        self.search_filter = search_filter
+        self.limit = limit
+        self.attributes = attributes
+        self.domain = domain or search_base
+        self.state_file = state_file
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.full = None
+        self.truncated = False
+        self.count = 0
+
+    def __iter__(self):
+        current = dc_state(self.conn)
+        key = f"{self.domain.lower()}|{current['dc'].lower()}"
+        state = load_state(self.state_file)
+        previous = state.get(key)
+
+        search_filter = self.search_filter
+        if not previous:
+            self.full = True
+            logging.info(f"no watermark for {key}: full export")
+        elif previous["invocation_id"] != current["invocation_id"]:
+            self.full = True
+            logging.warning(f"invocationId of {current['dc']} changed: full export")
+        else:
+            self.full = False
+            search_filter = and_(search_filter, ge("uSNChanged", previous["usn"] + 1))
+            logging.info(f"exporting changes since USN {previous['usn']}")
+
+        status = {}
+        # one entry more than limit tells whether the limit truncated the search
+        for entry in iter_search(
+            self.conn,
+            self.search_base,
+            search_filter,
+            limit=self.limit + 1 if self.limit else 0,
+            attributes=self.attributes,
+            page_size=self.page_size,
+            prefetch=self.prefetch,
+            cached=False,
+            status=status,
+        ):
+            if self.limit and self.count >= self.limit:
+                self.truncated = True
+                break
+            self.count += 1
+            yield entry
+
+        if self.truncated or status.get("truncated"):
+            self.truncated = True
+            logging.warning("the search was truncated: the watermark is not updated")
+            return
+        state = load_state(self.state_file)
+        state[key] = {
+            "invocation_id": current["invocation_id"],
+            "usn": current["usn"],
+            "updated": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        save_state(state, self.state_file)
+        logging.info(f"{self.count} entries changed, new watermark {current['usn']}")
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Bulk export of entries to compressed ndjson/csv files or to parquet
+
+Every requested attribute is a column with a type (str, int, bool,
+datetime or bytes) taken from the schema, and is a list if the attribute
+is multi-valued: the columns do not depend on the values found.
+zstd needs the zstandard package, parquet the pyarrow package
+"""
+
+import collections
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+
+from . import stats
+from .output import CsvWriter, NdjsonWriter
+from .search import iter_entries
+
+FORMATS = ["ndjson", "csv", "tsv", "parquet"]
+COMPRESSIONS = ["gzip", "zstd", "none"]
+
+# rows per parquet row group (the rows kept in memory)
+CHUNK_SIZE = 10000
+
+SUFFIXES = {
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".json": "ndjson",
+    ".csv": "csv",
+    ".tsv": "tsv",
+    ".parquet": "parquet",
+}
+COMPRESSED_SUFFIXES = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+
+# type of the values returned by the ldap3 formatters
+_FORMATTER_TYPES = {
+    "format_integer": "int",
+    "format_boolean": "bool",
+    "format_ad_timestamp": "datetime",
+    "format_time": "datetime",
+    "format_time_with_0_year": "datetime",
+    "format_binary": "bytes",
+}
+
+Column = collections.namedtuple("Column", ["name", "type", "multi"])
+
+
+def column(server, name: str) -> Column:
+    """The column of an attribute, as decoded by ldap3 with the schema of the server"""
+    from ldap3.protocol.formatters.standard import find_attribute_helpers
+
+    schema = getattr(server, "schema", None)
+    attr_type = None
+    if schema and schema.attribute_types and name in schema.attribute_types:
+        attr_type = schema.attribute_types[name]
+    helpers = find_attribute_helpers(attr_type, name, getattr(server, "custom_formatter", None))
+    formatter = helpers[0] if isinstance(helpers, tuple) else helpers
+    value_type = _FORMATTER_TYPES.get(getattr(formatter, "__name__", ""), "str")
+    return Column(name, value_type, not (attr_type and attr_type.single_value))
+
+
+def columns(server, attributes: list) -> list:
+    return [Column("dn", "str", False)] + [column(server, name) for name in attributes]
+
+
+def _convert(value, value_type: str):
+    """The value as value_type, None if it cannot be converted"""
+    if value is None:
+        return None
+    try:
+        if value_type == "int":
+            return int(value)
+        if value_type == "bool":
+            return value if isinstance(value, bool) else str(value).upper() == "TRUE"
+        if value_type == "datetime":
+            return value if isinstance(value, datetime.datetime) else None
+        if value_type == "bytes":
+            return value if isinstance(value, bytes) else str(value).encode("utf-8")
+        return value.hex() if isinstance(value, bytes) else str(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize(record: dict, columns: list) -> dict:
+    """The values of the columns, converted to their types"""
+    # attribute names are case insensitive in LDAP
+    lower = {k.lower(): v for k, v in record.items()}
+    row = {}
+    for c in columns:
+        value = lower.get(c.name.lower())
+        values = value if isinstance(value, list) else ([] if value is None else [value])
+        if c.multi:
+            row[c.name] = [v for v in (_convert(v, c.type) for v in values) if v is not None]
+        else:
+            row[c.name] = _convert(values[0], c.type) if values else None
+    return row
+
+
+def _text(value):
+    """A json friendly value: datetimes as iso strings, bytes as hex"""
+    if isinstance(value, list):
+        return [_text(v) for v in value]
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+def guess_format(path: str, out_format=None, compression=None):
+    """The (format, compression) given or else guessed from the file name"""
+    name = path.lower()
+    root, suffix = os.path.splitext(name)
+    if compression is None:
+        compression = COMPRESSED_SUFFIXES.get(suffix, "none")
+    if suffix in COMPRESSED_SUFFIXES:
+        suffix = os.path.splitext(root)[1]
+    if out_format is None:
+        out_format = SUFFIXES.get(suffix, "ndjson")
+    if out_format not in FORMATS:
+        raise ValueError(f"Unknown export format '{out_format}'. Use one of {', '.join(FORMATS)}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{compression}'. Use one of {', '.join(COMPRESSIONS)}")
+    return out_format, compression
+
+
+class _Unclosable(io.BufferedIOBase):
+    """stdout for the compressors, left open when they are closed"""
+
+    def __init__(self, f):
+        self._f = f
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+
+def _open_text(f, compression: str):
+    """A text stream writing to the binary file f, compressed"""
+    if compression == "gzip":
+        f = gzip.GzipFile(fileobj=f, mode="wb")
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression needs the zstandard package: pip install zstandard")
+        f = zstandard.ZstdCompressor().stream_writer(f)
+    return io.TextIOWrapper(f, encoding="utf-8", newline="")
+
+
+def _write_text(rows, f, out_format, compression, cols):
+    stream = _open_text(f, compression)
+    if out_format == "ndjson":
+        writer = NdjsonWriter(stream)
+        records = ({k: _text(v) for k, v in row.items()} for row in rows)
+    else:
+        writer = CsvWriter(stream, fields=[c.name for c in cols], delimiter="," if out_format == "csv" else "\t")
+        # multi-valued attributes are json lists, keeping their values and types
+        records = (
+            {k: json.dumps(_text(v)) if isinstance(v, list) else _text(v) for k, v in row.items()}
+            for row in rows
+        )
+    count = writer.write_all(records)
+    stream.close()
+    return count
+
+
+def _arrow_type(pa, c: Column):
+    value_type = {
+        "int": pa.int64(),
+        "bool": pa.bool_(),
+        "datetime": pa.timestamp("us", tz="UTC"),
+        "bytes": pa.binary(),
+        "str": pa.string(),
+    }[c.type]
+    return pa.list_(value_type) if c.multi else value_type
+
+
+def _write_parquet(rows, f, compression, cols, chunk_size):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("parquet export needs the pyarrow package: pip install pyarrow")
+
+    schema = pa.schema([pa.field(c.name, _arrow_type(pa, c)) for c in cols])
+    codec = "snappy" if compression == "none" else compression
+    count = 0
+    with pq.ParquetWriter(f, schema, compression=codec) as writer:
+        chunk = {c.name: [] for c in cols}
+        size = 0
+        for row in rows:
+            for c in cols:
+                chunk[c.name].append(row[c.name])
+            size += 1
+            if size >= chunk_size:
+                writer.write_table(pa.Table.from_pydict(chunk, schema=schema))
+                count += size
+                chunk = {c.name: [] for c in cols}
+                size = 0
+        if size:
+            writer.write_table(pa.Table.from_pydict(chunk, schema=schema))
+            count += size
+    return count
+
+
+@stats.instrumented
+def export(
+    conn,
+    search_base,
+    search_filter,
+    path,
+    out_format=None,
+    compression=None,
+    attributes=None,
+    limit=0,
+    chunk_size=CHUNK_SIZE,
+    page_size=None,
+    prefetch=0,
+):
+    """Stream the entries found to path ('-' for stdout), returning their number
+
+    The format and the compression are guessed from the file name if not given
+    """
+    out_format, compression = guess_format(path, out_format, compression)
+    attributes = [a for a in attributes or [] if a != "*"]
+    if not attributes and out_format != "ndjson":
+        raise ValueError(f"The {out_format} export needs the list of attributes")
+
+    server = getattr(conn, "server", None)
+    cols = columns(server, attributes)
+    lazy = {}
+
+    def _rows():
+        for entry in iter_entries(
+            conn,
+            search_base,
+            search_filter,
+            limit=limit,
+            attributes=attributes or None,
+            page_size=page_size,
+            prefetch=prefetch,
+            cached=False,
+        ):
+            record = {"dn": entry["dn"], **entry["attributes"]}
+            if attributes:
+                yield normalize(record, cols)
+                continue
+            # all the attributes: the columns are found as the entries arrive
+            for name in record:
+                if name.lower() not in lazy:
+                    lazy[name.lower()] = column(server, name) if name != "dn" else cols[0]
+            yield normalize(record, [lazy[name.lower()] for name in record])
+
+    if path == "-":
+        if out_format == "parquet":
+            raise ValueError("The parquet export needs a file")
+        count = _write_text(_rows(), _Unclosable(sys.stdout.buffer), out_format, compression, cols)
+    else:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                if out_format == "parquet":
+                    count = _write_parquet(_rows(), f, compression, cols, chunk_size)
+                else:
+                    count = _write_text(_rows(), f, out_format, compression, cols)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+    logging.info(f"exported {count} entries to {path}")
+    return count
+
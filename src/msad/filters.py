@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Construction, optimization, parsing and local evaluation of LDAP search filters (RFC 4515)
+
+    and_(eq("objectCategory", "person"), like("sAMAccountName", "matt*"))
+
+The builders escape the values; like() keeps the * wildcards only.
+
+optimize() only rewrites a filter into equivalent ones: nested and/or
+flattened, duplicates, double negations and (objectClass=*) inside and
+removed, extensible matches without rule turned into equalities. It does
+not change what a filter means to make it indexed (e.g. objectClass to
+objectCategory): scan_items() reports the items AD has to answer by
+reading every object, judged on INDEXED_ATTRIBUTES
+"""
+
+import datetime
+import functools
+import logging
+import re
+
+IN_CHAIN = "1.2.840.113556.1.4.1941"
+BIT_AND = "1.2.840.113556.1.4.803"
+BIT_OR = "1.2.840.113556.1.4.804"
+
+FILETIME_EPOCH = datetime.datetime(1601, 1, 1, tzinfo=datetime.timezone.utc)
+
+# attributes indexed in a default AD schema (searchFlags fATTINDEX) and the
+# linked ones, lowercase: extend it with add_indexed for the schema in use
+INDEXED_ATTRIBUTES = {
+    "altsecurityidentities",
+    "anr",
+    "cn",
+    "displayname",
+    "distinguishedname",
+    "dnshostname",
+    "givenname",
+    "legacyexchangedn",
+    "mail",
+    "mailnickname",
+    "manager",
+    "member",
+    "memberof",
+    "name",
+    "objectcategory",
+    "objectclass",
+    "objectguid",
+    "objectsid",
+    "ou",
+    "primarygroupid",
+    "proxyaddresses",
+    "samaccountname",
+    "samaccounttype",
+    "serviceprincipalname",
+    "sidhistory",
+    "sn",
+    "userprincipalname",
+    "usnchanged",
+    "usncreated",
+}
+
+
+class FilterError(ValueError):
+    pass
+
+
+# refuse the filters forcing a full scan instead of warning, see set_strict
+_strict = False
+
+
+def set_strict(strict: bool):
+    global _strict
+    _strict = strict
+
+
+def is_strict() -> bool:
+    return _strict
+
+
+def add_indexed(*attributes):
+    """Declare attributes indexed in the schema in use (e.g. employeeID)"""
+    INDEXED_ATTRIBUTES.update(a.lower() for a in attributes)
+    _prepare.cache_clear()
+
+
+def escape(value) -> str:
+    """Escape a value for a filter: \\ * ( ) and NUL, and every byte of a bytes value"""
+    if isinstance(value, bytes):
+        return "".join(f"\\{b:02x}" for b in value)
+    return (
+        str(value)
+        .replace("\\", "\\5c")
+        .replace("*", "\\2a")
+        .replace("(", "\\28")
+        .replace(")", "\\29")
+        .replace("\0", "\\00")
+    )
+
+
+def eq(attribute: str, value) -> str:
+    return f"({attribute}={escape(value)})"
+
+
+def like(attribute: str, pattern: str) -> str:
+    """A substring (or equality) filter: * in pattern is a wildcard, everything else is escaped"""
+    if pattern == "*":
+        return present(attribute)
+    return f"({attribute}={'*'.join(escape(part) for part in pattern.split('*'))})"
+
+
+def present(attribute: str) -> str:
+    return f"({attribute}=*)"
+
+
+def ge(attribute: str, value) -> str:
+    return f"({attribute}>={escape(value)})"
+
+
+def le(attribute: str, value) -> str:
+    return f"({attribute}<={escape(value)})"
+
+
+def bit_and(attribute: str, bits: int) -> str:
+    """The entries having all the bits set"""
+    return f"({attribute}:{BIT_AND}:={int(bits)})"
+
+
+def in_chain(attribute: str, dn: str) -> str:
+    """The entries linked to dn through attribute, also nested (LDAP_MATCHING_RULE_IN_CHAIN)"""
+    return f"({attribute}:{IN_CHAIN}:={escape(dn)})"
+
+
+def _join(op: str, filters) -> str:
+    filters = [f for f in filters if f]
+    if len(filters) == 1:
+        return filters[0]
+    return f"({op}{''.join(filters)})"
+
+
+def and_(*filters) -> str:
+    """All the filters (empty ones are skipped)"""
+    return _join("&", filters)
+
+
+def or_(*filters) -> str:
+    """Any of the filters (empty ones are skipped)"""
+    return _join("|", filters)
+
+
+def not_(search_filter: str) -> str:
+    return f"(!{search_filter})"
+
+
+class Node:
+    """A filter item
+
+    op is one of and, or, not, eq, present, substring, ge, le, approx, ext.
+    Substring values are lists [initial, any..., final] (initial and final
+    can be empty strings). dn is set for the extensible matches also
+    matching the attributes of the DN (attr:dn:rule:=value)
+    """
+
+    __slots__ = ("op", "attribute", "value", "children", "rule", "text", "dn")
+
+    def __init__(self, op, attribute=None, value=None, children=None, rule=None, text=None, dn=False):
+        self.op = op
+        self.attribute = attribute
+        self.value = value
+        self.children = children or []
+        self.rule = rule
+        self.text = text  # the item as written, values still escaped
+        self.dn = dn
+
+    def __repr__(self):
+        return f"Node({self.op!r}, {self.attribute!r}, {self.value!r}, {self.children!r}, {self.rule!r}, dn={self.dn!r})"
+
+
+def _unescape(text: str) -> str:
+    return re.sub(
+        r"\\([0-9a-fA-F]{2})", lambda m: chr(int(m.group(1), 16)), text
+    )
+
+
+def parse(text: str) -> Node:
+    text = text.strip()
+    if not text.startswith("("):
+        text = f"({text})"
+    node, pos = _parse(text, 0)
+    if pos != len(text):
+        raise FilterError(f"unexpected text at position {pos} in {text}")
+    return node
+
+
+def _parse(text: str, pos: int):
+    if pos >= len(text) or text[pos] != "(":
+        raise FilterError(f"expected '(' at position {pos} in {text}")
+    pos += 1
+    if pos >= len(text):
+        raise FilterError(f"unterminated filter {text}")
+    op = text[pos]
+    if op in "&|":
+        pos += 1
+        children = []
+        while pos < len(text) and text[pos] == "(":
+            child, pos = _parse(text, pos)
+            children.append(child)
+        node = Node("and" if op == "&" else "or", children=children)
+    elif op == "!":
+        child, pos = _parse(text, pos + 1)
+        node = Node("not", children=[child])
+    else:
+        end = pos
+        while end < len(text) and text[end] != ")":
+            end += 1
+        node = _parse_item(text[pos:end])
+        node.text = text[pos:end]
+        pos = end
+    if pos >= len(text) or text[pos] != ")":
+        raise FilterError(f"expected ')' at position {pos} in {text}")
+    return node, pos + 1
+
+
+def _parse_item(item: str) -> Node:
+    match = re.match(r"^([^=<>~]*?)(:=|>=|<=|~=|=)(.*)$", item, re.S)
+    if not match:
+        raise FilterError(f"invalid filter item ({item})")
+    attribute, operator, value = match.groups()
+    if operator == ":=" or ":" in attribute:
+        # extensible match attr[:dn][:rule]:=value or [:dn]:rule:=value
+        if operator != ":=":
+            raise FilterError(f"invalid extensible match ({item})")
+        attribute, *options = attribute.split(":")
+        dn = bool(options) and options[0].lower() == "dn"
+        if dn:
+            options = options[1:]
+        if len(options) > 1 or not (attribute or options) or "" in options:
+            raise FilterError(f"invalid extensible match ({item})")
+        return Node("ext", attribute, _unescape(value), rule=options[0] if options else "", dn=dn)
+    if operator == ">=":
+        return Node("ge", attribute, _unescape(value))
+    if operator == "<=":
+        return Node("le", attribute, _unescape(value))
+    if operator == "~=":
+        return Node("approx", attribute, _unescape(value))
+    if value == "*":
+        return Node("present", attribute)
+    if "*" in value:
+        return Node("substring", attribute, [_unescape(part) for part in value.split("*")])
+    return Node("eq", attribute, _unescape(value))
+
+
+def to_text(node: Node) -> str:
+    if node.op in ["and", "or"]:
+        return f"({'&' if node.op == 'and' else '|'}{''.join(to_text(c) for c in node.children)})"
+    if node.op == "not":
+        return f"(!{to_text(node.children[0])})"
+    return f"({node.text})"
+
+
+def _is_any_object(node: Node) -> bool:
+    return node.op == "present" and node.attribute.lower() == "objectclass"
+
+
+def _simplify(node: Node) -> Node:
+    """Flatten nested and/or, remove duplicated items, double negations and (objectClass=*) from and
+
+    (attr:=value) becomes (attr=value)
+    """
+    if node.op == "not":
+        child = _simplify(node.children[0])
+        if child.op == "not":
+            return child.children[0]
+        return Node("not", children=[child])
+    if node.op == "ext" and not node.rule and not node.dn:
+        return Node("eq", node.attribute, node.value, text=f"{node.attribute}={escape(node.value)}")
+    if node.op not in ["and", "or"]:
+        return node
+    children = []
+    seen = set()
+    for child in (_simplify(c) for c in node.children):
+        for c in child.children if child.op == node.op else [child]:
+            key = to_text(c)
+            if key not in seen:
+                seen.add(key)
+                children.append(c)
+    if node.op == "and" and len(children) > 1:
+        children = [c for c in children if not _is_any_object(c)] or children[:1]
+    if len(children) == 1:
+        return children[0]
+    return Node(node.op, children=children)
+
+
+def _indexed(node: Node) -> bool:
+    """Can AD answer node from an index (instead of reading every object)?"""
+    if node.op == "and":
+        return any(_indexed(c) for c in node.children)
+    if node.op == "or":
+        return bool(node.children) and all(_indexed(c) for c in node.children)
+    if node.op == "not":
+        return False
+    if node.attribute is None or node.attribute.lower() not in INDEXED_ATTRIBUTES:
+        return False
+    if node.op == "substring":
+        # a leading * cannot use the (prefix) index
+        return node.value[0] != ""
+    if node.op == "ext":
+        # the in-chain rule follows the links, the bitwise and :dn: rules read every object
+        return node.rule in [IN_CHAIN, ""] and not node.dn
+    return True
+
+
+def _scans(node: Node) -> list:
+    """The items of node making AD read every object"""
+    if node.op == "and":
+        if any(_indexed(c) for c in node.children):
+            return []
+        return [item for c in node.children for item in _scans(c)]
+    if node.op == "or":
+        return [item for c in node.children for item in _scans(c)]
+    return [] if _indexed(node) else [to_text(node)]
+
+
+@functools.lru_cache(maxsize=1024)
+def _prepare(search_filter: str):
+    try:
+        node = _simplify(parse(search_filter))
+    except FilterError:
+        # left to the server (e.g. attr:dn:rule:= items)
+        return search_filter, []
+    return to_text(node), _scans(node)
+
+
+def optimize(search_filter: str) -> str:
+    """The filter without redundant parts: nested and/or flattened, duplicates and (objectClass=*) in and removed"""
+    return _prepare(search_filter)[0]
+
+
+def scan_items(search_filter: str) -> list:
+    """The items of a filter that make AD read every object (not indexed attributes, leading wildcards, negations, bitwise rules)"""
+    return _prepare(search_filter)[1]
+
+
+def prepare(search_filter: str) -> str:
+    """The optimized filter, warning if it needs a full scan (FilterError with set_strict(True))"""
+    text, scans = _prepare(search_filter)
+    if scans:
+        message = f"filter {search_filter} needs a full scan of the directory because of {', '.join(scans)}"
+        if _strict:
+            raise FilterError(f"{message} (refused in strict mode)")
+        _warn(message)
+    return text
+
+
+@functools.lru_cache(maxsize=1024)
+def _warn(message: str):
+    """Log a warning once, while it is among the latest ones (e.g. in the daemon)"""
+    logging.warning(message)
+
+
+def _get(record, attribute: str) -> list:
+    for key, value in record.items():
+        if key.lower() == attribute.lower():
+            if isinstance(value, (list, tuple)):
+                return list(value)
+            return [] if value is None else [value]
+    return []
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, datetime.datetime):
+        value = value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+        delta = value - FILETIME_EPOCH
+        return (delta.days * 86400 + delta.seconds) * 10_000_000 + delta.microseconds * 10
+    try:
+        return int(str(value))
+    except ValueError:
+        return None
+
+
+def _text(value) -> str:
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value).lower()
+
+
+def _equals(attribute: str, value, expected: str) -> bool:
+    if attribute.lower() == "objectcategory" and "=" not in expected:
+        # (objectCategory=person) matches CN=Person,CN=Schema,...
+        value = str(value).split(",", 1)[0].split("=", 1)[-1]
+    if isinstance(value, bytes):
+        # binary values (e.g. objectSid) are written \xx by byte
+        try:
+            return value == expected.encode("latin-1")
+        except UnicodeEncodeError:
+            return value == expected.encode()
+    number = _number(expected)
+    if number is not None and not isinstance(value, str):
+        return _number(value) == number
+    return _text(value) == expected.lower()
+
+
+def _substring_regex(parts: list):
+    return re.compile(
+        "^" + ".*".join(re.escape(part) for part in parts) + "$", re.I | re.S
+    )
+
+
+def matches(node: Node, record, in_chain=None) -> bool:
+    """Evaluate a filter on a record (a dict of attributes)
+
+    in_chain(attribute, value, record) evaluates the LDAP_MATCHING_RULE_IN_CHAIN
+    """
+    op = node.op
+    if op == "and":
+        return all(matches(child, record, in_chain) for child in node.children)
+    if op == "or":
+        return any(matches(child, record, in_chain) for child in node.children)
+    if op == "not":
+        return not matches(node.children[0], record, in_chain)
+
+    values = _get(record, node.attribute)
+    if op == "present":
+        return bool(values)
+    if op in ["eq", "approx"]:
+        return any(_equals(node.attribute, v, node.value) for v in values)
+    if op == "substring":
+        regex = _substring_regex(node.value)
+        return any(regex.match(str(v)) for v in values)
+    if op in ["ge", "le"]:
+        expected = _number(node.value)
+        for v in values:
+            n = _number(v)
+            if expected is not None and n is not None:
+                ok = n >= expected if op == "ge" else n <= expected
+            else:
+                ok = _text(v) >= node.value.lower() if op == "ge" else _text(v) <= node.value.lower()
+            if ok:
+                return True
+        return False
+    if op == "ext":
+        if node.dn:
+            raise FilterError(f"extensible match on the DN attributes ({node.text}) is not supported here")
+        if node.rule in [BIT_AND, BIT_OR]:
+            bits = _number(node.value) or 0
+            for v in values:
+                n = _number(v) or 0
+                if (n & bits == bits) if node.rule == BIT_AND else (n & bits):
+                    return True
+            return False
+        if node.rule == IN_CHAIN:
+            if in_chain is None:
+                raise FilterError(f"matching rule {IN_CHAIN} is not supported here")
+            return in_chain(node.attribute, node.value, record)
+        if not node.rule:
+            return any(_equals(node.attribute, v, node.value) for v in values)
+        raise FilterError(f"matching rule {node.rule} is not supported")
+    raise FilterError(f"unknown filter operator {op}")
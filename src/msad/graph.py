@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+
+from array import array
+from collections import deque
+
+from . import stats
+from .search import iter_search
+
+
+class GroupGraph:
+    """The group memberships of a domain, loaded with one paged scan
+
+    Nested memberships are computed locally (instead of using the
+    LDAP_MATCHING_RULE_IN_CHAIN) and memoized. Cycles are allowed.
+    """
+
+    def __init__(self):
+        self.dns = []  # id -> dn
+        self._ids = {}  # lower(dn) -> id
+        self._names = {}  # lower(sAMAccountName) -> group id
+        self.names = {}  # group id -> sAMAccountName
+        self.members = {}  # group id -> member ids
+        self.parents = {}  # member id -> group ids
+        self.cycles = set()  # groups that are (nested) members of themselves
+        self._ancestors = {}
+        self._descendants = {}
+
+    @classmethod
+    @stats.instrumented
+    def load(cls, conn, search_base, search_filter="(objectClass=group)"):
+        graph = cls()
+        for entry in iter_search(
+            conn,
+            search_base,
+            search_filter,
+            attributes=["distinguishedName", "sAMAccountName", "member"],
+        ):
+            graph.add_group(
+                entry["distinguishedName"],
+                entry.get("sAMAccountName"),
+                entry.get("member") or [],
+            )
+        logging.debug(
+            f"loaded {len(graph.members)} groups and {len(graph.dns)} objects"
+        )
+        return graph
+
+    def _id(self, dn: str) -> int:
+        key = dn.lower()
+        i = self._ids.get(key)
+        if i is None:
+            i = len(self.dns)
+            self._ids[key] = i
+            self.dns.append(dn)
+        return i
+
+    def add_group(self, dn: str, name: str | None, members):
+        group = self._id(dn)
+        if name:
+            self.names[group] = name
+            self._names[name.lower()] = group
+        ids = array("I", (self._id(member) for member in members))
+        self.members[group] = ids
+        for member in ids:
+            self.parents.setdefault(member, array("I")).append(group)
+        self._ancestors.clear()
+        self._descendants.clear()
+
+    def find(self, entry: str):
+        """Return the id of a DN or of a group sAMAccountName, None if unknown"""
+        if entry.lower().startswith("cn="):
+            return self._ids.get(entry.lower())
+        return self._names.get(entry.lower())
+
+    def is_group(self, i: int) -> bool:
+        return i in self.members
+
+    def _closure(self, start: int, edges: dict, memo: dict) -> frozenset:
+        """All the ids reachable from start (memoized, cycles are detected)"""
+        if start in memo:
+            return memo[start]
+        reached = set()
+        todo = deque(edges.get(start, ()))
+        while todo:
+            i = todo.popleft()
+            if i in reached:
+                continue
+            if i == start and i not in self.cycles:
+                logging.warning(f"membership cycle: {self.dns[i]} contains itself")
+                self.cycles.add(i)
+            reached.add(i)
+            if i in memo:
+                reached.update(memo[i])
+            else:
+                todo.extend(edges.get(i, ()))
+        memo[start] = frozenset(reached)
+        return memo[start]
+
+    def ancestors(self, i: int) -> frozenset:
+        """The ids of the groups containing i, also nested"""
+        return self._closure(i, self.parents, self._ancestors)
+
+    def descendants(self, i: int) -> frozenset:
+        """The ids of the members of group i, also nested"""
+        return self._closure(i, self.members, self._descendants)
+
+    def group_names(self, ids) -> list:
+        return sorted(self.names.get(i, self.dns[i]) for i in ids)
+
+    def user_groups(self, entry: str, nested: bool = True) -> list | None:
+        """The sAMAccountNames of the groups of a DN"""
+        i = self.find(entry)
+        if i is None:
+            return None
+        groups = self.ancestors(i) if nested else self.parents.get(i, ())
+        return self.group_names(groups)
+
+    def flat_members(self, group: str, nested: bool = True) -> list | None:
+        """The DNs of the members of a group (DN or sAMAccountName) that are not groups"""
+        i = self.find(group)
+        if i is None or not self.is_group(i):
+            return None
+        members = self.descendants(i) if nested else self.members[i]
+        return sorted(self.dns[m] for m in members if not self.is_group(m))
+
+    def is_member(self, group: str, entry: str) -> bool | None:
+        group_id = self.find(group)
+        entry_id = self.find(entry)
+        if group_id is None or entry_id is None:
+            return None
+        return group_id in self.ancestors(entry_id)
+
+    def effective_groups(self):
+        """Yield (dn, groups) for every object that is not a group"""
+        for i, dn in enumerate(self.dns):
+            if not self.is_group(i):
+                yield dn, self.group_names(self.ancestors(i))
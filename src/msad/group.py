@@ -17,9 +17,27 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
+import re
 
-from .search import get_dn, search
+from . import stats
+from .cache import get_dn_cache
+from .filters import and_, eq, in_chain, present
+from .search import (
+    dn_cache_key,
+    get_dn,
+    invalidate_dn,
+    invalidate_results,
+    iter_entries,
+    iter_range,
+    iter_search,
+    iter_search_many,
+    search,
+)
 
+# groupType flag of the security groups, the only ones listed in tokenGroups
+GROUP_TYPE_SECURITY_ENABLED = 0x80000000
+
+@stats.instrumented
 def add_member(conn, search_base, group, user):
     group_dn = get_dn(conn, search_base, group)
     if not group_dn:
@@ -29,9 +47,17 @@ def add_member(conn, search_base, group, user):
     if not user_dn:
         return None
 
-    return conn.extend.microsoft.add_members_to_groups([user_dn], [group_dn])
+    with stats.timed("modify"):
+        result = conn.extend.microsoft.add_members_to_groups([user_dn], [group_dn])
+    invalidate_results(search_base)
+    if not result:
+        # the cached DNs may be stale (e.g. renamed or moved objects)
+        invalidate_dn(search_base, group)
+        invalidate_dn(search_base, user)
+    return result
 
 
+@stats.instrumented
 def remove_member(conn, search_base, group, user):
     group_dn = get_dn(conn, search_base, group)
     if not group_dn:
@@ -41,40 +67,325 @@ def remove_member(conn, search_base, group, user):
     if not user_dn:
         return None
 
-    return conn.extend.microsoft.remove_members_from_groups([user_dn], [group_dn])
+    with stats.timed("modify"):
+        result = conn.extend.microsoft.remove_members_from_groups([user_dn], [group_dn])
+    invalidate_results(search_base)
+    if not result:
+        # the cached DNs may be stale (e.g. renamed or moved objects)
+        invalidate_dn(search_base, group)
+        invalidate_dn(search_base, user)
+    return result
 
 
+@stats.instrumented
 def group_flat_members(
-    conn, search_base, limit, group, attributes=None
+    conn, search_base, limit, group, attributes=None, graph=None
 ):
+    """Retrieve the members (also nested) of a group
+
+    With a GroupGraph the nested members are resolved locally
+    """
     group_dn = get_dn(conn, search_base, group)
 
     if not group_dn:
         return None
 
-    search_filter = f"(&(objectClass=person)(sAMAccountName=*)(memberOf:1.2.840.113556.1.4.1941:={group_dn}))"
-    return search(conn, search_base, search_filter, attributes=attributes)
+    if graph is not None:
+        members = graph.flat_members(group_dn)
+        if members is None:
+            logging.error(f"group {group} not found")
+            return None
+        if limit:
+            members = members[:limit]
+        return iter_search_many(
+            conn,
+            search_base,
+            "distinguishedName",
+            members,
+            search_filter=and_(eq("objectClass", "person"), present("sAMAccountName")),
+            attributes=attributes,
+        )
 
+    search_filter = and_(eq("objectClass", "person"), present("sAMAccountName"), in_chain("memberOf", group_dn))
+    return iter_search(conn, search_base, search_filter, limit=limit, attributes=attributes)
 
+
+@stats.instrumented
 def group_members(conn, search_base, group):
+    """Stream the direct members of a group, one {"member": dn} per member
+
+    The members are read with ranged retrieval, so that groups with more
+    than MaxValRange (1500) members are not truncated
+    """
     group_dn = get_dn(conn, search_base, group)
     if not group_dn:
         return None
 
-    search_filter = f"(distinguishedName={group_dn})"
-    return search(conn, group_dn, search_filter, limit=1, attributes=["member"])
+    return ({"member": dn} for dn in iter_range(conn, group_dn, "member"))
 
 
-def group_member(conn, search_base, group, user):
+@stats.instrumented
+def group_member(conn, search_base, group, user, graph=None):
+    memberships = group_memberships(conn, search_base, user, [group], graph=graph)
+    return None if memberships is None else memberships[group]
+
+
+def _in_chain_member(conn, search_base, group_dn, user_dn) -> bool:
+    search_filter = and_(
+        in_chain("memberOf", group_dn),
+        eq("objectCategory", "person"),
+        eq("objectClass", "user"),
+        eq("distinguishedName", user_dn),
+    )
+    result = search(conn, search_base, search_filter)
+    return True if len(result) == 1 else False
+
+
+def _sid(value) -> str:
+    if isinstance(value, bytes):
+        from ldap3.protocol.formatters.formatters import format_sid
+
+        return format_sid(value)
+    return str(value)
 
-    group_dn = get_dn(conn, search_base, group)
-    if not group_dn:
-        return None
 
+def _groups_info(conn, search_base, groups) -> dict:
+    """The dn, objectSid and groupType of groups (DNs or sAMAccountNames), cached with the DNs
+
+    Returns a dict group -> info, None for the groups not found
+    """
+    cache = get_dn_cache()
+    info = {}
+    missing = []
+    for group in groups:
+        value = cache.get(dn_cache_key(conn, "group", search_base, group)) if cache is not None else None
+        if value is None:
+            missing.append(group)
+        else:
+            info[group] = value
+
+    for attribute in ["distinguishedName", "sAMAccountName"]:
+        wanted = {
+            g.lower(): g
+            for g in missing
+            if g.lower().startswith("cn=") == (attribute == "distinguishedName")
+        }
+        if not wanted:
+            continue
+        for entry in iter_search_many(
+            conn,
+            search_base,
+            attribute,
+            list(wanted.values()),
+            search_filter=eq("objectClass", "group"),
+            attributes=["distinguishedName", "sAMAccountName", "objectSid", "groupType"],
+        ):
+            group = wanted.get(str(entry.get(attribute)).lower())
+            if group is None or not entry.get("objectSid"):
+                continue
+            try:
+                group_type = int(entry.get("groupType") or 0)
+            except (TypeError, ValueError):
+                group_type = 0
+            info[group] = {
+                "dn": entry["distinguishedName"],
+                "sid": _sid(entry["objectSid"]),
+                "group_type": group_type,
+            }
+            if cache is not None:
+                cache.set(dn_cache_key(conn, "group", search_base, group), info[group])
+
+    for group in groups:
+        if group not in info:
+            logging.error(f"entry {group} not found")
+            info[group] = None
+    return info
+
+
+def token_groups(conn, user_dn) -> set | None:
+    """The SIDs of the security groups (also nested) of an entry, from its tokenGroups
+
+    None if the attribute is not available (e.g. in a snapshot)
+    """
+    import ldap3
+
+    sids = set()
+    # tokenGroups is computed by the DC and can only be read with a base search
+    for entry in iter_entries(
+        conn, user_dn, "(objectClass=*)", limit=1, attributes=["tokenGroups"], search_scope=ldap3.BASE
+    ):
+        values = entry["attributes"].get("tokenGroups") or []
+        sids.update(_sid(v) for v in (values if isinstance(values, list) else [values]))
+    # every account has at least its primary group
+    return sids or None
+
+
+@stats.instrumented
+def group_memberships(conn, search_base, user, groups, graph=None):
+    """Check if a user is a (also nested) member of each of the groups
+
+    Returns a dict group -> True/False (None if the group is not found),
+    None if the user is not found. The security groups are checked with one
+    read of the tokenGroups of the user, compared to the (cached) objectSid
+    of the groups; the distribution groups with one in-chain search each.
+    With a GroupGraph the memberships are resolved locally
+    """
     user_dn = get_dn(conn, search_base, user)
     if not user_dn:
         return None
 
-    search_filter = f"(&(memberOf:1.2.840.113556.1.4.1941:={group_dn})(objectCategory=person)(objectClass=user)(distinguishedName={user_dn}))"
-    result = search(conn, search_base, search_filter)
-    return True if len(result) == 1 else False
+    groups = list(groups)
+    info = _groups_info(conn, search_base, groups)
+    if graph is not None:
+        return {
+            group: None if info[group] is None else bool(graph.is_member(info[group]["dn"], user_dn))
+            for group in groups
+        }
+
+    security = [i for i in info.values() if i and i["group_type"] & GROUP_TYPE_SECURITY_ENABLED]
+    sids = token_groups(conn, user_dn) if security else None
+    result = {}
+    for group in groups:
+        i = info[group]
+        if i is None:
+            result[group] = None
+        elif sids is not None and i["group_type"] & GROUP_TYPE_SECURITY_ENABLED:
+            result[group] = i["sid"] in sids
+        else:
+            result[group] = _in_chain_member(conn, search_base, i["dn"], user_dn)
+    return result
+
+
+def _chunks(values: list, size: int):
+    for i in range(0, len(values), size):
+        yield values[i : i + size]
+
+
+# an escaped character of a DN value: \, or \2c
+_DN_ESCAPE = re.compile(r"\\([0-9a-fA-F]{2}|.)", re.DOTALL)
+
+
+def _unescape_dn_value(value: str) -> str:
+    data = bytearray()
+    position = 0
+    for match in _DN_ESCAPE.finditer(value):
+        data += value[position : match.start()].encode("utf-8")
+        escaped = match.group(1)
+        data += bytes.fromhex(escaped) if len(escaped) == 2 else escaped.encode("utf-8")
+        position = match.end()
+    data += value[position:].encode("utf-8")
+    return data.decode("utf-8", errors="replace")
+
+
+def _dn_key(dn: str) -> str:
+    """The DN without differences of case, spaces and escaping, to compare DNs"""
+    from ldap3.core.exceptions import LDAPInvalidDnError
+    from ldap3.utils.dn import parse_dn
+
+    try:
+        rdns = parse_dn(dn, strip=True)
+    except LDAPInvalidDnError:
+        return dn.strip().lower()
+    return "".join(
+        f"{attribute.lower()}={_unescape_dn_value(value).lower()}{separator}"
+        for attribute, value, separator in rdns
+    )
+
+
+def _resolve_dns(conn, search_base, identities, chunk_size):
+    """Resolve DNs and sAMAccountNames to DNs with batched searches
+
+    Returns a dict _dn_key(dn) -> dn and the list of identities not found
+    """
+    dns = {}
+    names = []
+    for identity in identities:
+        if identity.lower().startswith("cn="):
+            dns[_dn_key(identity)] = identity
+        else:
+            names.append(identity)
+
+    found = set()
+    for entry in iter_search_many(
+        conn,
+        search_base,
+        "sAMAccountName",
+        names,
+        chunk_size=chunk_size,
+        attributes=["sAMAccountName", "distinguishedName"],
+    ):
+        found.add(entry["sAMAccountName"].lower())
+        dns[_dn_key(entry["distinguishedName"])] = entry["distinguishedName"]
+    unresolved = [name for name in names if name.lower() not in found]
+    return dns, unresolved
+
+
+@stats.instrumented
+def sync_members(
+    conn,
+    search_base,
+    group,
+    identities,
+    chunk_size: int = 500,
+    dry_run: bool = False,
+    allow_empty: bool = False,
+):
+    """Make the (direct) members of a group equal to the given identities
+
+    The identities are DNs or sAMAccountNames. Only the missing members are
+    added and only the extra ones are removed, in chunks of chunk_size.
+    Nothing is changed if some identities cannot be resolved (they could
+    be current members) or, unless allow_empty, if there are no identities
+    """
+    identities = [i.strip() for i in identities if i.strip()]
+    if not identities and not allow_empty:
+        logging.error(f"no identities for group {group}: refusing to remove all its members")
+        return None
+
+    group_dn = get_dn(conn, search_base, group)
+    if not group_dn:
+        return None
+
+    desired, unresolved = _resolve_dns(conn, search_base, identities, chunk_size)
+    for identity in unresolved:
+        logging.error(f"entry {identity} not found")
+
+    current = {_dn_key(dn): dn for dn in iter_range(conn, group_dn, "member")}
+
+    to_add = [dn for key, dn in desired.items() if key not in current]
+    to_remove = [dn for key, dn in current.items() if key not in desired]
+    logging.info(
+        f"group {group}: {len(current)} members, {len(to_add)} to add, {len(to_remove)} to remove"
+    )
+
+    result = {
+        "group": group_dn,
+        "added": to_add,
+        "removed": to_remove,
+        "unresolved": unresolved,
+        "success": True,
+    }
+    if dry_run:
+        return result
+    if unresolved:
+        logging.error(f"group {group}: {len(unresolved)} identities not found, nothing changed")
+        result.update(added=[], removed=[], success=False)
+        return result
+
+    try:
+        for chunk in _chunks(to_add, chunk_size):
+            with stats.timed("modify"):
+                done = conn.extend.microsoft.add_members_to_groups(chunk, [group_dn], fix=False)
+            if not done:
+                result["success"] = False
+                return result
+        for chunk in _chunks(to_remove, chunk_size):
+            with stats.timed("modify"):
+                done = conn.extend.microsoft.remove_members_from_groups(chunk, [group_dn], fix=False)
+            if not done:
+                result["success"] = False
+                return result
+        return result
+    finally:
+        if to_add or to_remove:
+            invalidate_results(search_base)
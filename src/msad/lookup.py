@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Bulk lookup of identities (sAMAccountName, mail or userPrincipalName)
+
+    for row in lookup(lambda: new_connection(), "dc=example,dc=com", ["matteo", "ann@example.com"]):
+        print(row)
+"""
+
+import contextvars
+import logging
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import stats
+from .filters import and_, eq, or_
+from .pool import ConnectionPool
+from .search import iter_entries
+
+# the attributes an identity is compared to
+MATCH_ATTRIBUTES = ["sAMAccountName", "mail", "userPrincipalName"]
+
+BATCH_SIZE = 200
+
+# the attributes written when none is requested to the outputs with a fixed header (csv, tsv)
+HEADER_ATTRIBUTES = ["distinguishedName", "sAMAccountName", "mail", "userPrincipalName", "displayName"]
+
+
+def _values(attributes, name: str) -> list:
+    value = attributes.get(name)
+    if isinstance(value, list):
+        return value
+    return [] if value is None else [value]
+
+
+def _batches(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _search(pool, search_base, identities: set, search_filter, attributes) -> dict:
+    """The entries matching the identities (lowercase), as a dict identity -> attributes"""
+    values_filter = or_(
+        *(eq(attribute, identity) for identity in sorted(identities) for attribute in MATCH_ATTRIBUTES)
+    )
+    found = {}
+    with pool.connection() as conn:
+        for entry in iter_entries(
+            conn, search_base, and_(search_filter, values_filter), attributes=attributes
+        ):
+            for attribute in MATCH_ATTRIBUTES:
+                for value in _values(entry["attributes"], attribute):
+                    key = str(value).lower()
+                    if key not in identities:
+                        continue
+                    if key in found and found[key]["dn"] != entry["dn"]:
+                        logging.warning(f"{value} matches {found[key]['dn']} and {entry['dn']}: using the first one")
+                        continue
+                    found[key] = entry
+    return found
+
+
+@stats.instrumented
+def lookup(
+    connection_factory,
+    search_base,
+    rows,
+    key=None,
+    attributes=None,
+    search_filter="",
+    batch_size: int = BATCH_SIZE,
+    workers: int = 2,
+    unmatched=None,
+):
+    """Join rows to the entries whose sAMAccountName, mail or userPrincipalName is their identity
+
+    rows are identities or dicts having the identity in key. Each batch of
+    batch_size identities is searched with one OR-filter, up to workers
+    batches at a time on a pool of connections, while the previous ones are
+    yielded. Rows are yielded in order (a dict {"identity": ...} for plain
+    identities), with the attributes of the entry found added to them:
+    the identities not found are logged and appended to unmatched (a list)
+    """
+    pool = ConnectionPool(connection_factory, size=workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    wanted = {a.lower() for a in attributes} if attributes else None
+    fetched = None
+    if attributes:
+        # the identities are matched locally too
+        fetched = list(attributes) + [a for a in MATCH_ATTRIBUTES if a.lower() not in wanted]
+
+    def _record(row):
+        return dict(row) if key is not None else {"identity": row}
+
+    def _identity(row) -> str:
+        return str((row.get(key) if key is not None else row) or "").strip()
+
+    def _join(batch, future):
+        found = future.result()
+        for row in batch:
+            record = _record(row)
+            identity = _identity(row)
+            entry = found.get(identity.lower())
+            if entry is None:
+                if identity:
+                    logging.error(f"entry {identity} not found")
+                    if unmatched is not None:
+                        unmatched.append(identity)
+            else:
+                for name, value in entry["attributes"].items():
+                    if (wanted is None or name.lower() in wanted) and name not in record:
+                        record[name] = value
+            yield record
+
+    pending = deque()
+    try:
+        for batch in _batches(rows, batch_size):
+            identities = {_identity(row).lower() for row in batch} - {""}
+            if identities:
+                # the searches see the context of the caller (e.g. for msad.stats)
+                future = executor.submit(
+                    contextvars.copy_context().run, _search, pool, search_base, identities, search_filter, fetched
+                )
+            else:
+                future = executor.submit(dict)
+            pending.append((batch, future))
+            while len(pending) > workers:
+                yield from _join(*pending.popleft())
+        while pending:
+            yield from _join(*pending.popleft())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        pool.close()
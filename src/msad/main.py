@@ -16,18 +16,24 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>
 
+import csv
+import json
 import logging
-import datetime
 import os
-import json
-import ssl
 import sys
 import tomllib
 
+import click
 import typer
 
 import msad
-import ldap3
+import msad.cache
+import msad.daemon
+import msad.filters
+import msad.graph
+import msad.output
+import msad.stats
+import msad.usage
 
 from pathlib import Path
 
@@ -36,9 +42,7 @@ BANNER = """
 
 """
 
-logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
-logging.info(BANNER)
-    
+
 def _get_domain_config(config: dict|None, domain: str|None):
     if "defaults" not in config:
         logging.error(f"Missing entry 'defaults' in config file. Bye!")
@@ -67,12 +71,15 @@ def _get_domain_config(config: dict|None, domain: str|None):
 
     domain_config = config["domains"][domain]
     for field in ["host", "port", "search_base", "use_ssl"]:
+        if field == "host" and "hosts" in domain_config:
+            continue
         if field not in domain_config:
             logging.error(f"Missing required field '{field}' in section 'domains.{domain}' in config file. Bye!")
             sys.exit(105)
-    return domain_config
+    return dict(domain_config, domain=domain)
         
-def _get_config(domain: str|None, config_file: str|None):
+def _read_config_file(config_file: str|None) -> dict:
+    """Read the config file (default ~/.msad.toml), exiting if it is missing or not readable"""
     if not config_file:
         home = Path.home()
         config_file = home / ".msad.toml"
@@ -85,77 +92,166 @@ def _get_config(domain: str|None, config_file: str|None):
         logging.error(f"File {config_file} is not readable. Bye!")
         sys.exit(2)
     
-    """Read config file"""
     with open(config_file, "rb") as f:
-        data = tomllib.load(f)
-        return _get_domain_config(data, domain)
-
-def _json_converter(o):
-    if isinstance(o, datetime.datetime):
-        return o.__str__()
-    elif isinstance(o, list):
-        return ";".join(o)
-    # else return o
+        return tomllib.load(f)
 
+def _get_config(domain: str|None, config_file: str|None):
+    """Read the configuration of a domain (default: the one in section defaults)"""
+    return _get_domain_config(_read_config_file(config_file), domain)
+
+def _get_hosts(config: dict) -> list:
+    """The domain controllers of a domain: host can be a name or a list of names"""
+    hosts = config.get("hosts") or config["host"]
+    return [hosts] if isinstance(hosts, str) else list(hosts)
+
+def _get_server(config: dict, tls=None):
+    """The server of the domain or, with many hosts, a pool of servers"""
+    import msad.schema
+    import msad.servers
+
+    hosts = _get_hosts(config)
+    if len(hosts) == 1:
+        return msad.schema.get_server(hosts[0], port=config["port"], use_ssl=config["use_ssl"], tls=tls)
+    return msad.servers.get_server_pool(hosts,
+                                        port=config["port"],
+                                        use_ssl=config["use_ssl"],
+                                        tls=tls,
+                                        strategy=config.get("pool_strategy", "first"),
+                                        connect_timeout=config.get("connect_timeout"))
+
+def _get_connection_krb(config: dict, **options):
+    import ssl
+    import ldap3
 
-def _get_connection_krb(host: str, port: int, use_ssl: bool):
     tls = ldap3.Tls(validate=ssl.CERT_NONE, version=ssl.PROTOCOL_TLSv1_2)
-    server = ldap3.Server(host, port=port, use_ssl=use_ssl, tls=tls)
+    server = _get_server(config, tls=tls)
 
     conn = ldap3.Connection(
         server,
         authentication=ldap3.SASL,
         sasl_mechanism=ldap3.KERBEROS,
         auto_bind=False,
+        **options,
     )
     # conn.bind()
     return conn
 
 
-def _get_connection_user_pwd(host: str, port: int, use_ssl: bool, user: str, password: str):
-    server = ldap3.Server(host, port=port, use_ssl=use_ssl)
+def _get_connection_user_pwd(config: dict, **options):
+    import ldap3
+
+    server = _get_server(config)
 
-    conn = ldap3.Connection(server, user=user, password=password, auto_bind=False)
+    conn = ldap3.Connection(server, user=config["user"], password=config["password"], auto_bind=False, **options)
     # conn.bind()
     return conn
 
 
-def _get_connection(config: dict):
+def _new_connection(config: dict):
+    import ldap3
+    import msad.schema
+    import msad.servers
+
+    options = {}
+    hosts = _get_hosts(config)
+    if len(hosts) > 1:
+        # failed operations are sent again, to the next available DC
+        options["client_strategy"] = ldap3.RESTARTABLE
     if "user" in config and "password" in config:
-        conn = _get_connection_user_pwd(config["host"],
-                                        config["port"],
-                                        config["use_ssl"],
-                                        config["user"],
-                                        config["password"])
+        conn = _get_connection_user_pwd(config, **options)
     else:
-        conn = _get_connection_krb(config["host"],
-                                   config["port"],
-                                   config["use_ssl"])
-    conn.bind()
+        conn = _get_connection_krb(config, **options)
+    if len(hosts) > 1:
+        msad.servers.restartable(conn, tries=config.get("retries", len(hosts)))
+    with msad.stats.timed("bind"):
+        conn.bind()
+    try:
+        with msad.stats.timed("schema"):
+            msad.schema.refresh(conn)
+    except Exception as error:
+        logging.warning(f"Cannot refresh the schema cache: {error}")
     return conn
 
-def _pprint(ldapresult, out_format="json", sep="\t"):
-    if not ldapresult or out_format == "default":
-        return ldapresult
-    elif out_format == "json1":
-        return json.dumps(dict(ldapresult))
-    else:
-        result = ""
-        for obj in ldapresult:
-            if out_format == "json":
-                result = (
-                    result + json.dumps(dict(obj), default=_json_converter) + "\n"
-                )
-            elif out_format == "csv":
-                sorted_obj = dict(sorted(obj.items()))
-                new_values = list(
-                    map(
-                        lambda v: "|".join(v) if isinstance(v, list) else v,
-                        sorted_obj.values(),
-                    )
-                )
-                result = result + sep.join(new_values) + "\n"
-        return result
+def _get_connection(config: dict):
+    daemon = msad.daemon.current()
+    if daemon:
+        return daemon.get_connection(config)
+    return _new_connection(config)
+
+def _get_source(config: dict, offline: bool = False):
+    """A connection or, if offline, the snapshot of the domain"""
+    import msad.snapshot
+
+    if not offline:
+        return _get_connection(config)
+    try:
+        return msad.snapshot.Snapshot(config.get("snapshot") or msad.snapshot.default_path(config["domain"]))
+    except (FileNotFoundError, ValueError) as error:
+        logging.error(error)
+        sys.exit(11)
+
+def _get_configs(config_file: str|None):
+    """Read the configurations of all domains"""
+    data = _read_config_file(config_file)
+    return {domain: _get_domain_config(data, domain) for domain in data.get("domains", {})}
+
+def _get_domains_configs(domains: str|None, all_domains: bool, config_file: str|None):
+    """The configurations of the domains selected with --domains or --all-domains, None if not used"""
+    if not domains and not all_domains:
+        return None
+    configs = _get_configs(config_file)
+    if all_domains:
+        return list(configs.values())
+    names = [name.strip() for name in domains.split(",") if name.strip()]
+    for name in names:
+        if name not in configs:
+            logging.error(f"Missing section '{name}' in section 'domains' in config file. Bye!")
+            sys.exit(104)
+    return [configs[name] for name in names]
+
+def _fan_out(configs: list, function):
+    """Run function(config) for all domains concurrently, merging the records tagged with their domain"""
+    import msad.parallel
+
+    def _task(config):
+        def _run():
+            for record in function(config) or []:
+                record = dict(record)
+                record["domain"] = config["domain"]
+                yield record
+        return _run
+    return msad.parallel.iter_concurrently([_task(config) for config in configs], workers=len(configs))
+
+def _run_on_domains(function, domain, domains, all_domains, config_file):
+    configs = _get_domains_configs(domains, all_domains, config_file)
+    if configs:
+        return _fan_out(configs, function)
+    return function(_get_config(domain, config_file))
+
+def _stdout():
+    return msad.daemon.client_stream() or sys.stdout
+
+def _fields(attributes: list, domains: str|None, all_domains: bool):
+    """The output fields, with the domain tag when querying many domains"""
+    if attributes and (domains or all_domains):
+        return list(attributes) + ["domain"]
+    return attributes
+
+def _paging(config: dict, page_size: int|None, prefetch: int|None):
+    """The page size and prefetch of the command line, or else of the domain config"""
+    return {
+        "page_size": page_size or config.get("page_size"),
+        "prefetch": prefetch if prefetch is not None else config.get("prefetch", 0),
+    }
+
+def _output(result, out_format="json", attributes=None):
+    if result is None:
+        return
+    try:
+        msad.output.write_records(result, out_format, stream=_stdout(), fields=attributes)
+    except ValueError as error:
+        logging.error(error)
+        sys.exit(10)
 
     # def users(self, user):
     #     """Find users inside AD. The
@@ -213,16 +309,168 @@ def _pprint(ldapresult, out_format="json", sep="\t"):
 
 
 
+def _log_cache_stats(cache):
+    cache_stats = cache.stats()
+    if cache_stats["hit_ratio"] is not None:
+        logging.info(f"result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                     f"hit ratio {cache_stats['hit_ratio']}")
+
+def _summary(collector, result_cache=None) -> dict:
+    summary = collector.summary()
+    if result_cache is not None:
+        summary["result_cache"] = result_cache.stats()
+    return summary
+
+def _invalidate_results(config: dict):
+    """Remove the results cached on disk for the domain, also by the commands run without --result-ttl"""
+    cache = msad.cache.get_result_cache(shared=True)
+    path = msad.cache.CACHE_DIR / "results.sqlite"
+    if cache is None and path.exists():
+        cache = msad.cache.Cache(path=path)
+    msad.invalidate_results(config["search_base"], cache)
+
+def _forward(offline: bool = False):
+    """Run the current command in the msad daemon, if one is listening and the options allow it"""
+    ctx = click.get_current_context()
+    # snapshots need no connection, and their paths are relative to the client
+    if (offline
+        or not ctx.meta.get("msad.forward")
+        or ctx.info_name not in msad.daemon.FORWARDED_COMMANDS):
+        return
+    code = msad.daemon.forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+
 app = typer.Typer()
 
+@app.callback()
+def main(ctx: typer.Context,
+         no_cache: bool = typer.Option(False, help="Do not use the cache of DNs"),
+         cache_ttl: int = typer.Option(86400, help="Seconds the resolved DNs are cached on disk"),
+         result_ttl: int = typer.Option(0, help="Seconds the results of identical searches are reused (0: not cached)"),
+         refresh: bool = typer.Option(False, help="Search again, updating the cached results"),
+         strict: bool = typer.Option(False, help="Refuse the filters needing a full scan of the directory (not indexed attributes, leading wildcards, negations, bitwise rules) instead of warning"),
+         no_daemon: bool = typer.Option(False, help="Do not forward the command to a running msad daemon"),
+         stats: bool = typer.Option(False, help="Print the LDAP operations, entries, bytes and latencies (json) to stderr")):
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+    if msad.daemon.current():
+        # a forwarded command: the caches of the daemon, with the options of the command
+        token = msad.cache.set_request_caches(None if no_cache else cache_ttl, result_ttl, refresh)
+        ctx.call_on_close(lambda: msad.cache.reset_request_caches(token))
+        return
+    logging.debug(BANNER)
+    msad.filters.set_strict(strict)
+    result_cache = None
+    if ctx.invoked_subcommand == "serve":
+        # the daemon keeps the results in memory, for the commands asking for them with --result-ttl
+        result_cache = msad.cache.Cache(maxsize=msad.cache.RESULT_CACHE_SIZE, ttl=result_ttl)
+        msad.cache.set_result_cache(result_cache)
+    elif result_ttl > 0:
+        result_cache = msad.cache.Cache(maxsize=msad.cache.RESULT_CACHE_SIZE, ttl=result_ttl,
+                                        path=msad.cache.CACHE_DIR / "results.sqlite")
+        msad.cache.set_result_cache(result_cache, refresh=refresh)
+        ctx.call_on_close(lambda: _log_cache_stats(result_cache))
+    if stats:
+        collector = msad.stats.enable()
+        ctx.call_on_close(lambda: print(json.dumps(_summary(collector, result_cache)), file=sys.stderr))
+    # the command forwards itself once its options are parsed (see _forward)
+    ctx.meta["msad.forward"] = not (no_daemon or stats or strict or ctx.resilient_parsing)
+    if no_cache:
+        msad.cache.set_dn_cache(None)
+    else:
+        msad.cache.set_dn_cache(
+            msad.cache.Cache(ttl=cache_ttl, path=msad.cache.CACHE_DIR / "dn_cache.sqlite"))
+
+@app.command()
+def audit(filter: str = typer.Option("", help="Extra LDAP condition on the accounts, e.g. (department=IT)"),
+          max_age: int = typer.Option(90, help="Days after which a password is expired"),
+          stale_days: int = typer.Option(90, help="Days without logon after which an account is stale"),
+          flagged_only: bool = typer.Option(False, help="Only the accounts having at least one flag"),
+          domain: str|None = None,
+          config_file: str|None = None,
+          out_format: str = "json",
+          offline: bool = typer.Option(False, help="Answer from the local snapshot (see 'msad snapshot')"),
+          page_size: int|None = typer.Option(None, help="Entries per page (default: page_size of the domain or 1000)"),
+          prefetch: int|None = typer.Option(None, help="Pages requested in background while the current one is written (default: prefetch of the domain or 0)")):
+    """Flag the disabled, locked, never expiring, expired password and stale accounts with one scan; the counts go to stderr"""
+    config = _get_config(domain, config_file)
+    conn = _get_source(config, offline)
+    counts = {}
+    result = msad.user.audit_users(conn, config["search_base"],
+                                   max_age=max_age,
+                                   stale_days=stale_days,
+                                   search_filter=filter,
+                                   counts=counts,
+                                   **_paging(config, page_size, prefetch))
+    if flagged_only:
+        result = (r for r in result if any(r[flag] for flag in msad.user.AUDIT_FLAGS))
+    _output(result, out_format)
+    print(json.dumps(counts), file=sys.stderr)
+
+@app.command()
+def cache_clear(entry: str|None = None,
+                domain: str|None = None,
+                config_file: str|None = None,
+                results: bool = typer.Option(False, help="Remove the cached search results of the domain (see --result-ttl)")):
+    """Remove an entry (sAMAccountName) or all the entries of a domain from the cache of DNs"""
+    config = _get_config(domain, config_file)
+    if results:
+        _invalidate_results(config)
+        return
+    msad.invalidate_dn(config["search_base"], entry)
+
 @app.command()
 def change_password(user: str,
                     domain: str|None = None,
                     config_file: str|None = None):
-    config = _get_config(config_file, domain)
+    config = _get_config(domain, config_file)
     conn = _get_connection(config)
-    return msad.user.change_password(
+    result = msad.user.change_password(
         conn, config["search_base"], user)
+    _invalidate_results(config)
+    return result
+
+def _read_lines(file: str):
+    """Read the lines of a file or of stdin if file is '-'"""
+    if file == "-":
+        yield from (line.rstrip("\n") for line in sys.stdin)
+        return
+    with open(file, encoding="utf-8") as f:
+        yield from (line.rstrip("\n") for line in f)
+
+def _read_csv(file: str, delimiter: str = ","):
+    """The header and the rows (dicts) of a CSV file or of stdin if file is '-'"""
+    f = sys.stdin if file == "-" else open(file, encoding="utf-8", newline="")
+    reader = csv.DictReader(f, delimiter=delimiter)
+    fields = reader.fieldnames or []
+
+    def _rows():
+        try:
+            yield from reader
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+    return fields, _rows()
+
+@app.command()
+def check_users(file: str = "-",
+                max_age: int = 90,
+                groups: list[str] = [],
+                chunk_size: int = 200,
+                domain: str|None = None,
+                config_file: str|None = None,
+                out_format: str = "json"):
+    """Check many users (one sAMAccountName per line in a file or stdin): disabled? locked? password expired? group memberships"""
+    config = _get_config(domain, config_file)
+    conn = _get_connection(config)
+    result = msad.user.check_users(conn,
+                                   config["search_base"],
+                                   _read_lines(file),
+                                   max_age,
+                                   groups=groups,
+                                   chunk_size=chunk_size)
+    _output(result, out_format)
 
 @app.command()
 def group_add_member(group: str,
@@ -231,7 +479,8 @@ def group_add_member(group: str,
                      config_file: str|None = None):
     """Adds the user to a group (using DN or sAMAccountName)"""
     
-    config = _get_config(config_file, domain)
+    _forward()
+    config = _get_config(domain, config_file)
     conn = _get_connection(config)
     result =  msad.add_member(
         conn=conn,
@@ -239,6 +488,7 @@ def group_add_member(group: str,
         group=group,
         user=user,
     )
+    _invalidate_results(config)
     return result
 
 @app.command()
@@ -248,7 +498,8 @@ def group_remove_member(group: str,
                      config_file: str|None = None):
     """Remove the user to a group (using DN or sAMAccountName)"""
     
-    config = _get_config(config_file, domain)
+    _forward()
+    config = _get_config(domain, config_file)
     conn = _get_connection(config)
     result =  msad.remove_member(
         conn=conn,
@@ -256,6 +507,7 @@ def group_remove_member(group: str,
         group=group,
         user=user,
     )
+    _invalidate_results(config)
     return result
 
 @app.command()
@@ -265,61 +517,249 @@ def group_members(group: str,
                   domain: str|None = None,
                   config_file: str|None = None,
                   out_format: str = "json",
-                  attributes: list[str] = []):
+                  attributes: list[str] = [],
+                  graph: bool = typer.Option(False, help="Resolve nested memberships locally from one scan of all groups"),
+                  offline: bool = typer.Option(False, help="Answer from the local snapshot (see 'msad snapshot')"),
+                  domains: str|None = typer.Option(None, help="Comma separated domains queried concurrently"),
+                  all_domains: bool = typer.Option(False, help="Query all the configured domains concurrently")):
     
-    config = _get_config(config_file, domain)
-    conn = _get_connection(config)
-    if nested:
-        result = msad.group_flat_members(
-            conn,
-            config["search_base"],
-            limit,
-            group,
-            attributes=attributes,
-        )
-    else:
-        """Extract the direct members of a group"""
-        result = msad.group_members(
-            conn,
-            config["search_base"],
-            group)
-    print(_pprint(result))
+    _forward(offline)
+
+    def _group_members(config):
+        conn = _get_source(config, offline)
+        if nested:
+            return msad.group_flat_members(
+                conn,
+                config["search_base"],
+                limit,
+                group,
+                attributes=attributes,
+                graph=msad.graph.GroupGraph.load(conn, config["search_base"]) if graph else None,
+            )
+        else:
+            """Extract the direct members of a group"""
+            return msad.group_members(
+                conn,
+                config["search_base"],
+                group)
+
+    result = _run_on_domains(_group_members, domain, domains, all_domains, config_file)
+    _output(result, out_format, _fields(attributes, domains, all_domains))
     
+@app.command()
+def group_sync(group: str,
+               from_file: str = "-",
+               chunk_size: int = 500,
+               dry_run: bool = False,
+               allow_empty: bool = typer.Option(False, help="Remove all the members if the file lists no identities"),
+               domain: str|None = None,
+               config_file: str|None = None,
+               out_format: str = "json"):
+    """Make the members of a group equal to the DNs or sAMAccountNames listed in a file (or stdin), unless some are not found"""
+    config = _get_config(domain, config_file)
+    conn = _get_connection(config)
+    result = msad.group.sync_members(conn,
+                                     config["search_base"],
+                                     group,
+                                     _read_lines(from_file),
+                                     chunk_size=chunk_size,
+                                     dry_run=dry_run,
+                                     allow_empty=allow_empty)
+    if not dry_run:
+        _invalidate_results(config)
+    if result is None:
+        sys.exit(1)
+    _output([result], out_format)
+    if not result["success"]:
+        sys.exit(1)
+
 @app.command()
 def search(filter: str,
-           limit: int = 2000,
+           limit: int|None = typer.Option(None, help="Max entries returned (default: 2000, no limit with --since-usn)"),
            domain: str|None = None,
            config_file: str|None = None,
            out_format: str = "json",
-           attributes: list[str] = []):
-    config = _get_config(config_file, domain)
+           attributes: list[str] = [],
+           parallel: int = typer.Option(0, help="Split the search over N connections"),
+           partition_by: str = typer.Option("ou", help="ou (one sub-search per child of search_base) or prefix (per first char of sAMAccountName)"),
+           since_usn: bool = typer.Option(False, help="Only the entries changed since the previous --since-usn run (uSNChanged watermark)"),
+           state_file: str|None = typer.Option(None, help="File with the uSNChanged watermarks"),
+           offline: bool = typer.Option(False, help="Answer from the local snapshot (see 'msad snapshot')"),
+           page_size: int|None = typer.Option(None, help="Entries per page (default: page_size of the domain or 1000)"),
+           prefetch: int|None = typer.Option(None, help="Pages requested in background while the current one is written (default: prefetch of the domain or 0)"),
+           domains: str|None = typer.Option(None, help="Comma separated domains queried concurrently"),
+           all_domains: bool = typer.Option(False, help="Query all the configured domains concurrently")):
+
+    if limit is None:
+        # a delta run must read all the changes to move the watermark
+        limit = 0 if since_usn else 2000
+
+    _forward(offline)
+
+    def _search(config):
+        import msad.delta
+        import msad.parallel
+
+        if offline:
+            conn = _get_source(config, offline)
+            result = msad.iter_search(conn, config["search_base"], filter, limit=limit, attributes=attributes)
+        elif since_usn:
+            conn = _get_connection(config)
+            result = msad.delta.DeltaSearch(conn,
+                                            config["search_base"],
+                                            filter,
+                                            limit=limit,
+                                            attributes=attributes,
+                                            state_file=state_file or msad.delta.STATE_FILE,
+                                            **_paging(config, page_size, prefetch))
+        elif parallel > 0:
+            result = msad.parallel.parallel_search(lambda: _new_connection(config),
+                                                   config["search_base"],
+                                                   filter,
+                                                   limit=limit,
+                                                   attributes=attributes,
+                                                   workers=parallel,
+                                                   partition_by=partition_by,
+                                                   page_size=_paging(config, page_size, prefetch)["page_size"])
+        else:
+            conn = _get_connection(config)
+            result = msad.iter_search(conn, config["search_base"], filter, limit=limit, attributes=attributes,
+                                      **_paging(config, page_size, prefetch))
+        return result
+
+    result = _run_on_domains(_search, domain, domains, all_domains, config_file)
+    _output(result, out_format, _fields(attributes, domains, all_domains))
+
+@app.command()
+def export(filter: str,
+           path: str,
+           out_format: str|None = typer.Option(None, help="ndjson, csv, tsv or parquet (default: from the file extension)"),
+           compression: str|None = typer.Option(None, help="gzip, zstd or none (default: from the file extension)"),
+           attributes: list[str] = [],
+           limit: int = 0,
+           chunk_size: int = typer.Option(10000, help="Rows per parquet row group"),
+           page_size: int|None = typer.Option(None, help="Entries per page (default: page_size of the domain or 1000)"),
+           prefetch: int|None = typer.Option(None, help="Pages requested in background while the current one is written (default: prefetch of the domain or 0)"),
+           domain: str|None = None,
+           config_file: str|None = None):
+    """Export the entries found to a file (or - for stdout), e.g. users.csv.gz, users.ndjson.zst or users.parquet"""
+    import msad.export
+
+    config = _get_config(domain, config_file)
     conn = _get_connection(config)
-    result = msad.search(conn, config["search_base"], filter, limit=limit, attributes=attributes)
-    print(_pprint(result, out_format))
+    try:
+        msad.export.export(conn, config["search_base"], filter, path,
+                           out_format=out_format,
+                           compression=compression,
+                           attributes=attributes,
+                           limit=limit,
+                           chunk_size=chunk_size,
+                           **_paging(config, page_size, prefetch))
+    except (ImportError, ValueError) as error:
+        logging.error(error)
+        sys.exit(10)
 
 @app.command()
-def get_sample_config():
-    output = """
-[defaults]
+def lookup(file: str = "-",
+           column: str|None = typer.Option(None, help="Read the identities from this column of a CSV file with header (default: one identity per line)"),
+           delimiter: str = typer.Option(",", help="Delimiter of the CSV file"),
+           attributes: list[str] = typer.Option([], help="Attributes added to the rows (default: all, or a few for csv/tsv output)"),
+           filter: str = typer.Option("(&(objectCategory=person)(objectClass=user))", help="The objects searched"),
+           batch_size: int = typer.Option(200, help="Identities searched with one OR-filter"),
+           workers: int = typer.Option(2, help="Connections searching the next batches while the results are written"),
+           domain: str|None = None,
+           config_file: str|None = None,
+           out_format: str = "json"):
+    """Find the entries of many sAMAccountNames, mails or userPrincipalNames (in a file or stdin), joined to the input rows"""
+    import msad.lookup
+
+    config = _get_config(domain, config_file)
+    if column:
+        fields, rows = _read_csv(file, delimiter)
+        if column not in fields:
+            logging.error(f"Column {column} not found in {', '.join(fields)}")
+            sys.exit(10)
+    else:
+        fields, rows = ["identity"], (line for line in _read_lines(file) if line.strip())
+    if not attributes and out_format in ["csv", "tsv"]:
+        # the header is written first: it cannot come from the rows, which may be unmatched
+        attributes = msad.lookup.HEADER_ATTRIBUTES
+    unmatched = []
+    result = msad.lookup.lookup(lambda: _new_connection(config),
+                                config["search_base"],
+                                rows,
+                                key=column,
+                                attributes=attributes,
+                                search_filter=filter,
+                                batch_size=batch_size,
+                                workers=workers,
+                                unmatched=unmatched)
+    _output(result, out_format, fields + [a for a in attributes if a not in fields] if attributes else None)
+    if unmatched:
+        logging.warning(f"{len(unmatched)} identities not found")
 
-domain = "mydomain"
+@app.command()
+def effective_groups(domain: str|None = None,
+                     config_file: str|None = None,
+                     out_format: str = "json"):
+    """Extract the groups (also nested) of every member of any group, with one scan of all groups"""
+    config = _get_config(domain, config_file)
+    conn = _get_connection(config)
+    group_graph = msad.graph.GroupGraph.load(conn, config["search_base"])
+    result = ({"distinguishedName": dn, "groups": groups}
+              for dn, groups in group_graph.effective_groups())
+    _output(result, out_format)
 
-[domains]
+@app.command()
+def get_sample_config():
+    print(msad.usage.SAMPLE_CONFIG)
 
-[domains.mydomain]
+@app.command()
+def serve(socket: str|None = None,
+          pool_size: int = 4,
+          max_idle: int = 600,
+          config_file: str|None = None):
+    """Run a daemon keeping bound connections to the configured domains: msad commands are forwarded to it"""
+    daemon = msad.daemon.Daemon(socket or msad.daemon.socket_path(),
+                                pool_size=pool_size,
+                                max_idle=max_idle)
+    daemon.prewarm(_get_configs(config_file))
+    daemon.serve_forever()
 
-host = "example.com"
-search_base = "dc=example,dc=com"
-    
-port = 636
-use_ssl = true
-#port = 389
-#use_ssl = false
+@app.command()
+def snapshot(path: str|None = None,
+             filter: str = "(objectClass=*)",
+             attributes: list[str] = [],
+             domain: str|None = None,
+             config_file: str|None = None,
+             page_size: int|None = typer.Option(None, help="Entries per page (default: page_size of the domain or 1000)"),
+             prefetch: int|None = typer.Option(None, help="Pages requested in background while the current one is written (default: prefetch of the domain or 0)")):
+    """Save the entries of the domain to a local snapshot, used by the commands with --offline"""
+    import msad.snapshot
+
+    config = _get_config(domain, config_file)
+    conn = _get_connection(config)
+    path = path or config.get("snapshot") or msad.snapshot.default_path(config["domain"])
+    msad.snapshot.create_snapshot(conn, config["search_base"], path, filter, attributes=attributes,
+                                  **_paging(config, page_size, prefetch))
 
-# user =
-# password =
-"""
-    print(output)
+@app.command()
+def users(user: str,
+          limit: int = 2000,
+          domain: str|None = None,
+          config_file: str|None = None,
+          out_format: str = "json",
+          attributes: list[str] = [],
+          offline: bool = typer.Option(False, help="Answer from the local snapshot (see 'msad snapshot')"),
+          page_size: int|None = typer.Option(None, help="Entries per page (default: page_size of the domain or 1000)"),
+          prefetch: int|None = typer.Option(None, help="Pages requested in background while the current one is written (default: prefetch of the domain or 0)")):
+    """Search users by sAMAccountName, mail, cn or userPrincipalName (can contain *)"""
+    _forward(offline)
+    config = _get_config(domain, config_file)
+    conn = _get_source(config, offline)
+    result = msad.users(conn, config["search_base"], user, limit, attributes=attributes,
+                        **_paging(config, page_size, prefetch))
+    _output(result, out_format, attributes)
 
 @app.command()
 def user_groups(user: str,
@@ -327,13 +767,23 @@ def user_groups(user: str,
                 limit: int = 2000,
                 domain: str|None = None,
                 config_file: str|None = None,
-                out_format: str = "json"):
+                out_format: str = "json",
+                graph: bool = typer.Option(False, help="Resolve nested memberships locally from one scan of all groups"),
+                offline: bool = typer.Option(False, help="Answer from the local snapshot (see 'msad snapshot')"),
+                domains: str|None = typer.Option(None, help="Comma separated domains queried concurrently"),
+                all_domains: bool = typer.Option(False, help="Query all the configured domains concurrently")):
     
-    config = _get_config(config_file, domain)
-    conn = _get_connection(config)
+    _forward(offline)
+
+    def _user_groups(config):
+        conn = _get_source(config, offline)
+        group_graph = None
+        if nested and graph:
+            group_graph = msad.graph.GroupGraph.load(conn, config["search_base"])
+        return msad.user.user_groups(conn, config["search_base"], limit, user, nested=nested, graph=group_graph)
 
-    result = msad.user.user_groups(conn, config["search_base"], limit, user, nested=nested)
-    print(_pprint(result, out_format))
+    result = _run_on_domains(_user_groups, domain, domains, all_domains, config_file)
+    _output(result, out_format)
 
 if __name__ == "__main__":
     app()
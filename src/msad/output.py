@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import datetime
+import io
+import json
+import sys
+
+FORMATS = ["json", "ndjson", "csv", "tsv", "default"]
+
+# records are buffered and written to the stream in chunks of about this size
+BUFFER_SIZE = 64 * 1024
+
+
+def _json_converter(o):
+    if isinstance(o, datetime.datetime):
+        return o.__str__()
+    elif isinstance(o, bytes):
+        return o.hex()
+    return str(o)
+
+
+def _text(value, list_sep="|"):
+    if isinstance(value, list):
+        return list_sep.join(_text(v) for v in value)
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+class Writer:
+    """Write records to a stream one at a time, flushing in buffered chunks"""
+
+    def __init__(self, stream=None, buffer_size=BUFFER_SIZE):
+        self.stream = stream if stream is not None else sys.stdout
+        self.buffer_size = buffer_size
+        self.count = 0
+        self._buffer = []
+        self._buffered = 0
+
+    def _format(self, record) -> str:
+        raise NotImplementedError
+
+    def write(self, record):
+        line = self._format(record)
+        self._buffer.append(line)
+        self._buffered += len(line)
+        self.count += 1
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        self.flush()
+        return self.count
+
+    def flush(self):
+        if self._buffer:
+            self.stream.write("".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self.stream.flush()
+
+
+class NdjsonWriter(Writer):
+    """One json document per line"""
+
+    def _format(self, record):
+        return json.dumps(dict(record), default=_json_converter) + "\n"
+
+
+class DefaultWriter(Writer):
+    """The python representation of each record"""
+
+    def _format(self, record):
+        return repr(record) + "\n"
+
+
+class CsvWriter(Writer):
+    """Delimited rows with a fixed header
+
+    The header is the list of fields if given, otherwise the sorted keys
+    of the first record. Multi-valued attributes are joined with '|'
+    """
+
+    def __init__(self, stream=None, fields=None, delimiter=",", buffer_size=BUFFER_SIZE):
+        super().__init__(stream, buffer_size)
+        self.fields = list(fields) if fields else None
+        self.delimiter = delimiter
+        self._line = io.StringIO()
+        self._csv = csv.writer(self._line, delimiter=delimiter, lineterminator="\n")
+        self._header_written = False
+
+    def _row(self, values):
+        self._line.seek(0)
+        self._line.truncate()
+        self._csv.writerow(values)
+        return self._line.getvalue()
+
+    def _format(self, record):
+        record = dict(record)
+        header = ""
+        if not self._header_written:
+            if not self.fields:
+                self.fields = sorted(record.keys())
+            header = self._row(self.fields)
+            self._header_written = True
+        # attribute names are case insensitive in LDAP
+        lower = {k.lower(): v for k, v in record.items()}
+        return header + self._row(
+            [_text(lower.get(field.lower())) for field in self.fields]
+        )
+
+
+def get_writer(out_format: str = "json", stream=None, fields=None, buffer_size=BUFFER_SIZE):
+    if out_format in ["json", "ndjson"]:
+        return NdjsonWriter(stream, buffer_size=buffer_size)
+    elif out_format == "csv":
+        return CsvWriter(stream, fields=fields, delimiter=",", buffer_size=buffer_size)
+    elif out_format == "tsv":
+        return CsvWriter(stream, fields=fields, delimiter="\t", buffer_size=buffer_size)
+    elif out_format == "default":
+        return DefaultWriter(stream, buffer_size=buffer_size)
+    raise ValueError(f"Unknown output format '{out_format}'. Use one of {', '.join(FORMATS)}")
+
+
+def write_records(records, out_format: str = "json", stream=None, fields=None):
+    """Write the records to the stream (stdout by default) as they arrive"""
+    if records is None:
+        return 0
+    writer = get_writer(out_format, stream=stream, fields=fields)
+    return writer.write_all(records)
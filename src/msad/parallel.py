@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextvars
+import logging
+import queue
+import string
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import ldap3
+
+from .filters import FilterError, and_, is_strict, like, not_, or_, scan_items
+from .pool import ConnectionPool
+from .search import iter_entries
+
+PARTITIONS = ["ou", "prefix"]
+
+# first characters of sAMAccountName used by the "prefix" partitioning
+PREFIXES = string.ascii_lowercase + string.digits
+
+_DONE = object()
+
+
+def iter_concurrently(tasks, workers: int = 4, queue_size: int = 1000):
+    """Run the tasks (callables returning iterables) in a thread pool
+
+    Items are yielded as soon as any task produces them. The bounded queue
+    caps memory when the consumer is slower than the tasks.
+    """
+    items = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(task):
+        iterable = None
+        try:
+            # a task failing before returning its iterable must be reported too
+            iterable = task()
+            for item in iterable:
+                if not _put(item):
+                    return
+            _put(_DONE)
+        except BaseException as error:
+            _put(error)
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for task in tasks:
+            # the tasks see the context of the caller (e.g. for msad.stats)
+            executor.submit(contextvars.copy_context().run, _run, task)
+        pending = len(tasks)
+        while pending:
+            item = items.get()
+            if item is _DONE:
+                pending -= 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _partitions(conn, search_base, search_filter, partition_by):
+    """Split the search into disjoint (search_base, filter, scope) sub-searches"""
+    if partition_by == "ou":
+        yield (search_base, search_filter, ldap3.BASE)
+        for child in iter_entries(
+            conn,
+            search_base,
+            "(objectClass=*)",
+            attributes=[ldap3.NO_ATTRIBUTES],
+            search_scope=ldap3.LEVEL,
+        ):
+            yield (child["dn"], search_filter, ldap3.SUBTREE)
+    elif partition_by == "prefix":
+        prefixes = [like("sAMAccountName", f"{c}*") for c in PREFIXES]
+        rest = and_(search_filter, not_(or_(*prefixes)))
+        if is_strict() and scan_items(rest):
+            # the negation is indexed only through the other items of the filter
+            raise FilterError(
+                f"partitioning {search_filter} by prefix needs a full scan for the names not starting"
+                " with a letter or a digit: partition it by ou"
+            )
+        for prefix in prefixes:
+            yield (search_base, and_(search_filter, prefix), ldap3.SUBTREE)
+        yield (search_base, rest, ldap3.SUBTREE)
+    else:
+        raise ValueError(f"Unknown partitioning '{partition_by}'. Use one of {', '.join(PARTITIONS)}")
+
+
+def parallel_search(
+    connection_factory,
+    search_base,
+    search_filter,
+    limit=0,
+    attributes=None,
+    workers: int = 4,
+    partition_by: str = "ou",
+    page_size=None,
+):
+    """Run a search as disjoint sub-searches on up to workers connections
+
+    With partition_by "ou" there is one sub-search per child of search_base,
+    with "prefix" one per first character of sAMAccountName.
+    Entries are yielded (attributes only, like iter_search) as they arrive,
+    without duplicates.
+    """
+    pool = ConnectionPool(connection_factory, size=workers)
+
+    def _task(base, sub_filter, scope):
+        def _run():
+            with pool.connection() as conn:
+                yield from iter_entries(
+                    conn,
+                    base,
+                    sub_filter,
+                    limit=limit,
+                    attributes=attributes,
+                    search_scope=scope,
+                    page_size=page_size,
+                )
+
+        return _run
+
+    try:
+        with pool.connection() as conn:
+            tasks = [
+                _task(*partition)
+                for partition in _partitions(conn, search_base, search_filter, partition_by)
+            ]
+        logging.debug(f"search {search_filter} split in {len(tasks)} sub-searches")
+
+        seen = set()
+        for entry in iter_concurrently(tasks, workers=workers):
+            dn = entry["dn"].lower()
+            if dn in seen:
+                continue
+            seen.add(dn)
+            yield entry["attributes"]
+            if limit and len(seen) >= limit:
+                return
+    finally:
+        pool.close()
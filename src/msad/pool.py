@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import queue
+import threading
+import time
+
+from contextlib import contextmanager
+
+from . import stats
+
+
+class ConnectionPool:
+    """A bounded pool of bound connections created by factory()
+
+    Connections idle for more than max_idle seconds (AD closes idle sessions
+    after 15 minutes by default) or found closed are bound again before use.
+    """
+
+    def __init__(self, factory, size: int = 4, max_idle: float = 600):
+        self.factory = factory
+        self.size = size
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+        self._available = threading.BoundedSemaphore(size)
+
+    def _new(self):
+        conn = self.factory()
+        if not conn.bound:
+            with stats.timed("bind"):
+                conn.bind()
+        return conn
+
+    def acquire(self, timeout: float | None = None):
+        """A connection of the pool, waiting for a free one up to timeout seconds (forever if None)"""
+        if not self._available.acquire(timeout=timeout):
+            raise TimeoutError("no free connection in the pool")
+        try:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new()
+            if conn.closed or not conn.bound or time.monotonic() - last_used > self.max_idle:
+                logging.debug("rebinding pooled connection")
+                self._close(conn)
+                return self._new()
+            return conn
+        except BaseException:
+            self._available.release()
+            raise
+
+    def release(self, conn, discard: bool = False):
+        if discard:
+            self._close(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+        self._available.release()
+
+    @contextmanager
+    def connection(self, timeout: float | None = None):
+        from ldap3.core.exceptions import LDAPCommunicationError, LDAPSessionTerminatedByServerError
+
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except (LDAPCommunicationError, LDAPSessionTerminatedByServerError):
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.unbind()
+        except Exception as error:
+            logging.debug(error)
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn)
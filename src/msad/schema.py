@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""On disk cache of the server info and schema used to decode attribute values"""
+
+import json
+import logging
+import os
+import re
+
+import ldap3
+
+from ldap3.protocol.rfc4512 import DsaInfo, SchemaInfo
+
+from .cache import CACHE_DIR
+
+SCHEMA_DIR = CACHE_DIR / "schema"
+
+
+def _paths(server, cache_dir):
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{server.host}_{server.port}")
+    return (
+        os.path.join(cache_dir, f"{name}.info.json"),
+        os.path.join(cache_dir, f"{name}.schema.json"),
+        os.path.join(cache_dir, f"{name}.meta.json"),
+    )
+
+
+def get_server(host, port=None, use_ssl=False, tls=None, cache_dir=SCHEMA_DIR):
+    """A server using the cached info and schema, if any
+
+    Call refresh() once bound to revalidate them
+    """
+    server = ldap3.Server(host, port=port, use_ssl=use_ssl, tls=tls, get_info=ldap3.NONE)
+    info_file, schema_file, _ = _paths(server, cache_dir)
+    if os.path.isfile(info_file) and os.path.isfile(schema_file):
+        try:
+            server.attach_dsa_info(DsaInfo.from_file(info_file))
+            server.attach_schema_info(SchemaInfo.from_file(schema_file))
+        except Exception as error:
+            logging.warning(f"Ignoring invalid schema cache for {host}: {error}")
+            server._dsa_info = None
+            server._schema_info = None
+    return server
+
+
+def _schema_timestamp(conn):
+    """The modifyTimestamp of the schema naming context, changed by any schema update"""
+    info = conn.server.info
+    if not info or "schemaNamingContext" not in info.other:
+        return None
+    schema_dn = info.other["schemaNamingContext"][0]
+    if not conn.search(schema_dn, "(objectClass=*)", ldap3.BASE, attributes=["modifyTimestamp"]):
+        return None
+    value = conn.response[0]["attributes"].get("modifyTimestamp")
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return str(value) if value else None
+
+
+def refresh(conn, cache_dir=SCHEMA_DIR, force: bool = False):
+    """Download and save the server info and schema if missing or changed"""
+    server = conn.server
+    info_file, schema_file, meta_file = _paths(server, cache_dir)
+    meta = {}
+    if os.path.isfile(meta_file):
+        with open(meta_file, encoding="utf-8") as f:
+            meta = json.load(f)
+
+    if not force and server.info and server.schema:
+        timestamp = _schema_timestamp(conn)
+        if timestamp and timestamp == meta.get("modifyTimestamp"):
+            return
+        logging.info(f"schema of {server.host} changed, downloading it")
+
+    server.get_info = ldap3.ALL
+    server.get_info_from_server(conn)
+    if not server.info or not server.schema:
+        logging.warning(f"cannot read the schema of {server.host}")
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    server.info.to_file(info_file)
+    server.schema.to_file(schema_file)
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump({"modifyTimestamp": _schema_timestamp(conn)}, f)
@@ -16,10 +16,25 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
-import ldap3
+import time
+
+from . import stats
+from .cache import get_dn_cache, get_result_cache, refreshing
+from .filters import and_, bit_and, eq, ge, like, or_, prepare
+
+# entries per page of the paged searches (the default MaxPageSize of AD)
+PAGE_SIZE = 1000
+
+# larger results are not kept in the result cache
+RESULT_MAX_ENTRIES = 10000
+
+# result codes of a search stopped before its end: sizeLimitExceeded, adminLimitExceeded
+LIMIT_EXCEEDED = (4, 11)
 
 
 def search_old(conn, search_base, search_filter, limit=0, attributes=None):
+    import ldap3
+
     if not attributes:
         attributes = ldap3.ALL_ATTRIBUTES
 
@@ -31,58 +46,373 @@ def search_old(conn, search_base, search_filter, limit=0, attributes=None):
     return result
 
 
-def search(conn, search_base, search_filter, limit=0, attributes=None):
+def iter_entries(
+    conn,
+    search_base,
+    search_filter,
+    limit=0,
+    attributes=None,
+    search_scope=None,
+    page_size=None,
+    prefetch=0,
+    cached=True,
+    status=None,
+):
+    """Stream the entries found (dicts with dn and attributes), page by page
+
+    conn can also be an offline source (e.g. a snapshot.Snapshot).
+    search_scope defaults to ldap3.SUBTREE, page_size to PAGE_SIZE.
+    With prefetch > 0 a background thread requests the next pages (up to
+    prefetch pages ahead) while the current one is consumed: conn must not
+    be used for anything else until the iteration ends.
+    The filter is optimized and checked with filters.prepare.
+    If a result cache is set (cache.set_result_cache) and cached is True,
+    the entries of the same search are reused until they expire.
+    status (a dict) gets "truncated": True if the server stopped the
+    search before its end (size or admin limit): the cache is not used then
+    """
+    import ldap3
+
     if not attributes:
         attributes = ldap3.ALL_ATTRIBUTES
+    if search_scope is None:
+        search_scope = ldap3.SUBTREE
+    search_filter = prepare(search_filter)
+
+    offline = getattr(conn, "iter_entries", None)
+    if offline is not None:
+        yield from offline(
+            search_base, search_filter, limit=limit, attributes=attributes, search_scope=search_scope
+        )
+        return
+
+    cache = get_result_cache() if cached and status is None else None
+    if cache is not None:
+        key = _result_key(search_base, search_filter, limit, attributes, search_scope)
+        if not refreshing():
+            # the results cached with a longer ttl (by another command or run) count if younger than ours
+            entries = cache.get(key, max_age=cache.ttl)
+            if entries is not None:
+                stats.record("cache_hit", 0.0, len(entries))
+                yield from entries
+                return
+
+    def _pages():
+        return _iter_pages(
+            conn, search_base, search_filter, limit, attributes, search_scope, page_size or PAGE_SIZE, status
+        )
+
+    if prefetch > 0:
+        from .parallel import iter_concurrently
+
+        pages = iter_concurrently([_pages], workers=1, queue_size=prefetch)
+    else:
+        pages = _pages()
+    if cache is None:
+        for page in pages:
+            yield from page
+        return
+
+    # kept only if the search is read to the end
+    entries = []
+    for page in pages:
+        if entries is not None:
+            entries.extend(page)
+            if len(entries) > RESULT_MAX_ENTRIES:
+                entries = None
+        yield from page
+    if entries is not None:
+        cache.set(key, entries)
+
 
-    resultgenerator = conn.extend.standard.paged_search(
-        search_base, search_filter, size_limit=limit, attributes=attributes
+def _domain(search_base: str) -> str:
+    """The dc= components of a DN, e.g. dc=example,dc=com"""
+    parts = [p.strip().lower() for p in search_base.split(",")]
+    while parts and not parts[0].startswith("dc="):
+        parts.pop(0)
+    return ",".join(parts)
+
+
+def _result_key(search_base, search_filter, limit, attributes, search_scope) -> tuple:
+    if not isinstance(attributes, (list, tuple)):
+        attributes = [attributes]
+    return (
+        "result",
+        _domain(search_base),
+        search_base.lower(),
+        str(search_scope),
+        search_filter,
+        ",".join(sorted(a.lower() for a in attributes)),
+        str(limit),
     )
-    result = list(resultgenerator)
-    result = list(filter(lambda r: "dn" in r.keys(), result))
-    result = list(map(lambda r: r["attributes"], result))
-    logging.debug(result)
-    return result
 
 
-def users(conn, search_base, string, limit, attributes=None):
+def invalidate_results(search_base, cache=None):
+    """Remove the cached results of all the searches in the domain of search_base, e.g. after a change
+
+    cache defaults to the result cache in use
+    """
+    cache = cache if cache is not None else get_result_cache()
+    if cache is not None:
+        cache.clear(("result", _domain(search_base)))
+
+
+def _send_search(conn, *args, **kwargs):
+    """Run conn.search with any client strategy, returning (response, result)"""
+    result = conn.search(*args, **kwargs)
+    if not conn.strategy.sync:
+        return conn.get_response(result)
+    if conn.strategy.thread_safe:
+        _, result, response, _ = result
+        return response, result
+    return conn.response, conn.result
+
+
+def _iter_pages(conn, search_base, search_filter, limit, attributes, search_scope, page_size, status=None):
+    """Yield the entries found, one list per page"""
+    count = 0
+    pages = 0
+    cookie = None
+    # ldap3 paged_search does the same, but hides the pages
+    auto_referrals = conn.auto_referrals
+    conn.auto_referrals = False
+    try:
+        while True:
+            start = time.perf_counter()
+            response, result = _send_search(
+                conn,
+                search_base,
+                search_filter,
+                search_scope=search_scope,
+                attributes=attributes,
+                size_limit=limit,
+                paged_size=page_size,
+                paged_cookie=cookie,
+            )
+            entries = [r for r in response or [] if "dn" in r]
+            pages += 1
+            count += len(entries)
+            if stats.active():
+                stats.record("search", time.perf_counter() - start, len(entries), stats.entries_size(entries))
+            if status is not None and result and result.get("result") in LIMIT_EXCEEDED:
+                status["truncated"] = True
+            yield entries
+            try:
+                cookie = result["controls"]["1.2.840.113556.1.4.319"]["value"]["cookie"]
+            except (KeyError, TypeError):
+                cookie = None
+            if not cookie:
+                break
+    finally:
+        conn.auto_referrals = auto_referrals
+    logging.debug(f"search {search_filter} returned {count} entries in {pages} pages")
+
+
+@stats.instrumented
+def iter_range(conn, dn, attribute):
+    """Stream the values of a multi-valued attribute (e.g. member) of an entry
+
+    AD returns at most MaxValRange values (1500 or 5000) per search: the
+    values are requested range by range (member;range=0-*, then
+    member;range=1500-* ...) and yielded as they arrive
+    """
+    import ldap3
+
+    offline = getattr(conn, "iter_entries", None)
+    if offline is not None:
+        for entry in offline(dn, "(objectClass=*)", limit=1, attributes=[attribute], search_scope=ldap3.BASE):
+            values = entry["attributes"].get(attribute) or []
+            yield from values if isinstance(values, list) else [values]
+        return
+
+    low = 0
+    # ldap3 would fetch all the ranges before returning (auto_range) and
+    # fails on the ranged names when filling missing attributes (empty_attributes)
+    auto_range, empty_attributes = conn.auto_range, conn.empty_attributes
+    conn.auto_range = conn.empty_attributes = False
+    try:
+        while True:
+            start = time.perf_counter()
+            response, _ = _send_search(
+                conn, dn, "(objectClass=*)", search_scope=ldap3.BASE, attributes=[f"{attribute};range={low}-*"]
+            )
+            entries = [r for r in response or [] if "dn" in r]
+            if stats.active():
+                stats.record("search", time.perf_counter() - start, len(entries), stats.entries_size(entries))
+            if not entries:
+                return
+            values, high = [], "*"
+            for name, value in entries[0]["attributes"].items():
+                base, _, returned = name.partition(";range=")
+                if base.lower() == attribute.lower():
+                    values = value if isinstance(value, list) else [value]
+                    # the whole attribute if returned without range
+                    high = returned.partition("-")[2] or "*"
+            yield from values
+            if high == "*" or not values:
+                return
+            low = int(high) + 1
+    finally:
+        conn.auto_range, conn.empty_attributes = auto_range, empty_attributes
+
+
+def iter_search(
+    conn,
+    search_base,
+    search_filter,
+    limit=0,
+    attributes=None,
+    page_size=None,
+    prefetch=0,
+    cached=True,
+    status=None,
+):
+    """Stream the attributes of the entries found, page by page"""
+    for r in iter_entries(
+        conn,
+        search_base,
+        search_filter,
+        limit=limit,
+        attributes=attributes,
+        page_size=page_size,
+        prefetch=prefetch,
+        cached=cached,
+        status=status,
+    ):
+        yield r["attributes"]
+
+
+def search(conn, search_base, search_filter, limit=0, attributes=None, page_size=None):
+    return list(
+        iter_search(
+            conn, search_base, search_filter, limit=limit, attributes=attributes, page_size=page_size
+        )
+    )
+
+
+@stats.instrumented
+def iter_search_many(
+    conn,
+    search_base,
+    attribute,
+    values,
+    search_filter="",
+    chunk_size=200,
+    attributes=None,
+):
+    """Stream the entries whose attribute matches any of the values
+
+    The values are searched in chunks with one OR-filter per chunk.
+    search_filter is an optional extra condition that every entry must satisfy
+    """
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= chunk_size:
+            yield from _iter_search_chunk(conn, search_base, attribute, chunk, search_filter, attributes)
+            chunk = []
+    if chunk:
+        yield from _iter_search_chunk(conn, search_base, attribute, chunk, search_filter, attributes)
+
+
+def _iter_search_chunk(conn, search_base, attribute, values, search_filter, attributes):
+    values_filter = or_(*(eq(attribute, value) for value in values))
+    yield from iter_search(
+        conn, search_base, and_(search_filter, values_filter), attributes=attributes
+    )
+
+
+@stats.instrumented
+def users(conn, search_base, string, limit, attributes=None, page_size=None, prefetch=0):
     """Search users inside AD
     filter: is the cn or userPrincipalName or samaccoutnname or mail to be searched. Can contain *
     """
-    search_filter = f"(&(objectclass=user)(|(samaccountname={string})(mail={string})(cn={string})(userPrincipalName={string})))"
-    return search(conn, search_base, search_filter, limit=limit, attributes=attributes)
+    search_filter = and_(
+        eq("objectCategory", "person"),
+        eq("objectClass", "user"),
+        or_(*(like(attribute, string) for attribute in ["sAMAccountName", "mail", "cn", "userPrincipalName"])),
+    )
+    return iter_search(
+        conn,
+        search_base,
+        search_filter,
+        limit=limit,
+        attributes=attributes,
+        page_size=page_size,
+        prefetch=prefetch,
+    )
 
 
+@stats.instrumented
 def get_dn(conn, search_base, entry):
     if entry.lower().startswith("cn="):
         return entry
-    search_filter = f"(sAMAccountName={entry})"
+
+    cache = get_dn_cache()
+    key = dn_cache_key(conn, "dn", search_base, entry)
+    if cache is not None:
+        dn = cache.get(key)
+        if dn:
+            return dn
+
+    search_filter = eq("sAMAccountName", entry)
     result = search(conn, search_base, search_filter, attributes=["distinguishedName"])
     logging.debug(result)
     if len(result) < 1:
         logging.error(f"entry {entry} not found")
         return None
 
-    return result[0]["distinguishedName"]
+    dn = result[0]["distinguishedName"]
+    if cache is not None:
+        cache.set(key, dn)
+    return dn
+
+
+def dn_cache_key(conn, kind, search_base, entry) -> tuple:
+    """The key of an entry in the DN cache
+
+    The entries resolved in a snapshot (offline sources) have keys of
+    their own, so that their possibly stale DNs are never used online
+    """
+    key = (kind, search_base.lower(), entry.lower())
+    if getattr(conn, "iter_entries", None) is not None:
+        return ("offline",) + key
+    return key
+
+
+def invalidate_dn(search_base, entry=None):
+    """Remove an entry (all entries if None) from the DN cache, e.g. after a rename"""
+    cache = get_dn_cache()
+    if cache is None:
+        return
+    for namespace in [(), ("offline",)]:
+        for kind in ["dn", "group"]:
+            if entry:
+                cache.delete(namespace + (kind, search_base.lower(), entry.lower()))
+            else:
+                cache.clear(namespace + (kind, search_base.lower()))
 
 
 # never expires
 #
+@stats.instrumented
 def never_expires_password(conn, search_base, filter, limit=0, attributes=None):
     ## (userAccountControl:1.2.840.113556.1.4.803:=2)
-    search_filter = f"(&(objectClass=user)(userAccountControl:1.2.840.113556.1.4.803:=65536){filter})"
+    search_filter = and_(eq("objectClass", "user"), bit_and("userAccountControl", 65536), filter)
     return search(conn, search_base, search_filter, limit=limit, attributes=attributes)
 
 
+@stats.instrumented
 def disabled_users(conn, search_base, filter, limit=0, attributes=None):
     ## (userAccountControl:1.2.840.113556.1.4.803:=2)
-    search_filter = f"(&(objectCategory=Person)(objectClass=User){filter}(userAccountControl:1.2.840.113556.1.4.803:=2))"
+    search_filter = and_(
+        eq("objectCategory", "Person"), eq("objectClass", "User"), filter, bit_and("userAccountControl", 2)
+    )
     return search(conn, search_base, search_filter, limit=limit, attributes=attributes)
 
 
+@stats.instrumented
 def locked_users(conn, search_base, filter, limit=0, attributes=None):
     ## (userAccountControl:1.2.840.113556.1.4.803:=2)
-    search_filter = (
-        f"(&(objectCategory=Person)(objectClass=User){filter}(lockoutTime>=1))"
-    )
+    search_filter = and_(eq("objectCategory", "Person"), eq("objectClass", "User"), filter, ge("lockoutTime", 1))
     return search(conn, search_base, search_filter, attributes=attributes)
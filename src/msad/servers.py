@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Pools of domain controllers: failover and selection of the server to bind to"""
+
+import logging
+import socket
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import ldap3
+
+from .cache import CACHE_DIR, Cache
+from .schema import SCHEMA_DIR, get_server
+
+STRATEGIES = ["first", "round_robin", "latency"]
+
+# seconds a probed latency is reused and an unreachable server is skipped
+PROBE_TTL = 300
+EXHAUST = 60
+
+_probe_cache = None
+_pools = {}
+_lock = threading.Lock()
+
+
+def _get_probe_cache() -> Cache:
+    global _probe_cache
+    if _probe_cache is None:
+        _probe_cache = Cache(ttl=PROBE_TTL, path=CACHE_DIR / "servers.sqlite")
+    return _probe_cache
+
+
+def probe(host: str, port: int, timeout: float = 2.0):
+    """Seconds needed to open a TCP connection to host, None if unreachable"""
+    start = time.perf_counter()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return time.perf_counter() - start
+    except OSError as error:
+        logging.warning(f"{host}:{port} is unreachable: {error}")
+        return None
+
+
+def latencies(hosts: list, port: int, cache=None) -> dict:
+    """The (cached) latency of every host, probing concurrently the ones not in cache"""
+    cache = cache if cache is not None else _get_probe_cache()
+    result = {}
+    missing = []
+    for host in hosts:
+        value = cache.get(("latency", host.lower(), str(port)))
+        if value is None:
+            missing.append(host)
+        else:
+            result[host] = value["seconds"]
+    if missing:
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            for host, seconds in zip(missing, executor.map(lambda h: probe(h, port), missing)):
+                cache.set(("latency", host.lower(), str(port)), {"seconds": seconds})
+                result[host] = seconds
+    return result
+
+
+def order_hosts(hosts: list, port: int, strategy: str = "first", cache=None) -> list:
+    """The hosts in the order they should be tried"""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown pool strategy '{strategy}'. Use one of {', '.join(STRATEGIES)}")
+    if strategy != "latency" or len(hosts) < 2:
+        return list(hosts)
+    measured = latencies(hosts, port, cache)
+    # unreachable hosts last, they may be back
+    return sorted(hosts, key=lambda h: (measured[h] is None, measured[h] or 0))
+
+
+def get_server_pool(
+    hosts: list,
+    port=None,
+    use_ssl=False,
+    tls=None,
+    strategy: str = "first",
+    connect_timeout=None,
+    cache_dir=SCHEMA_DIR,
+):
+    """A ldap3.ServerPool of the hosts, each server using the cached info and schema
+
+    Unavailable servers are skipped for EXHAUST seconds. The pool is
+    shared by the connections created with the same arguments, so that
+    round_robin spreads them over the servers
+    """
+    key = (tuple(h.lower() for h in hosts), port, use_ssl, strategy, connect_timeout)
+    with _lock:
+        pool = _pools.get(key)
+        if pool is not None:
+            return pool
+        servers = []
+        for host in order_hosts(hosts, port or (636 if use_ssl else 389), strategy):
+            server = get_server(host, port=port, use_ssl=use_ssl, tls=tls, cache_dir=cache_dir)
+            server.connect_timeout = connect_timeout
+            servers.append(server)
+        pool = ldap3.ServerPool(
+            servers,
+            pool_strategy=ldap3.ROUND_ROBIN if strategy == "round_robin" else ldap3.FIRST,
+            active=2,
+            exhaust=EXHAUST,
+        )
+        _pools[key] = pool
+        return pool
+
+
+def restartable(conn, tries: int, sleep_time: float = 1):
+    """Make a connection (client_strategy=ldap3.RESTARTABLE) retry failed operations tries times,
+    moving to the next available server of its pool"""
+    conn.strategy.restartable_tries = tries
+    conn.strategy.restartable_sleep_time = sleep_time
+    return conn
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""A local sqlite copy of the directory, usable instead of a connection"""
+
+import datetime
+import logging
+import os
+import sqlite3
+
+from ldap3 import BASE, LEVEL, SUBTREE
+from ldap3.utils.ciDict import CaseInsensitiveDict
+
+from . import stats
+from .cache import CACHE_DIR, create_private, dumps, loads
+from .filters import IN_CHAIN, matches, parse
+
+# attribute -> indexed column
+INDEXED = {
+    "samaccountname": "samaccountname",
+    "mail": "mail",
+    "cn": "cn",
+    "userprincipalname": "userprincipalname",
+    "distinguishedname": "dn_lower",
+}
+
+# version of the data column (json, see cache.dumps)
+FORMAT = "2"
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE entries (
+    id INTEGER PRIMARY KEY,
+    dn TEXT NOT NULL,
+    dn_lower TEXT NOT NULL UNIQUE,
+    samaccountname TEXT,
+    mail TEXT,
+    cn TEXT,
+    userprincipalname TEXT,
+    data TEXT
+);
+CREATE TABLE member_of (entry_id INTEGER NOT NULL, group_dn TEXT NOT NULL);
+"""
+
+INDEXES = """
+CREATE INDEX entries_samaccountname ON entries (samaccountname);
+CREATE INDEX entries_mail ON entries (mail);
+CREATE INDEX entries_cn ON entries (cn);
+CREATE INDEX entries_userprincipalname ON entries (userprincipalname);
+CREATE INDEX member_of_group ON member_of (group_dn);
+CREATE INDEX member_of_entry ON member_of (entry_id);
+"""
+
+NESTED_MEMBERS = """
+WITH RECURSIVE nested(dn) AS (
+    SELECT e.dn_lower FROM member_of m JOIN entries e ON e.id = m.entry_id WHERE m.group_dn = ?
+    UNION
+    SELECT e.dn_lower FROM member_of m JOIN entries e ON e.id = m.entry_id JOIN nested n ON m.group_dn = n.dn
+)
+"""
+
+NESTED_GROUPS = """
+WITH RECURSIVE nested(dn) AS (
+    SELECT m.group_dn FROM member_of m JOIN entries e ON e.id = m.entry_id WHERE e.dn_lower = ?
+    UNION
+    SELECT m.group_dn FROM member_of m JOIN entries e ON e.id = m.entry_id JOIN nested n ON e.dn_lower = n.dn
+)
+"""
+
+
+def default_path(domain: str):
+    return CACHE_DIR / f"snapshot-{domain}.sqlite"
+
+
+def _first(record, attribute):
+    value = record.get(attribute)
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return str(value).lower() if value is not None else None
+
+
+@stats.instrumented
+def create_snapshot(
+    conn,
+    search_base,
+    path,
+    search_filter="(objectClass=*)",
+    attributes=None,
+    batch_size=1000,
+    page_size=None,
+    prefetch=0,
+):
+    """Stream the entries found into a new snapshot file, returning their number"""
+    from .search import iter_entries
+
+    if attributes:
+        attributes = list(attributes) + ["distinguishedName", "memberOf"] + list(INDEXED)
+    tmp = f"{path}.tmp"
+    if os.path.exists(tmp):
+        os.unlink(tmp)
+    # a copy of the directory: only for the owner, like the directory itself
+    create_private(tmp)
+    db = sqlite3.connect(tmp)
+    db.executescript(SCHEMA)
+    count = 0
+    entries = []
+    member_of = []
+
+    def _flush():
+        db.executemany(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entries
+        )
+        db.executemany("INSERT INTO member_of VALUES (?, ?)", member_of)
+        entries.clear()
+        member_of.clear()
+
+    for entry in iter_entries(
+        conn,
+        search_base,
+        search_filter,
+        attributes=attributes,
+        page_size=page_size,
+        prefetch=prefetch,
+        cached=False,
+    ):
+        count += 1
+        record = CaseInsensitiveDict(entry["attributes"])
+        entries.append(
+            (
+                count,
+                entry["dn"],
+                entry["dn"].lower(),
+                _first(record, "sAMAccountName"),
+                _first(record, "mail"),
+                _first(record, "cn"),
+                _first(record, "userPrincipalName"),
+                dumps(dict(record)),
+            )
+        )
+        groups = record.get("memberOf") or []
+        member_of.extend((count, str(group).lower()) for group in groups)
+        if len(entries) >= batch_size:
+            _flush()
+    _flush()
+    db.executescript(INDEXES)
+    db.executemany(
+        "INSERT INTO meta VALUES (?, ?)",
+        [
+            ("search_base", search_base),
+            ("search_filter", search_filter),
+            ("format", FORMAT),
+            ("created", datetime.datetime.now(datetime.timezone.utc).isoformat()),
+        ],
+    )
+    db.commit()
+    db.close()
+    os.replace(tmp, path)
+    logging.info(f"saved {count} entries to {path}")
+    return count
+
+
+def _in_scope(dn: str, base: str, scope) -> bool:
+    if scope == BASE:
+        return dn == base
+    if scope == LEVEL:
+        return dn.endswith("," + base) and "," not in dn[: -len(base) - 1].replace("\\,", "")
+    return not base or dn == base or dn.endswith("," + base)
+
+
+class Snapshot:
+    """A read only directory loaded from a snapshot file
+
+    It can be used instead of a connection by the search functions
+    (search.iter_entries and everything built on it). The filters are
+    evaluated locally, using the indexes when possible
+    """
+
+    def __init__(self, path):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Missing snapshot {path}: create it with 'msad snapshot'")
+        self.path = path
+        self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.meta = dict(self.db.execute("SELECT key, value FROM meta"))
+        if self.meta.get("format") != FORMAT:
+            raise ValueError(f"Snapshot {path} has an old format: create it again with 'msad snapshot'")
+
+    def _candidates(self, node):
+        """Return a (sql condition, params) on the entries table using the indexes, None for a full scan"""
+        attribute = (node.attribute or "").lower()
+        if node.op == "eq" and attribute in INDEXED:
+            return f"{INDEXED[attribute]} = ?", [node.value.lower()]
+        if node.op == "substring" and attribute in INDEXED and node.value[0]:
+            prefix = node.value[0].lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            return f"{INDEXED[attribute]} LIKE ? ESCAPE '\\'", [prefix + "%"]
+        if node.op == "eq" and attribute == "memberof":
+            return "id IN (SELECT entry_id FROM member_of WHERE group_dn = ?)", [node.value.lower()]
+        if node.op == "ext" and node.rule == IN_CHAIN and attribute == "memberof":
+            return f"dn_lower IN ({NESTED_MEMBERS} SELECT dn FROM nested)", [node.value.lower()]
+        if node.op == "ext" and node.rule == IN_CHAIN and attribute == "member":
+            return f"dn_lower IN ({NESTED_GROUPS} SELECT dn FROM nested)", [node.value.lower()]
+        if node.op in ["and", "or"]:
+            conditions = [self._candidates(child) for child in node.children]
+            if node.op == "and":
+                conditions = [c for c in conditions if c is not None]
+            if not conditions or None in conditions:
+                return None
+            sql = f" {node.op.upper()} ".join(f"({c[0]})" for c in conditions)
+            return sql, [p for c in conditions for p in c[1]]
+        return None
+
+    def _in_chain(self, attribute, value, record):
+        dn = str(record.get("distinguishedName", "")).lower()
+        if attribute.lower() == "memberof":
+            sql = f"{NESTED_MEMBERS} SELECT 1 FROM nested WHERE dn = ?"
+        elif attribute.lower() == "member":
+            sql = f"{NESTED_GROUPS} SELECT 1 FROM nested WHERE dn = ?"
+        else:
+            return False
+        return self.db.execute(sql, [value.lower(), dn]).fetchone() is not None
+
+    def iter_entries(self, search_base, search_filter, limit=0, attributes=None, search_scope=SUBTREE):
+        node = parse(search_filter)
+        base = search_base.lower()
+        sql = "SELECT dn, dn_lower, data FROM entries"
+        params = []
+        candidates = self._candidates(node)
+        if candidates:
+            sql += f" WHERE {candidates[0]}"
+            params = candidates[1]
+        else:
+            logging.debug(f"full scan of the snapshot for {search_filter}")
+        if attributes in [None, "*"] or "*" in attributes:
+            attributes = None
+        count = 0
+        for dn, dn_lower, data in self.db.execute(sql + " ORDER BY id", params):
+            if not _in_scope(dn_lower, base, search_scope):
+                continue
+            record = CaseInsensitiveDict(loads(data))
+            record.setdefault("distinguishedName", dn)
+            if not matches(node, record, self._in_chain):
+                continue
+            if attributes:
+                wanted = {a.lower() for a in attributes}
+                record = CaseInsensitiveDict(
+                    {k: v for k, v in record.items() if k.lower() in wanted}
+                )
+            yield {"dn": dn, "attributes": record}
+            count += 1
+            if limit and count >= limit:
+                return
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Counters of the LDAP operations (bind, search pages, modify) per msad function
+
+    collector = msad.stats.enable()
+    msad.user.user_groups(conn, search_base, 0, "matteo")
+    print(collector.summary())
+
+or, for a metrics exporter, msad.stats.add_hook(callback): callback(event) is
+called after each operation with a dict having the keys function, operation,
+seconds, entries and bytes. Nothing is measured while no collector and no hook
+are active
+"""
+
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+import types
+
+# upper bounds (milliseconds) of the latency histogram buckets
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# the innermost instrumented msad function being run
+_function = contextvars.ContextVar("msad_function", default=None)
+
+_collector = None
+_hooks = []
+
+
+def _bucket(seconds: float) -> str:
+    ms = seconds * 1000
+    for bound in BUCKETS_MS:
+        if ms <= bound:
+            return f"<={bound}"
+    return f">{BUCKETS_MS[-1]}"
+
+
+class Stats:
+    """Operations, entries, bytes and latency histograms per function and operation"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.functions = {}
+        self._lock = threading.Lock()
+
+    def record(self, function: str, operation: str, seconds: float, entries: int = 0, size: int = 0):
+        with self._lock:
+            counters = self.functions.setdefault(function, {}).setdefault(
+                operation, {"count": 0, "entries": 0, "bytes": 0, "seconds": 0.0, "histogram_ms": {}}
+            )
+            counters["count"] += 1
+            counters["entries"] += entries
+            counters["bytes"] += size
+            counters["seconds"] += seconds
+            bucket = _bucket(seconds)
+            counters["histogram_ms"][bucket] = counters["histogram_ms"].get(bucket, 0) + 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            totals = {}
+            functions = {}
+            for function, operations in self.functions.items():
+                functions[function] = {}
+                for operation, counters in operations.items():
+                    functions[function][operation] = dict(
+                        counters, seconds=round(counters["seconds"], 6), histogram_ms=dict(counters["histogram_ms"])
+                    )
+                    if operation == "call":
+                        continue
+                    total = totals.setdefault(operation, {"count": 0, "entries": 0, "bytes": 0, "seconds": 0.0})
+                    for key in ["count", "entries", "bytes", "seconds"]:
+                        total[key] += counters[key]
+            for total in totals.values():
+                total["seconds"] = round(total["seconds"], 6)
+            return {
+                "elapsed_s": round(time.perf_counter() - self.started, 6),
+                "operations": totals,
+                "functions": functions,
+            }
+
+
+def enable() -> Stats:
+    """Start collecting in a new Stats, returned"""
+    global _collector
+    _collector = Stats()
+    return _collector
+
+
+def disable():
+    global _collector
+    _collector = None
+
+
+def get_stats():
+    return _collector
+
+
+def add_hook(callback):
+    _hooks.append(callback)
+
+
+def remove_hook(callback):
+    if callback in _hooks:
+        _hooks.remove(callback)
+
+
+def active() -> bool:
+    return _collector is not None or bool(_hooks)
+
+
+def record(operation: str, seconds: float, entries: int = 0, size: int = 0):
+    """Account an operation to the current msad function (default: the operation itself)"""
+    if not active():
+        return
+    function = _function.get() or operation
+    collector = _collector
+    if collector is not None:
+        collector.record(function, operation, seconds, entries, size)
+    for hook in list(_hooks):
+        try:
+            hook({"function": function, "operation": operation, "seconds": seconds, "entries": entries, "bytes": size})
+        except Exception as error:
+            logging.warning(f"stats hook {hook} failed: {error}")
+
+
+@contextlib.contextmanager
+def timed(operation: str):
+    """Record the time spent in the with block as one operation"""
+    if not active():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(operation, time.perf_counter() - start)
+
+
+def entries_size(entries) -> int:
+    """Approximate size in bytes of the entries of a search response"""
+    size = 0
+    for entry in entries:
+        size += len(entry.get("dn") or "")
+        for values in (entry.get("raw_attributes") or {}).values():
+            for value in values if isinstance(values, list) else [values]:
+                size += len(value or b"")
+    return size
+
+
+def _record_call(name, seconds, entries):
+    token = _function.set(name)
+    try:
+        record("call", seconds, entries)
+    finally:
+        _function.reset(token)
+
+
+def _iterate(name, iterator):
+    count = 0
+    seconds = 0.0
+    try:
+        while True:
+            token = _function.set(name)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+                _function.reset(token)
+            count += 1
+            yield item
+    finally:
+        _record_call(name, seconds, count)
+
+
+def instrumented(function):
+    """Account the operations run by function (also lazily, by the iterator it returns) to it"""
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not active():
+            return function(*args, **kwargs)
+        token = _function.set(name)
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            _function.reset(token)
+        if isinstance(result, types.GeneratorType):
+            return _iterate(name, result)
+        _record_call(name, seconds, len(result) if isinstance(result, list) else 0)
+        return result
+
+    return wrapper
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""What msad answers without loading typer (msad --help and get-sample-config), see __main__.py"""
+
+import textwrap
+
+SAMPLE_CONFIG = """
+[defaults]
+
+domain = "mydomain"
+
+[domains]
+
+[domains.mydomain]
+
+host = "example.com"
+search_base = "dc=example,dc=com"
+    
+port = 636
+use_ssl = true
+#port = 389
+#use_ssl = false
+
+#host = ["dc1.example.com", "dc2.example.com"]
+# first, round_robin (spreads --parallel and the daemon connections) or latency
+#pool_strategy = "latency"
+#connect_timeout = 5
+
+# user =
+# password =
+
+# entries per page and pages requested in background by the searches
+# page_size = 1000
+# prefetch = 2
+"""
+
+# format_help() of the msad app: the tests check it is up to date
+HELP = """\
+Usage: msad [OPTIONS] COMMAND [ARGS]...
+
+Options:
+  --no-cache / --no-no-cache    Do not use the cache of DNs
+  --cache-ttl INTEGER           Seconds the resolved DNs are cached on disk  [default: 86400]
+  --result-ttl INTEGER          Seconds the results of identical searches are reused (0: not cached)
+                                [default: 0]
+  --refresh / --no-refresh      Search again, updating the cached results
+  --strict / --no-strict        Refuse the filters needing a full scan of the directory (not indexed
+                                attributes, leading wildcards, negations, bitwise rules) instead of
+                                warning
+  --no-daemon / --no-no-daemon  Do not forward the command to a running msad daemon
+  --stats / --no-stats          Print the LDAP operations, entries, bytes and latencies (json) to
+                                stderr
+  --install-completion          Install completion for the current shell.
+  --show-completion             Show completion for the current shell, to copy it or customize the
+                                installation.
+  --help                        Show this message and exit.
+
+Commands:
+  audit                Flag the disabled, locked, never expiring, expired password and stale...
+  cache-clear          Remove an entry (sAMAccountName) or all the entries of a domain from the...
+  change-password
+  check-users          Check many users (one sAMAccountName per line in a file or stdin):...
+  group-add-member     Adds the user to a group (using DN or sAMAccountName)
+  group-remove-member  Remove the user to a group (using DN or sAMAccountName)
+  group-members
+  group-sync           Make the members of a group equal to the DNs or sAMAccountNames listed in...
+  search
+  export               Export the entries found to a file (or - for stdout), e.g.
+  lookup               Find the entries of many sAMAccountNames, mails or userPrincipalNames (in...
+  effective-groups     Extract the groups (also nested) of every member of any group, with one...
+  get-sample-config
+  serve                Run a daemon keeping bound connections to the configured domains: msad...
+  snapshot             Save the entries of the domain to a local snapshot, used by the commands...
+  users                Search users by sAMAccountName, mail, cn or userPrincipalName (can contain *)
+  user-groups
+"""
+
+WIDTH = 100
+
+
+def _rows(rows: list) -> list:
+    column = min(max(len(name) for name, _ in rows), 30)
+    lines = []
+    for name, text in rows:
+        if len(name) > column:
+            lines.append(f"  {name}")
+            name = ""
+        wrapped = textwrap.wrap(text, WIDTH - column - 4) or [""]
+        lines.append(f"  {name:<{column}}  {wrapped[0]}".rstrip())
+        lines.extend(f"  {'':<{column}}  {line}" for line in wrapped[1:])
+    return lines
+
+
+def format_help(group) -> str:
+    """The help of the msad command in plain text, from the click group of its typer app"""
+    options = []
+    for param in group.params:
+        name = " / ".join(", ".join(opts) for opts in [param.opts, param.secondary_opts] if opts)
+        text = param.help or ""
+        if not param.is_flag:
+            name += f" {param.type.name.upper()}"
+            text += f"  [default: {param.default}]"
+        options.append((name, text))
+    options.append(("--help", "Show this message and exit."))
+    # one line each, as click does
+    limit = WIDTH - 4 - max(len(name) for name in group.commands)
+    commands = [(name, command.get_short_help_str(limit)) for name, command in group.commands.items()]
+    lines = ["Usage: msad [OPTIONS] COMMAND [ARGS]...", "", "Options:"]
+    lines += _rows(options) + ["", "Commands:"] + _rows(commands)
+    return "\n".join(lines) + "\n"
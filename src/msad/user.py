@@ -18,10 +18,39 @@
 
 import logging
 import getpass
-import ldap3
 import datetime
-from .search import disabled_users, get_dn, search, locked_users, never_expires_password
-from .group import group_member
+import itertools
+from . import stats
+from .search import (
+    disabled_users,
+    get_dn,
+    invalidate_results,
+    iter_entries,
+    iter_range,
+    iter_search,
+    iter_search_many,
+    search,
+    locked_users,
+    never_expires_password,
+)
+from .filters import and_, eq, in_chain
+from .group import group_memberships
+
+# userAccountControl flags
+ACCOUNTDISABLE = 0x0002
+DONT_EXPIRE_PASSWORD = 0x10000
+
+# Windows FILETIME epoch, used by pwdLastSet, lockoutTime, lastLogonTimestamp
+FILETIME_EPOCH = datetime.datetime(1601, 1, 1, tzinfo=datetime.timezone.utc)
+
+# the flags computed by audit_users, counted in its summary
+AUDIT_FLAGS = [
+    "is_disabled",
+    "is_locked",
+    "has_never_expires_password",
+    "has_expired_password",
+    "is_stale",
+]
 
 
 def _enter_password(text: str):
@@ -34,6 +63,7 @@ def _enter_password(text: str):
         return p
 
 
+@stats.instrumented
 def change_password(conn, search_base: str, user: str):
     user_dn = get_dn(conn, search_base, user)
 
@@ -44,34 +74,40 @@ def change_password(conn, search_base: str, user: str):
     newpwd = _enter_password("New password : ")
     newpwd2 = _enter_password("New password (check): ")
     if newpwd == newpwd2:
-        conn.extend.microsoft.modify_password(user_dn, newpwd, oldpwd)
+        with stats.timed("modify"):
+            conn.extend.microsoft.modify_password(user_dn, newpwd, oldpwd)
+        invalidate_results(search_base)
 
 
+@stats.instrumented
 def is_disabled(conn, search_base: str, user: str):
     result = disabled_users(
-        conn, search_base, f"(samaccountname={user})", limit=1, attributes=None
+        conn, search_base, eq("sAMAccountName", user), limit=1, attributes=None
     )
     logging.debug(result)
     return True if len(result) == 1 else None
 
 
+@stats.instrumented
 def is_locked(conn, search_base: str, user: str):
     result = locked_users(
-        conn, search_base, f"(samaccountname={user})", limit=1, attributes=None
+        conn, search_base, eq("sAMAccountName", user), limit=1, attributes=None
     )
     return True if len(result) == 1 else None
 
 
+@stats.instrumented
 def has_never_expires_password(conn, search_base: str, user: str):
     result = never_expires_password(
-        conn, search_base, f"(samaccountname={user})", limit=1, attributes=None
+        conn, search_base, eq("sAMAccountName", user), limit=1, attributes=None
     )
     return True if len(result) == 1 else None
 
 
-def password_changed_in_days(conn, search_base: str, user: str, limit: int = 2000, max_age: int):
+@stats.instrumented
+def password_changed_in_days(conn, search_base: str, user: str, max_age: int = 0, limit: int = 2000):
     #    return search(conn, search_base, search_filter, attributes=attributes)
-    search_filter = f"(samaccountname={user})"
+    search_filter = eq("sAMAccountName", user)
     result = search(
         conn, search_base, search_filter, limit=1, attributes=["pwdLastSet"]
     )
@@ -90,6 +126,187 @@ def password_changed_in_days(conn, search_base: str, user: str, limit: int = 200
         return True if days > max_age else False
 
 
+@stats.instrumented
+def has_expired_password(conn, search_base: str, user: str, max_age: int):
+    return password_changed_in_days(conn, search_base, user, max_age=max_age)
+
+
+def _values(attributes: dict, name: str) -> list:
+    """Return the values of an attribute (attribute names are case insensitive)"""
+    for key, value in attributes.items():
+        if key.lower() == name.lower():
+            if isinstance(value, list):
+                return value
+            return [] if value is None else [value]
+    return []
+
+
+def _value(attributes: dict, name: str):
+    values = _values(attributes, name)
+    return values[0] if values else None
+
+
+def _to_int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _filetime(value):
+    """Convert a FILETIME attribute to a datetime, None if it was never set"""
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        value = value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+        return None if value <= FILETIME_EPOCH else value
+    ticks = _to_int(value)
+    if ticks <= 0 or ticks >= 0x7FFFFFFFFFFFFFFF:
+        return None
+    return FILETIME_EPOCH + datetime.timedelta(microseconds=ticks // 10)
+
+
+def _account_flags(attributes: dict, max_age: int, now=None) -> dict:
+    """Compute the account checks from already fetched attributes"""
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    uac = _to_int(_value(attributes, "userAccountControl"))
+    pwd_last_set = _filetime(_value(attributes, "pwdLastSet"))
+    return {
+        "is_disabled": bool(uac & ACCOUNTDISABLE),
+        "is_locked": _filetime(_value(attributes, "lockoutTime")) is not None,
+        "has_never_expires_password": bool(uac & DONT_EXPIRE_PASSWORD),
+        "password_age_days": (now - pwd_last_set).days if pwd_last_set else None,
+        "has_expired_password": pwd_last_set is None
+        or (now - pwd_last_set).days > max_age,
+    }
+
+
+@stats.instrumented
+def audit_users(
+    conn,
+    search_base: str,
+    max_age: int = 90,
+    stale_days: int = 90,
+    search_filter: str = "",
+    counts: dict | None = None,
+    page_size=None,
+    prefetch=0,
+):
+    """Classify all the user accounts with one paged scan, yielding one result per account
+
+    Only the attributes needed by the checks are fetched. An account is
+    stale if it has not logged on (lastLogonTimestamp, replicated every
+    ~14 days) for stale_days or never. If counts (a dict) is given, it is
+    updated with the number of accounts and of accounts having each flag
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if counts is None:
+        counts = {}
+    counts.setdefault("accounts", 0)
+    for flag in AUDIT_FLAGS:
+        counts.setdefault(flag, 0)
+
+    for entry in iter_entries(
+        conn,
+        search_base,
+        and_(eq("objectCategory", "person"), eq("objectClass", "user"), search_filter),
+        attributes=["sAMAccountName", "userAccountControl", "lockoutTime", "pwdLastSet", "lastLogonTimestamp"],
+        page_size=page_size,
+        prefetch=prefetch,
+        cached=False,
+    ):
+        attributes = entry["attributes"]
+        last_logon = _filetime(_value(attributes, "lastLogonTimestamp"))
+        result = {"distinguishedName": entry["dn"], "sAMAccountName": _value(attributes, "sAMAccountName")}
+        result.update(_account_flags(attributes, max_age, now))
+        result["last_logon_days"] = (now - last_logon).days if last_logon else None
+        result["is_stale"] = last_logon is None or (now - last_logon).days > stale_days
+        counts["accounts"] += 1
+        for flag in AUDIT_FLAGS:
+            counts[flag] += result[flag]
+        yield result
+
+
+def _group_members_dn(conn, search_base: str, group_dn: str) -> set:
+    search_filter = in_chain("memberOf", group_dn)
+    return {
+        str(_value(entry, "distinguishedName")).lower()
+        for entry in iter_search(
+            conn, search_base, search_filter, attributes=["distinguishedName"]
+        )
+    }
+
+
+@stats.instrumented
+def check_users(
+    conn, search_base: str, users, max_age: int, groups=[], chunk_size: int = 200
+):
+    """Check many users with a few paged searches, yielding one result per user
+
+    The accounts are fetched in chunks with OR-filters and all the checks
+    are computed locally. Each group is expanded (also nested) only once.
+    """
+    group_dns = {group: get_dn(conn, search_base, group) for group in groups}
+    members = {
+        group: _group_members_dn(conn, search_base, group_dn) if group_dn else set()
+        for group, group_dn in group_dns.items()
+    }
+    attributes = [
+        "sAMAccountName",
+        "distinguishedName",
+        "userAccountControl",
+        "lockoutTime",
+        "pwdLastSet",
+        "memberOf",
+    ]
+
+    def _chunks():
+        chunk = []
+        for user in users:
+            user = user.strip()
+            if not user:
+                continue
+            chunk.append(user)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    for chunk in _chunks():
+        found = {}
+        for entry in iter_search_many(
+            conn,
+            search_base,
+            "sAMAccountName",
+            chunk,
+            search_filter=and_(eq("objectCategory", "person"), eq("objectClass", "user")),
+            chunk_size=chunk_size,
+            attributes=attributes,
+        ):
+            found[str(_value(entry, "sAMAccountName")).lower()] = entry
+
+        for user in chunk:
+            entry = found.get(user.lower())
+            if entry is None:
+                logging.error(f"entry {user} not found")
+                yield {"user": user, "found": False}
+                continue
+            result = {"user": user, "found": True}
+            result.update(_account_flags(entry, max_age))
+            user_dn = str(_value(entry, "distinguishedName")).lower()
+            member_of = {str(dn).lower() for dn in _values(entry, "memberOf")}
+            for group, group_dn in group_dns.items():
+                result[f"membership_{group}"] = (
+                    None
+                    if not group_dn
+                    else group_dn.lower() in member_of or user_dn in members[group]
+                )
+            yield result
+
+
+@stats.instrumented
 def check_user(conn, search_base:str, user:str, max_age:int, groups=[]):
     # result = {}
     yield ({"is_disabled": is_disabled(conn, search_base, user)})
@@ -107,31 +324,35 @@ def check_user(conn, search_base:str, user:str, max_age:int, groups=[]):
     yield (
         {"has_expired_password": has_expired_password(conn, search_base, user, max_age)}
     )
+    memberships = group_memberships(conn, search_base, user, groups) if groups else {}
     for group in groups:
-        yield (
-            {
-                f"membership_{group}": group_member(
-                    conn, search_base, group=group, user=user
-                )
-            }
-        )
+        yield ({f"membership_{group}": (memberships or {}).get(group)})
 
 
-def user_groups(conn, search_base:str , limit: int, user: str, nested: bool =True):
-    """retrieve all groups (also nested) of a user"""
+@stats.instrumented
+def user_groups(conn, search_base:str , limit: int, user: str, nested: bool =True, graph=None):
+    """retrieve all groups (also nested) of a user
+
+    With a GroupGraph the nested groups are resolved locally
+    """
 
     user_dn = get_dn(conn, search_base, user)
 
     if not user_dn:
         return None
 
-    if nested:
-        search_filter = f"(member:1.2.840.113556.1.4.1941:={user_dn})"
-        attributes = ["sAMaccountName"]
-    else:
-        search_filter = "(objectClass=*)"
-        search_base = user_dn
-        attributes = ["memberOf"]
+    if nested and graph is not None:
+        groups = graph.user_groups(user_dn) or []
+        if limit:
+            groups = groups[:limit]
+        return [{"sAMAccountName": group} for group in groups]
+
+    if not nested:
+        # one {"memberOf": dn} per group, read with ranged retrieval
+        groups = iter_range(conn, user_dn, "memberOf")
+        return ({"memberOf": dn} for dn in itertools.islice(groups, limit or None))
+
+    search_filter = in_chain("member", user_dn)
     return search(
-        conn, search_base, search_filter, limit=limit, attributes=attributes
+        conn, search_base, search_filter, limit=limit, attributes=["sAMaccountName"]
     )
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import ldap3
+import pytest
+
+BASE = "dc=example,dc=com"
+ADMIN = f"cn=admin,{BASE}"
+USERS = 20
+
+
+def user_dn(u: int) -> str:
+    return f"cn=user{u},ou=users,{BASE}"
+
+
+def group_dn(name: str) -> str:
+    return f"cn={name},ou=groups,{BASE}"
+
+
+# direct members of the groups: g1 contains g2
+GROUPS = {
+    "g1": [user_dn(1), user_dn(3), group_dn("g2")],
+    "g2": [user_dn(5)],
+}
+
+
+def build_directory(users: int = USERS):
+    """A mock server with users user0..userN in ou=users and the GROUPS in ou=groups"""
+    server = ldap3.Server("mock", get_info=ldap3.OFFLINE_AD_2012_R2)
+    conn = ldap3.Connection(server, user=ADMIN, password="secret", client_strategy=ldap3.MOCK_SYNC)
+    add = conn.strategy.add_entry
+    add(ADMIN, {"userPassword": "secret", "sAMAccountName": "admin"})
+    add(BASE, {"objectClass": ["top", "domain"]})
+    for ou in ["users", "groups"]:
+        add(f"ou={ou},{BASE}", {"objectClass": ["top", "organizationalUnit"], "ou": ou})
+    member_of = {}
+    for name, members in GROUPS.items():
+        for member in members:
+            member_of.setdefault(member, []).append(group_dn(name))
+    for u in range(users):
+        add(user_dn(u), {
+            "objectClass": ["top", "person", "organizationalPerson", "user"],
+            # AD expands (objectCategory=person) to the class DN, the mock does not
+            "objectCategory": "person",
+            "distinguishedName": user_dn(u),
+            "sAMAccountName": f"user{u}",
+            "cn": f"user{u}",
+            "mail": f"user{u}@example.com",
+            "userPrincipalName": f"user{u}@example.com",
+            "userAccountControl": 514 if u == 0 else 512,
+            "memberOf": member_of.get(user_dn(u), []),
+        })
+    for name, members in GROUPS.items():
+        add(group_dn(name), {
+            "objectClass": ["top", "group"],
+            "distinguishedName": group_dn(name),
+            "sAMAccountName": name,
+            "cn": name,
+            "groupType": -2147483646,
+            "member": members,
+            "memberOf": member_of.get(group_dn(name), []),
+        })
+    return server
+
+
+def connect(server):
+    return ldap3.Connection(server, user=ADMIN, password="secret", client_strategy=ldap3.MOCK_SYNC)
+
+
+class Ranged:
+    """A mock connection answering the ranged retrieval of AD (member;range=low-*), step values per search"""
+
+    def __init__(self, conn, step: int = 2):
+        self._conn = conn
+        self.step = step
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ["auto_range", "empty_attributes", "auto_referrals"]:
+            setattr(self._conn, name, value)
+        else:
+            object.__setattr__(self, name, value)
+
+    def search(self, search_base, search_filter, **kwargs):
+        attributes = kwargs.get("attributes") or []
+        ranged = [a for a in attributes if isinstance(a, str) and ";range=" in a]
+        if not ranged:
+            done = self._conn.search(search_base, search_filter, **kwargs)
+            self.response, self.result = self._conn.response, self._conn.result
+            return done
+        name, _, bounds = ranged[0].partition(";range=")
+        low = int(bounds.split("-")[0])
+        done = self._conn.search(search_base, search_filter, **dict(kwargs, attributes=[name]))
+        response = []
+        for entry in self._conn.response:
+            values = list(entry["attributes"].get(name) or [])[low : low + self.step]
+            high = "*" if low + self.step >= len(entry["attributes"].get(name) or []) else low + self.step - 1
+            attributes = {f"{name};range={low}-{high}": values} if values else {}
+            response.append(dict(entry, attributes=attributes))
+        self.response, self.result = response, self._conn.result
+        return done
+
+
+@pytest.fixture
+def server():
+    return build_directory()
+
+
+@pytest.fixture
+def factory(server):
+    return lambda: connect(server)
+
+
+@pytest.fixture
+def conn(server):
+    conn = connect(server)
+    conn.bind()
+    yield conn
+    conn.unbind()
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    """A config file with the domain example of the mock directory"""
+    path = tmp_path / "msad.toml"
+    path.write_text(f"""
+[defaults]
+domain = "example"
+
+[domains.example]
+host = "mock"
+port = 389
+use_ssl = false
+search_base = "{BASE}"
+""")
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def _no_caches(monkeypatch):
+    """Every test starts with empty in-memory caches and the default filter checks"""
+    import msad.cache
+    import msad.filters
+
+    monkeypatch.setattr(msad.cache, "_dn_cache", msad.cache.Cache())
+    monkeypatch.setattr(msad.cache, "_result_cache", None)
+    monkeypatch.setattr(msad.filters, "_strict", False)
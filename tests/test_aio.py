@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+from msad.aio import Client
+
+from conftest import BASE, USERS, user_dn
+
+
+def test_calls_are_not_starved_by_open_streams(factory):
+    async def _run():
+        async with Client(factory, BASE, size=2, streams=1) as ad:
+            stream = ad.iter_search("(objectClass=user)", chunk_size=1)
+            first = await anext(stream)
+            dns = await asyncio.gather(*(ad.get_dn(f"user{u}", timeout=5) for u in range(6)))
+            rest = [entry async for entry in stream]
+            return first, rest, dns
+
+    first, rest, dns = asyncio.run(_run())
+    assert len([first] + rest) == USERS
+    assert dns == [user_dn(u) for u in range(6)]
+
+
+def test_streams_wait_for_a_free_slot(factory):
+    async def _count(ad):
+        return len([entry async for entry in ad.iter_search("(objectClass=user)", chunk_size=2)])
+
+    async def _run():
+        async with Client(factory, BASE, size=1, streams=2) as ad:
+            return await asyncio.wait_for(asyncio.gather(*(_count(ad) for _ in range(5))), 10)
+
+    assert asyncio.run(_run()) == [USERS] * 5
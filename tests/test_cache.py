@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pickle
+import sqlite3
+import time
+
+from datetime import datetime, timedelta, timezone
+
+from msad.cache import Cache, CacheView
+
+from conftest import BASE, user_dn
+
+
+def test_values_survive_the_file(conn, tmp_path):
+    path = tmp_path / "cache.sqlite"
+    conn.search(BASE, "(sAMAccountName=user1)", attributes=["cn", "memberOf"])
+    entries = [dict(r) for r in conn.response]
+    value = {
+        "entries": entries,
+        "bytes": b"\x00\xff",
+        "when": datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=1))),
+        "lockout": timedelta(minutes=30),
+        "tuple": (1, "a"),
+    }
+    Cache(path=path).set(("k",), value)
+
+    cached = Cache(path=path).get(("k",))
+    assert cached["bytes"] == b"\x00\xff"
+    assert cached["when"] == value["when"]
+    assert cached["lockout"] == timedelta(minutes=30)
+    assert cached["tuple"] == [1, "a"]
+    attributes = cached["entries"][0]["attributes"]
+    assert attributes["CN"] == "user1"
+    assert attributes["memberof"] == [f"cn=g1,ou=groups,{BASE}"]
+    assert cached["entries"][0]["raw_attributes"]["cn"] == [b"user1"]
+    assert cached["entries"][0]["dn"] == user_dn(1)
+
+
+def test_pickled_rows_are_not_loaded(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    cache = Cache(path=path)
+    cache.set(("k",), "v")
+
+    class Payload:
+        def __reduce__(self):
+            return (path.unlink, ())
+
+    db = sqlite3.connect(str(path))
+    db.execute("UPDATE cache SET value = ?", (pickle.dumps(Payload()),))
+    db.commit()
+    assert Cache(path=path).get(("k",), "missing") == "missing"
+    assert path.exists()
+
+
+def test_max_age(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    path = tmp_path / "cache.sqlite"
+    cache = Cache(ttl=3600, path=path)
+    cache.set(("k",), "v")
+    view = CacheView(cache, 60)
+    now[0] += 30
+    assert view.get(("k",)) == "v"
+    assert Cache(path=path).get(("k",), max_age=60) == "v"
+    now[0] += 60
+    # too old for the view and for max_age, still valid for the cache
+    assert view.get(("k",)) is None
+    assert Cache(path=path).get(("k",), max_age=60) is None
+    assert cache.get(("k",)) == "v"
+    assert (cache.hits, cache.misses) == (2, 1)
+    view.set(("k",), "w")
+    now[0] += 61
+    assert cache.get(("k",)) is None
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+from ldap3.core.exceptions import LDAPSessionTerminatedByServerError
+
+import msad.daemon
+
+from conftest import connect, user_dn
+
+
+@pytest.fixture
+def start_daemon():
+    """Start a daemon on a temporary socket with factory(config), returning the socket path"""
+    directory = tempfile.TemporaryDirectory(dir="/tmp")
+
+    def _start(factory):
+        path = os.path.join(directory.name, "msad.sock")
+        daemon = msad.daemon.Daemon(path, factory=factory, pool_size=2)
+        threading.Thread(target=daemon.serve_forever, daemon=True).start()
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.01)
+        return path
+
+    yield _start
+    directory.cleanup()
+
+
+def _lines(text):
+    return [json.loads(line) for line in text.splitlines() if line]
+
+
+def test_forward_search(server, config_file, start_daemon, capsys):
+    path = start_daemon(lambda config: connect(server))
+    argv = ["search", "(sAMAccountName=user1)", "--attributes", "sAMAccountName", "--config-file", config_file]
+    assert msad.daemon.forward(argv, path) == 0
+    assert _lines(capsys.readouterr().out) == [{"sAMAccountName": "user1"}]
+
+
+def test_forward_exit_codes(server, config_file, start_daemon, capsys):
+    path = start_daemon(lambda config: connect(server))
+    # an unknown option (ClickException) and a missing config file (sys.exit)
+    assert msad.daemon.forward(["search", "(cn=x)", "--no-such-option", "--config-file", config_file], path) == 2
+    assert msad.daemon.forward(["search", "(cn=x)", "--config-file", config_file + ".missing"], path) == 1
+    assert capsys.readouterr().out == ""
+
+
+def test_forward_retries_on_terminated_session(server, config_file, start_daemon, capsys):
+    created = []
+
+    def factory(config):
+        conn = connect(server)
+        if not created:
+            def _terminated(*args, **kwargs):
+                raise LDAPSessionTerminatedByServerError("session terminated by server")
+
+            conn.search = _terminated
+        created.append(conn)
+        return conn
+
+    path = start_daemon(factory)
+    argv = ["search", "(sAMAccountName=user2)", "--attributes", "distinguishedName", "--config-file", config_file]
+    assert msad.daemon.forward(argv, path) == 0
+    assert _lines(capsys.readouterr().out) == [{"distinguishedName": user_dn(2)}]
+    assert len(created) == 2
+
+
+def test_forward_uses_the_caches_of_the_command(server, config_file, start_daemon, capsys, monkeypatch):
+    import msad.cache
+
+    results = msad.cache.Cache(ttl=0)
+    monkeypatch.setattr(msad.cache, "_result_cache", results)
+    path = start_daemon(lambda config: connect(server))
+    argv = ["search", "(sAMAccountName=user3)", "--attributes", "cn", "--config-file", config_file]
+    for options in [[], ["--result-ttl", "60"], ["--result-ttl", "60"], ["--result-ttl", "60", "--refresh"], []]:
+        assert msad.daemon.forward(options + argv, path) == 0
+    # only the commands run with --result-ttl use the cache of the daemon: one miss, one hit
+    assert (results.hits, results.misses) == (1, 1)
+    assert _lines(capsys.readouterr().out) == [{"cn": "user3"}] * 5
+
+
+def test_absolute_paths(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    argv = ["search", "x", "--config-file", "msad.toml", "--state-file=state.json", "--domain", "msad.toml"]
+    assert msad.daemon._absolute_paths(argv) == [
+        "search", "x",
+        "--config-file", str(tmp_path / "msad.toml"),
+        f"--state-file={tmp_path / 'state.json'}",
+        "--domain", "msad.toml",
+    ]
+
+
+@pytest.mark.parametrize("argv, forwarded", [
+    (["search", "(cn=x)"], True),
+    (["--result-ttl", "60", "users", "x"], True),
+    # an attribute named like an option is still forwarded
+    (["search", "(cn=x)", "--attributes", "--offline"], True),
+    (["search", "(cn=x)", "--offline"], False),
+    (["--no-daemon", "search", "(cn=x)"], False),
+    (["--strict", "search", "(cn=x)"], False),
+    (["users", "x", "--offline"], False),
+])
+def test_forward_decision(monkeypatch, tmp_path, argv, forwarded):
+    import msad.cache
+    import msad.main
+
+    monkeypatch.setattr(msad.cache, "CACHE_DIR", tmp_path)
+    calls = []
+    monkeypatch.setattr(msad.daemon, "forward", lambda argv, path=None: calls.append(argv) or 0)
+    monkeypatch.setattr(msad.main, "_get_config", lambda domain, config_file: sys.exit(1))
+    monkeypatch.setattr(sys, "argv", ["msad"] + argv)
+    with pytest.raises(SystemExit):
+        msad.main.app(args=argv, prog_name="msad", standalone_mode=False)
+    assert calls == ([argv] if forwarded else [])
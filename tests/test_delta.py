@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from types import SimpleNamespace
+
+import pytest
+
+from ldap3.core.exceptions import LDAPCommunicationError
+
+import msad.delta
+
+from msad.delta import DeltaSearch, dc_state, load_state
+
+from conftest import BASE, USERS, user_dn
+
+SERVICE = "CN=NTDS Settings,CN=DC1,CN=Servers,CN=Site,CN=Sites,CN=Configuration,DC=example,DC=com"
+
+
+class StubDC:
+    """Answers the searches of dc_state; moves to the other server (dc1, dc2) after the searches listed in moves"""
+
+    strategy = SimpleNamespace(sync=True, thread_safe=False)
+
+    def __init__(self, moves=()):
+        self.server = "dc1"
+        self.moves = list(moves)
+        self.searches = 0
+
+    def search(self, search_base, search_filter, search_scope, attributes):
+        self.searches += 1
+        usn = 100 if self.server == "dc1" else 900
+        if search_base == "":
+            attributes = {"dsServiceName": SERVICE.replace("DC1", self.server.upper()), "highestCommittedUSN": [usn]}
+        else:
+            attributes = {"invocationId": bytes.fromhex("0a0b") if self.server == "dc1" else b"\xff"}
+        self.response = [{"dn": search_base, "attributes": attributes}]
+        self.result = {"result": 0}
+        if self.searches in self.moves:
+            self.server = "dc2" if self.server == "dc1" else "dc1"
+        return True
+
+
+def test_dc_state():
+    assert dc_state(StubDC()) == {"dc": SERVICE, "invocation_id": "0a0b", "usn": 100}
+
+
+def test_dc_state_on_one_server():
+    # moving after the first search: both values are read again from dc2
+    conn = StubDC(moves=[1])
+    assert dc_state(conn) == {"dc": SERVICE.replace("DC1", "DC2"), "invocation_id": "ff", "usn": 900}
+    assert conn.searches == 4
+
+
+def test_dc_state_moving_server():
+    with pytest.raises(LDAPCommunicationError):
+        dc_state(StubDC(moves=[1, 3]))
+
+
+@pytest.fixture
+def delta(conn, tmp_path, monkeypatch):
+    """DeltaSearch on the mock directory, with the DC state in state (the mock has no rootDSE)"""
+    state = {"dc": SERVICE, "invocation_id": "0a0b", "usn": 100}
+    monkeypatch.setattr(msad.delta, "dc_state", lambda conn: dict(state))
+    for u in range(USERS):
+        conn.modify(user_dn(u), {"uSNChanged": [("MODIFY_REPLACE", [str(10 + u)])]})
+    state_file = tmp_path / "state.json"
+
+    def _run(limit=0):
+        search = DeltaSearch(conn, BASE, "(objectClass=user)", limit=limit, attributes=["distinguishedName"],
+                             domain="example", state_file=state_file)
+        dns = [entry["distinguishedName"] for entry in search]
+        return search, dns
+
+    return SimpleNamespace(run=_run, state=state, state_file=state_file)
+
+
+def _watermark(delta):
+    return load_state(delta.state_file)[f"example|{SERVICE.lower()}"]["usn"]
+
+
+def test_delta_search(conn, delta):
+    search, dns = delta.run()
+    assert (search.full, search.truncated, len(dns)) == (True, False, USERS)
+    assert _watermark(delta) == 100
+
+    conn.modify(user_dn(4), {"uSNChanged": [("MODIFY_REPLACE", ["150"])]})
+    conn.modify(user_dn(6), {"uSNChanged": [("MODIFY_REPLACE", ["101"])]})
+    delta.state["usn"] = 200
+    search, dns = delta.run()
+    assert (search.full, search.truncated) == (False, False)
+    assert sorted(dns) == [user_dn(4), user_dn(6)]
+    assert _watermark(delta) == 200
+
+    search, dns = delta.run()
+    assert (search.full, dns) == (False, [])
+
+
+def test_delta_search_truncated_by_limit(conn, delta):
+    delta.run()
+    for u in [4, 6]:
+        conn.modify(user_dn(u), {"uSNChanged": [("MODIFY_REPLACE", ["150"])]})
+    delta.state["usn"] = 200
+    search, dns = delta.run(limit=1)
+    assert (search.truncated, len(dns), search.count) == (True, 1, 1)
+    assert _watermark(delta) == 100
+    # exactly limit entries: complete
+    search, dns = delta.run(limit=2)
+    assert (search.truncated, len(dns)) == (False, 2)
+    assert _watermark(delta) == 200
+
+
+def test_delta_search_truncated_by_the_server(delta, monkeypatch):
+    delta.run()
+    search_entries = msad.delta.iter_search
+
+    def _truncated(*args, status, **kwargs):
+        yield from search_entries(*args, status=status, **kwargs)
+        status["truncated"] = True
+
+    monkeypatch.setattr(msad.delta, "iter_search", _truncated)
+    delta.state["usn"] = 300
+    search, _ = delta.run()
+    assert search.truncated
+    assert _watermark(delta) == 100
+
+
+def test_delta_search_restored_dc(delta):
+    delta.run()
+    delta.state.update(invocation_id="ffff", usn=50)
+    search, dns = delta.run()
+    assert (search.full, len(dns)) == (True, USERS)
+    assert _watermark(delta) == 50
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+import logging
+
+import pytest
+
+from msad import filters
+from msad.filters import (BIT_AND, BIT_OR, IN_CHAIN, FilterError, escape, like, matches, optimize,
+                          parse, prepare, scan_items, to_text)
+
+
+@pytest.mark.parametrize("value, escaped", [
+    ("plain", "plain"),
+    ("a*b", "a\\2ab"),
+    ("(x)", "\\28x\\29"),
+    ("back\\slash", "back\\5cslash"),
+    ("nul\0", "nul\\00"),
+    # the backslash is escaped first, not the ones added after
+    ("\\*", "\\5c\\2a"),
+    (b"\x01\xff", "\\01\\ff"),
+    (42, "42"),
+])
+def test_escape(value, escaped):
+    assert escape(value) == escaped
+
+
+@pytest.mark.parametrize("pattern, search_filter", [
+    ("*", "(cn=*)"),
+    ("matt*", "(cn=matt*)"),
+    ("*a(b)*", "(cn=*a\\28b\\29*)"),
+    ("no wildcard", "(cn=no wildcard)"),
+])
+def test_like(pattern, search_filter):
+    assert like("cn", pattern) == search_filter
+
+
+@pytest.mark.parametrize("text", [
+    "(cn=john)",
+    "(cn=*)",
+    "(cn=jo*h*n)",
+    "(cn=*ohn)",
+    "(cn=\\28john\\29)",
+    "(uSNChanged>=100)",
+    "(uSNChanged<=100)",
+    "(cn~=john)",
+    "(!(cn=john))",
+    "(&(cn=a)(|(sn=b)(sn=c)))",
+    f"(memberOf:{IN_CHAIN}:=cn=g1,dc=example,dc=com)",
+    f"(userAccountControl:{BIT_AND}:=2)",
+    "(cn:dn:2.5.13.5:=john)",
+    "(cn:dn:=john)",
+    "(:dn:2.5.13.5:=john)",
+    "(:2.5.13.5:=john)",
+    "(cn:=john)",
+])
+def test_parse_round_trip(text):
+    assert to_text(parse(text)) == text
+
+
+@pytest.mark.parametrize("text, op, attribute, value, rule, dn", [
+    ("cn=john", "eq", "cn", "john", None, False),
+    ("(cn=jo\\2an)", "eq", "cn", "jo*n", None, False),
+    ("(cn=a*\\28*)", "substring", "cn", ["a", "(", ""], None, False),
+    ("(cn:dn:2.5.13.5:=john)", "ext", "cn", "john", "2.5.13.5", True),
+    ("(cn:DN:=john)", "ext", "cn", "john", "", True),
+    ("(:dn:2.5.13.5:=john)", "ext", "", "john", "2.5.13.5", True),
+    ("(:2.5.13.5:=john)", "ext", "", "john", "2.5.13.5", False),
+])
+def test_parse(text, op, attribute, value, rule, dn):
+    node = parse(text)
+    assert (node.op, node.attribute, node.value, node.rule, node.dn) == (op, attribute, value, rule, dn)
+
+
+@pytest.mark.parametrize("text", [
+    "(cn=john",
+    "(&(cn=a)",
+    "(cn=a))",
+    "(cn)",
+    "(:=john)",
+    "(cn:a:b:=john)",
+    "(cn::=john)",
+    "(cn:dn>=1)",
+])
+def test_parse_errors(text):
+    with pytest.raises(FilterError):
+        parse(text)
+
+
+@pytest.mark.parametrize("text, simplified", [
+    ("(&(&(cn=a)(sn=b))(mail=c))", "(&(cn=a)(sn=b)(mail=c))"),
+    ("(|(cn=a)(|(cn=b)(cn=a)))", "(|(cn=a)(cn=b))"),
+    ("(&(objectClass=*)(cn=a))", "(cn=a)"),
+    ("(&(objectClass=*)(objectClass=*))", "(objectClass=*)"),
+    ("(|(objectClass=*)(cn=a))", "(|(objectClass=*)(cn=a))"),
+    ("(!(!(cn=a)))", "(cn=a)"),
+    ("(!(&(cn=a)))", "(!(cn=a))"),
+    ("(cn:=a\\2a)", "(cn=a\\2a)"),
+    ("(cn:dn:=a)", "(cn:dn:=a)"),
+    ("(&(cn=a)(cn=a))", "(cn=a)"),
+])
+def test_optimize(text, simplified):
+    assert optimize(text) == simplified
+
+
+@pytest.mark.parametrize("text, scans", [
+    ("(sAMAccountName=john)", []),
+    ("(sAMAccountName=jo*)", []),
+    ("(sAMAccountName=*hn)", ["(sAMAccountName=*hn)"]),
+    ("(description=x)", ["(description=x)"]),
+    ("(!(sAMAccountName=john))", ["(!(sAMAccountName=john))"]),
+    (f"(userAccountControl:{BIT_AND}:=2)", [f"(userAccountControl:{BIT_AND}:=2)"]),
+    (f"(objectClass:{BIT_OR}:=2)", [f"(objectClass:{BIT_OR}:=2)"]),
+    (f"(memberOf:{IN_CHAIN}:=cn=g)", []),
+    ("(cn:dn:=john)", ["(cn:dn:=john)"]),
+    # one indexed item is enough for and, every item is needed for or
+    ("(&(objectCategory=person)(!(cn=a))(description=x))", []),
+    ("(&(!(cn=a))(description=x))", ["(!(cn=a))", "(description=x)"]),
+    ("(|(cn=a)(description=x))", ["(description=x)"]),
+])
+def test_scan_items(text, scans):
+    assert scan_items(text) == scans
+
+
+def test_add_indexed():
+    assert scan_items("(employeeID=1)") == ["(employeeID=1)"]
+    filters.add_indexed("employeeID")
+    try:
+        assert scan_items("(employeeID=1)") == []
+    finally:
+        filters.INDEXED_ATTRIBUTES.discard("employeeid")
+        filters._prepare.cache_clear()
+
+
+def test_prepare(caplog):
+    filters._warn.cache_clear()
+    with caplog.at_level(logging.WARNING):
+        assert prepare("(&(description=a)(description=a))") == "(description=a)"
+        prepare("(&(description=a)(description=a))")
+    assert len([r for r in caplog.records if "full scan" in r.getMessage()]) == 1
+    assert prepare("(&(objectClass=*)(cn=a))") == "(cn=a)"
+    filters.set_strict(True)
+    with pytest.raises(FilterError, match="strict"):
+        prepare("(description=a)")
+    assert prepare("(cn=a)") == "(cn=a)"
+
+
+RECORD = {
+    "cn": ["John Smith"],
+    "objectCategory": "CN=Person,CN=Schema,CN=Configuration,DC=example,DC=com",
+    "userAccountControl": 514,
+    "pwdLastSet": datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+    "memberOf": ["cn=g1,dc=example,dc=com"],
+    "objectSid": b"\x01\x02",
+}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("(cn=john smith)", True),
+    ("(CN=John*)", True),
+    ("(cn=*smith)", True),
+    ("(cn=*oh*sm*)", True),
+    ("(cn=*x*)", False),
+    ("(cn=*)", True),
+    ("(mail=*)", False),
+    ("(objectCategory=person)", True),
+    ("(userAccountControl=514)", True),
+    (f"(userAccountControl:{BIT_AND}:=2)", True),
+    (f"(userAccountControl:{BIT_AND}:=3)", False),
+    (f"(userAccountControl:{BIT_OR}:=3)", True),
+    ("(userAccountControl>=512)", True),
+    ("(userAccountControl<=513)", False),
+    ("(pwdLastSet>=133485408000000000)", True),
+    ("(pwdLastSet<=133485407999999999)", False),
+    ("(objectSid=\\01\\02)", True),
+    ("(objectSid=0102)", False),
+    ("(&(cn=john*)(!(userAccountControl=512)))", True),
+    ("(|(cn=x)(memberOf=CN=G1,DC=example,DC=com))", True),
+    ("(cn:=John Smith)", True),
+])
+def test_matches(text, expected):
+    assert matches(parse(text), RECORD) is expected
+
+
+def test_matches_unsupported():
+    with pytest.raises(FilterError):
+        matches(parse(f"(memberOf:{IN_CHAIN}:=cn=g1)"), RECORD)
+    with pytest.raises(FilterError):
+        matches(parse("(cn:dn:=john)"), RECORD)
+    with pytest.raises(FilterError):
+        matches(parse("(cn:2.5.13.5:=john)"), RECORD)
+    in_chain = lambda attribute, value, record: value == "cn=g0"
+    assert matches(parse(f"(memberOf:{IN_CHAIN}:=cn=g0)"), RECORD, in_chain)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from msad.group import _dn_key, sync_members
+
+from conftest import BASE, Ranged, group_dn, user_dn
+
+
+def _members(conn, name):
+    conn.search(group_dn(name), "(objectClass=*)", search_scope="BASE", attributes=["member"])
+    return sorted(conn.response[0]["attributes"].get("member") or [])
+
+
+@pytest.fixture
+def ranged(conn):
+    return Ranged(conn, step=2)
+
+
+@pytest.mark.parametrize("a, b", [
+    (user_dn(1), user_dn(1).upper()),
+    ("cn=Smith\\, John,ou=users,dc=example,dc=com", "CN=smith\\2c john, OU=Users,DC=example,DC=com"),
+    ("cn=a\\+b,dc=example,dc=com", "cn=a\\2Bb,dc=example,dc=com"),
+    ("cn=caf\\c3\\a9,dc=example,dc=com", "cn=café,dc=example,dc=com"),
+])
+def test_dn_key(a, b):
+    assert _dn_key(a) == _dn_key(b)
+
+
+def test_sync_members(conn, ranged):
+    # g1 has user1, user3 and g2: keep user3 and g2 (given as a DN in other case), add user7 and user8
+    identities = ["user3", "USER7", group_dn("G2").upper(), user_dn(8), " ", "user3"]
+    result = sync_members(ranged, BASE, "g1", identities, chunk_size=1)
+    assert result["success"]
+    assert result["unresolved"] == []
+    assert sorted(result["added"]) == [user_dn(7), user_dn(8)]
+    assert result["removed"] == [user_dn(1)]
+    assert _members(conn, "g1") == sorted([user_dn(3), user_dn(7), user_dn(8), group_dn("g2")])
+
+
+def test_sync_members_no_changes(conn, ranged):
+    result = sync_members(ranged, BASE, "g1", [user_dn(1).upper(), "user3", "g2"])
+    assert (result["added"], result["removed"], result["success"]) == ([], [], True)
+
+
+def test_sync_members_escaped_dns(conn, ranged):
+    smith = "cn=Smith\\2c John,ou=users,dc=example,dc=com"
+    conn.strategy.add_entry(smith, {"objectClass": ["top", "user"], "sAMAccountName": "smith",
+                                    "distinguishedName": smith})
+    conn.modify(group_dn("g2"), {"member": [("MODIFY_ADD", [smith])]})
+    result = sync_members(ranged, BASE, "g2", [user_dn(5), "cn=smith\\, john,ou=users,dc=example,dc=com"])
+    assert (result["added"], result["removed"]) == ([], [])
+
+
+def test_sync_members_dry_run(conn, ranged):
+    result = sync_members(ranged, BASE, "g1", ["user2", "nobody"], dry_run=True)
+    assert result["added"] == [user_dn(2)]
+    assert sorted(result["removed"]) == sorted([user_dn(1), user_dn(3), group_dn("g2")])
+    assert result["unresolved"] == ["nobody"]
+    assert _members(conn, "g1") == sorted([user_dn(1), user_dn(3), group_dn("g2")])
+
+
+def test_sync_members_refusals(conn, ranged):
+    before = _members(conn, "g1")
+    # an empty input would remove every member
+    assert sync_members(ranged, BASE, "g1", []) is None
+    assert sync_members(ranged, BASE, "g1", ["", "  "]) is None
+    # an unresolved identity could be a current member
+    result = sync_members(ranged, BASE, "g1", ["user2", "nobody"])
+    assert (result["added"], result["removed"], result["unresolved"], result["success"]) == ([], [], ["nobody"], False)
+    assert sync_members(ranged, BASE, "missing", ["user2"]) is None
+    assert _members(conn, "g1") == before
+    result = sync_members(ranged, BASE, "g2", [], allow_empty=True)
+    assert result["removed"] == [user_dn(5)]
+    assert _members(conn, "g2") == []
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import io
+
+import pytest
+
+import msad.main
+
+from msad.lookup import HEADER_ATTRIBUTES, lookup
+
+from conftest import BASE, USERS, connect, user_dn
+
+
+# the first and the last rows are not found
+IDENTITIES = ["nobody"] + [
+    identity for u in reversed(range(1, USERS)) for identity in [f"user{u}", f"USER{u}@example.com"]
+] + ["", "none@example.com"]
+
+
+@pytest.mark.parametrize("batch_size, workers", [(1, 1), (3, 2), (7, 4), (1000, 2)])
+def test_lookup_keeps_the_order(factory, batch_size, workers):
+    unmatched = []
+    rows = list(lookup(factory, BASE, iter(IDENTITIES), attributes=["distinguishedName"],
+                       batch_size=batch_size, workers=workers, unmatched=unmatched))
+    assert [row["identity"] for row in rows] == IDENTITIES
+    found = [row.get("distinguishedName") for row in rows]
+    expected = [None] + [user_dn(u) for u in reversed(range(1, USERS)) for _ in range(2)] + [None, None]
+    assert found == expected
+    assert unmatched == ["nobody", "none@example.com"]
+    # the attributes matched locally are not added
+    assert all(set(row) <= {"identity", "distinguishedName"} for row in rows)
+
+
+def test_lookup_dict_rows(factory):
+    rows = [{"id": "user2", "note": "a"}, {"id": "x", "note": "b"}, {"id": "user4@example.com", "note": "c"}]
+    result = list(lookup(factory, BASE, rows, key="id", attributes=["cn"], batch_size=2))
+    assert result == [
+        {"id": "user2", "note": "a", "cn": "user2"},
+        {"id": "x", "note": "b"},
+        {"id": "user4@example.com", "note": "c", "cn": "user4"},
+    ]
+
+
+def test_lookup_csv_header(server, config_file, tmp_path, monkeypatch, capsys):
+    def _new_connection(config):
+        conn = connect(server)
+        conn.bind()
+        return conn
+
+    monkeypatch.setattr(msad.main, "_new_connection", _new_connection)
+    path = tmp_path / "identities.txt"
+    path.write_text("nobody\nuser1\n")
+    msad.main.app(args=["--no-cache", "lookup", "--file", str(path), "--out-format", "csv",
+                        "--config-file", config_file],
+                  prog_name="msad", standalone_mode=False)
+    rows = list(csv.reader(io.StringIO(capsys.readouterr().out)))
+    assert rows[0] == ["identity"] + HEADER_ATTRIBUTES
+    assert rows[1][0] == "nobody" and not any(rows[1][1:])
+    assert rows[2][:3] == ["user1", user_dn(1), "user1"]
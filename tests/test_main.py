@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+import msad.main
+
+from conftest import BASE
+
+
+def test_get_configs(config_file):
+    assert msad.main._get_configs(config_file)["example"]["search_base"] == BASE
+    assert msad.main._get_config(None, config_file)["domain"] == "example"
+
+
+@pytest.mark.parametrize("read", [
+    lambda path: msad.main._get_config(None, path),
+    lambda path: msad.main._get_configs(path),
+    lambda path: msad.main._get_domains_configs(None, True, path),
+])
+@pytest.mark.parametrize("name", ["missing.toml", "."])
+def test_missing_config_file(tmp_path, read, name):
+    with pytest.raises(SystemExit) as error:
+        read(str(tmp_path / name))
+    assert error.value.code == 1
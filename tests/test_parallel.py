@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from msad.parallel import iter_concurrently
+
+
+def test_task_failing_before_its_iterable():
+    def _fail():
+        raise RuntimeError("cannot connect")
+
+    with pytest.raises(RuntimeError, match="cannot connect"):
+        list(iter_concurrently([lambda: range(3), _fail], workers=2))
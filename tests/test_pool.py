@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import pytest
+
+from msad.pool import ConnectionPool
+from msad.search import get_dn
+
+from conftest import BASE, user_dn
+
+
+def test_callers_wait_for_a_free_connection(factory):
+    pool = ConnectionPool(factory, size=2)
+    results, errors = {}, []
+
+    def _call(u):
+        try:
+            with pool.connection() as conn:
+                time.sleep(0.05)
+                results[u] = get_dn(conn, BASE, f"user{u}")
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=_call, args=(u,)) for u in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+    assert errors == []
+    assert results == {u: user_dn(u) for u in range(6)}
+
+
+def test_acquire_timeout(factory):
+    pool = ConnectionPool(factory, size=1)
+    conn = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+    pool.release(conn)
+    pool.release(pool.acquire(timeout=0.05))
+    pool.close()
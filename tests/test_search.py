@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from types import SimpleNamespace
+
+import pytest
+
+from msad.search import iter_range
+
+from conftest import GROUPS, Ranged, group_dn
+
+DN = "cn=big,ou=groups,dc=example,dc=com"
+MEMBERS = [f"cn=user{i},ou=users,dc=example,dc=com" for i in range(2000)]
+
+
+class StubConnection:
+    """Answers member;range=low-* like AD with a MaxValRange of 1500, recording the searches"""
+
+    strategy = SimpleNamespace(sync=True, thread_safe=False)
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.auto_range = True
+        self.empty_attributes = True
+        self.requests = []
+
+    def search(self, search_base, search_filter, search_scope, attributes):
+        # the options of the connection while ranges are read
+        self.requests.append((attributes, self.auto_range, self.empty_attributes))
+        name = self.ranges.get(attributes[0])
+        if name is None:
+            self.response = []
+        else:
+            low, _, high = (name.partition(";range=")[2] or "0-*").partition("-")
+            end = len(MEMBERS) if high == "*" else int(high) + 1
+            self.response = [{"dn": search_base, "attributes": {name: MEMBERS[int(low):end]}}]
+        self.result = {"result": 0}
+        return True
+
+
+RANGES = {
+    "member;range=0-*": "member;range=0-1499",
+    "member;range=1500-*": "member;range=1500-*",
+}
+
+
+def test_iter_range():
+    conn = StubConnection(RANGES)
+    assert list(iter_range(conn, DN, "member")) == MEMBERS
+    assert conn.requests == [
+        (["member;range=0-*"], False, False),
+        (["member;range=1500-*"], False, False),
+    ]
+    assert (conn.auto_range, conn.empty_attributes) == (True, True)
+
+
+@pytest.mark.parametrize("ranges, count, searches", [
+    # the whole attribute returned without range
+    ({"member;range=0-*": "member"}, 2000, 1),
+    # an entry without the attribute
+    ({"member;range=0-*": "description"}, 0, 1),
+    # the entry is not found
+    ({}, 0, 1),
+])
+def test_iter_range_ends(ranges, count, searches):
+    conn = StubConnection(ranges)
+    assert len(list(iter_range(conn, DN, "member"))) == count
+    assert len(conn.requests) == searches
+
+
+def test_iter_range_restores_the_connection():
+    conn = StubConnection(RANGES)
+    values = iter_range(conn, DN, "member")
+    next(values)
+    values.close()
+    assert (conn.auto_range, conn.empty_attributes) == (True, True)
+
+
+def test_iter_range_on_mock(conn):
+    ranged = Ranged(conn, step=1)
+    assert list(iter_range(ranged, group_dn("g1"), "member")) == GROUPS["g1"]
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sqlite3
+
+import pytest
+
+from msad.filters import parse
+from msad.snapshot import Snapshot, create_snapshot
+
+from conftest import BASE, group_dn, user_dn
+
+
+@pytest.fixture
+def snapshot(conn, tmp_path):
+    path = tmp_path / "snapshot.sqlite"
+    create_snapshot(conn, BASE, path, page_size=7)
+    return Snapshot(path)
+
+
+def _live(conn, search_filter):
+    conn.search(BASE, search_filter, attributes=["cn"])
+    return sorted(r["dn"].lower() for r in conn.response)
+
+
+def _offline(snapshot, search_filter, **kwargs):
+    return sorted(e["dn"].lower() for e in snapshot.iter_entries(BASE, search_filter, **kwargs))
+
+
+@pytest.mark.parametrize("search_filter", [
+    "(sAMAccountName=user1)",
+    "(SAMACCOUNTNAME=USER1)",
+    "(cn=user1*)",
+    "(mail=*)",
+    f"(memberOf={group_dn('g1')})",
+    "(&(objectClass=user)(userAccountControl=514))",
+    "(|(sAMAccountName=user2)(mail=user3@example.com))",
+    "(&(objectClass=group)(cn=g*))",
+    "(&(objectClass=*)(!(objectClass=user)))",
+])
+def test_iter_entries_like_a_live_search(conn, snapshot, search_filter):
+    assert _offline(snapshot, search_filter) == _live(conn, search_filter)
+
+
+def test_in_chain(snapshot):
+    # g1 has user1, user3 and g2, g2 has user5
+    members = _offline(snapshot, f"(memberOf:1.2.840.113556.1.4.1941:={group_dn('g1')})")
+    assert members == sorted([user_dn(1), user_dn(3), user_dn(5), group_dn("g2")])
+    groups = _offline(snapshot, f"(member:1.2.840.113556.1.4.1941:={user_dn(5)})")
+    assert groups == sorted([group_dn("g1"), group_dn("g2")])
+    # the same, filtered locally with the recursive queries
+    members = _offline(snapshot, f"(&(objectClass=user)(memberOf:1.2.840.113556.1.4.1941:={group_dn('g1')}))")
+    assert members == sorted([user_dn(1), user_dn(3), user_dn(5)])
+
+
+def test_limit_attributes_and_scope(snapshot):
+    entries = list(snapshot.iter_entries(BASE, "(objectClass=user)", limit=3, attributes=["sAMAccountName"]))
+    assert len(entries) == 3
+    assert all(list(e["attributes"]) == ["sAMAccountName"] for e in entries)
+    assert _offline(snapshot, "(objectClass=*)", search_scope="BASE") == [BASE]
+    assert len(_offline(snapshot, "(objectClass=*)", search_scope="LEVEL")) == 2
+
+
+@pytest.mark.parametrize("search_filter, sql", [
+    ("(sAMAccountName=User1)", ("samaccountname = ?", ["user1"])),
+    ("(cn=us_r*)", ("cn LIKE ? ESCAPE '\\'", ["us\\_r%"])),
+    ("(cn=*1)", None),
+    ("(description=x)", None),
+    ("(&(description=x)(mail=a@b))", ("(mail = ?)", ["a@b"])),
+    ("(|(description=x)(mail=a@b))", None),
+    (f"(memberOf={group_dn('G1')})", ("id IN (SELECT entry_id FROM member_of WHERE group_dn = ?)", [group_dn("g1")])),
+])
+def test_candidates(snapshot, search_filter, sql):
+    assert snapshot._candidates(parse(search_filter)) == sql
+
+
+def test_old_format(snapshot):
+    snapshot.db.close()
+    db = sqlite3.connect(snapshot.path)
+    db.execute("DELETE FROM meta WHERE key = 'format'")
+    db.commit()
+    with pytest.raises(ValueError):
+        Snapshot(snapshot.path)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+# msad - Active Directory tool
+# Copyright (C) 2025 - matteo.redaelli@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import sys
+
+import typer.main
+
+import msad
+
+from msad.main import app
+from msad.usage import HELP, format_help
+
+
+def test_help_is_up_to_date():
+    # on failure, paste the output of format_help into usage.HELP
+    assert format_help(typer.main.get_command(app)) == HELP
+
+
+def test_help_without_typer():
+    code = "import runpy, sys; runpy.run_module('msad', run_name='__main__'); print(sorted(m for m in ('typer', 'click', 'ldap3') if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(msad.__file__)))
+    for argv, output in [(["--help"], HELP), (["get-sample-config"], "[defaults]")]:
+        run = subprocess.run([sys.executable, "-c", code, *argv], capture_output=True, text=True, check=True, env=env)
+        assert output in run.stdout
+        assert run.stdout.endswith("[]\n")